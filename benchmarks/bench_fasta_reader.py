@@ -0,0 +1,121 @@
+"""
+Throughput benchmark of the FASTA record parser used by the import format.
+
+Compares memetools.fasta.FastaReader with the line-by-line loop the
+FastaFormatExtractor used before it was rewritten, on a synthetic FASTA file.
+
+Usage: python benchmarks/bench_fasta_reader.py [--size-mb 256] [--line-width 60]
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python-lib'))
+
+from memetools.fasta import FastaReader  # noqa: E402
+
+
+class LegacyLineExtractor(object):
+    """The previous FastaFormatExtractor.read_row loop, kept verbatim for comparison."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def read_row(self):
+        sequence_id = None
+        sequence = []
+        comment = ''
+
+        for line in self.stream:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+
+            line = line.strip()
+            if line.startswith('>'):
+                if sequence_id is not None:
+                    return {
+                        'ID': sequence_id,
+                        'Comment': comment,
+                        'Sequence': ''.join(sequence)
+                    }
+                parts = line[1:].split(maxsplit=1)
+                sequence_id = parts[0]
+                comment = parts[1] if len(parts) > 1 else ''
+                sequence = []
+            else:
+                sequence.append(line)
+
+        if sequence_id is not None:
+            return {
+                'ID': sequence_id,
+                'Comment': comment,
+                'Sequence': ''.join(sequence)
+            }
+        return None
+
+
+def generate_fasta(size_bytes, line_width, seed=0):
+    """Build an in-memory FASTA file of roughly size_bytes with wrapped sequences."""
+    rng = random.Random(seed)
+    # Reuse a pool of random sequences, generating residues one by one is slow
+    pool = [''.join(rng.choice('ACGT') for _ in range(rng.randint(50, 2000))) for _ in range(256)]
+    out = io.BytesIO()
+    index = 0
+    while out.tell() < size_bytes:
+        sequence = pool[index % len(pool)]
+        lines = '\n'.join(sequence[i:i + line_width] for i in range(0, len(sequence), line_width))
+        out.write(f">seq{index} sample=S{index % 17}\n{lines}\n".encode('ascii'))
+        index += 1
+    return out.getvalue()
+
+
+def run_legacy(data):
+    extractor = LegacyLineExtractor(io.BytesIO(data))
+    rows = 0
+    while extractor.read_row() is not None:
+        rows += 1
+    return rows
+
+
+def run_reader(data):
+    reader = FastaReader(io.BytesIO(data))
+    rows = 0
+    while reader.read_record() is not None:
+        rows += 1
+    return rows
+
+
+def measure(name, func, data, repeat):
+    best = None
+    rows = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = func(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    mb_per_s = len(data) / (1024 * 1024) / best
+    print(f"{name:<12} {rows:>10} records  {best:8.3f} s  {mb_per_s:10.1f} MB/s")
+    return mb_per_s
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--line-width', type=int, default=60)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    data = generate_fasta(args.size_mb * 1024 * 1024, args.line_width)
+    print(f"Synthetic FASTA: {len(data) / (1024 * 1024):.1f} MB, line width {args.line_width}")
+    # The legacy loop swallows the header following each returned record,
+    # so it reports roughly half of the records
+    legacy = measure('legacy', run_legacy, data, args.repeat)
+    reader = measure('FastaReader', run_reader, data, args.repeat)
+    print(f"Speed-up: {reader / legacy:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
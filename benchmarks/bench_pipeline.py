@@ -0,0 +1,235 @@
+"""
+End-to-end benchmark of the plugin components on a synthetic partition.
+
+Generates a dataset of DNA sequences spread over samples whose sizes follow
+a power law (--skew 0 for equal samples), then runs in order:
+
+    exporter         the FASTA exporter, writing the dataset rows to a FASTA file
+    format           the FASTA format extractor, reading that file back
+    extract-to-fasta the recipe splitting the dataset into one FASTA file per sample
+    meme-streme-tool the STREME recipe on every sample
+    meme-fimo-tool   the FIMO recipe on every pair of samples
+
+against a local stand-in of the dataiku package (benchmarks/localdss, folders
+are local directories, datasets CSV files) and fake streme and fimo
+executables (benchmarks/fakememe) that sleep in proportion to their input and
+write realistic output files. Wall time and throughput of every stage are
+printed and saved as JSON, to compare runs across changes.
+
+Usage: python benchmarks/bench_pipeline.py [--samples 8] [--sequences 2000] [--length 300] [--skew 1.0]
+                                            [--workers 4] [--remote-folders] [--compression gzip] [--collapse-duplicates]
+                                            [--output results.json]
+"""
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import platform
+import random
+import runpy
+import shutil
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'python-lib'))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, 'localdss'))
+
+import dataiku  # noqa: E402
+from dataiku import customrecipe  # noqa: E402
+
+MB = 1024 * 1024
+PARTITION = 'P1'
+FAKE_STREME = os.path.join(BENCHMARKS_DIR, 'fakememe', 'streme')
+FAKE_FIMO = os.path.join(BENCHMARKS_DIR, 'fakememe', 'fimo')
+
+
+def sample_sizes(samples, sequences, skew):
+    """Number of sequences of every sample, proportional to (rank + 1) ** -skew, averaging `sequences`."""
+    weights = [(rank + 1) ** -skew for rank in range(samples)]
+    scale = samples * sequences / sum(weights)
+    return [max(1, int(round(weight * scale))) for weight in weights]
+
+
+def generate_dataset(path, sizes, length, seed=0):
+    """Write a CSV dataset of sample_id, ID and Sequence columns, returns its number of rows."""
+    rng = random.Random(seed)
+    # Reuse a pool of random sequences, generating residues one by one is slow
+    pool = [''.join(rng.choice('ACGT') for _ in range(rng.randint(length // 2, length * 3 // 2))) for _ in range(512)]
+    rows = 0
+    with open(path, 'w') as f:
+        f.write('sample_id,ID,Sequence\n')
+        for sample_index, size in enumerate(sizes):
+            for index in range(size):
+                f.write(f"S{sample_index:03d},S{sample_index:03d}_seq{index},{pool[rng.randrange(len(pool))]}\n")
+                rows += 1
+    return rows
+
+
+def load_component(relative_path):
+    """Import a plugin component file, whose directory names are not valid package names."""
+    path = os.path.join(ROOT_DIR, relative_path)
+    spec = importlib.util.spec_from_file_location(os.path.basename(os.path.dirname(path)).replace('-', '_'), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_recipe(name, inputs, outputs, config):
+    """Run a recipe script with its roles and parameters, the way DSS runs it for one partition."""
+    customrecipe.configure(inputs, outputs, config)
+    dataiku.dku_flow_variables.clear()
+    dataiku.dku_flow_variables['DKU_DST_sample'] = PARTITION
+    runpy.run_path(os.path.join(ROOT_DIR, 'custom-recipes', name, 'recipe.py'), run_name='__main__')
+
+
+def directory_stats(path, exclude=None):
+    """(number of files, total bytes) under a directory."""
+    files, size = 0, 0
+    for root, _, file_names in os.walk(path):
+        for file_name in file_names:
+            if exclude is not None and exclude(file_name):
+                continue
+            files += 1
+            size += os.path.getsize(os.path.join(root, file_name))
+    return files, size
+
+
+def stage_result(seconds, input_bytes, records=None, output_dir=None):
+    result = {'seconds': round(seconds, 4), 'input_bytes': input_bytes,
+              'input_mb_per_s': round(input_bytes / MB / seconds, 3) if seconds > 0 else None}
+    if records is not None:
+        result['records'] = records
+        result['records_per_s'] = round(records / seconds, 1) if seconds > 0 else None
+    if output_dir is not None:
+        result['output_files'], result['output_bytes'] = directory_stats(output_dir)
+    return result
+
+
+def bench_exporter(dataset_path, fasta_path, compression):
+    exporter_module = load_component('python-exporters/export-as-fasta/exporter.py')
+    dataset = dataiku.Dataset('sequences')
+    frame = dataset.get_dataframe(columns=['ID', 'Sequence'])
+    rows = list(frame.itertuples(index=False, name=None))
+    schema = {'columns': [{'name': 'ID', 'type': 'string'}, {'name': 'Sequence', 'type': 'string'}]}
+    exporter = exporter_module.FastaExporter({'id_column': 'ID', 'sequence_column': 'Sequence',
+                                              'compression': compression}, {})
+    start = time.perf_counter()
+    exporter.open_to_file(schema, fasta_path)
+    for row in rows:
+        exporter.write_row(row)
+    exporter.close()
+    return stage_result(time.perf_counter() - start, os.path.getsize(dataset_path), records=len(rows))
+
+
+def bench_format(fasta_path):
+    format_module = load_component('python-formats/import-fasta-format/format.py')
+    formatter = format_module.FastaFormatter({}, {})
+    records = 0
+    start = time.perf_counter()
+    with open(fasta_path, 'rb') as stream:
+        extractor = formatter.get_format_extractor(stream)
+        while extractor.read_row() is not None:
+            records += 1
+    return stage_result(time.perf_counter() - start, os.path.getsize(fasta_path), records=records)
+
+
+def bench_recipe(name, inputs, outputs, config, input_bytes, output_dir):
+    start = time.perf_counter()
+    run_recipe(name, inputs, outputs, config)
+    return stage_result(time.perf_counter() - start, input_bytes, output_dir=output_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, default=8)
+    parser.add_argument('--sequences', type=int, default=2000, help='average number of sequences per sample')
+    parser.add_argument('--length', type=int, default=300, help='average sequence length')
+    parser.add_argument('--skew', type=float, default=1.0, help='power law exponent of the sample sizes')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--transfer-workers', type=int, default=4)
+    parser.add_argument('--remote-folders', action='store_true',
+                        help='hide the folder paths, so files go through the transfer streams')
+    parser.add_argument('--fimo-batch', action='store_true', help='run FIMO in batch mode')
+    parser.add_argument('--output-profile', choices=['full', 'minimal'], default='full')
+    parser.add_argument('--compression', choices=['none', 'gzip', 'bgzf', 'zstd'], default='none',
+                        help='compression of the exported and extracted FASTA files')
+    parser.add_argument('--collapse-duplicates', action='store_true',
+                        help='collapse identical sequences before STREME, samples draw from 512 distinct sequences')
+    parser.add_argument('--max-sequences', type=int, default=0, help='distinct sequences kept per sample when collapsing')
+    parser.add_argument('--streme-seconds-per-mb', type=float, default=1.0)
+    parser.add_argument('--fimo-seconds-per-mb', type=float, default=0.02)
+    parser.add_argument('--startup-seconds', type=float, default=0.05)
+    parser.add_argument('--work-dir', help='directory for the generated data, a temporary one by default')
+    parser.add_argument('--keep', action='store_true', help='keep the generated data')
+    parser.add_argument('--output', help='JSON file receiving the results')
+    parser.add_argument('--verbose', action='store_true', help='show the recipe logs')
+    args = parser.parse_args()
+
+    log_level = 'INFO' if args.verbose else 'WARNING'
+    logging.basicConfig(level=getattr(logging, log_level), format='%(asctime)s - %(levelname)s - %(message)s')
+    os.environ['FAKEMEME_STREME_SECONDS_PER_MB'] = str(args.streme_seconds_per_mb)
+    os.environ['FAKEMEME_FIMO_SECONDS_PER_MB'] = str(args.fimo_seconds_per_mb)
+    os.environ['FAKEMEME_STARTUP_SECONDS'] = str(args.startup_seconds)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='memetools_bench_')
+    os.makedirs(work_dir, exist_ok=True)
+    folders = {name: os.path.join(work_dir, name) for name in ('fasta', 'streme', 'fimo')}
+    for name, root in folders.items():
+        shutil.rmtree(root, ignore_errors=True)
+        dataiku.register_folder(name, root, remote=args.remote_folders)
+    dataset_path = os.path.join(work_dir, 'sequences.csv')
+    dataiku.register_dataset('sequences', dataset_path)
+
+    sizes = sample_sizes(args.samples, args.sequences, args.skew)
+    rows = generate_dataset(dataset_path, sizes, args.length)
+    print(f"{args.samples} samples, {rows} sequences ({min(sizes)} to {max(sizes)} per sample), "
+          f"{os.path.getsize(dataset_path) / MB:.1f} MB dataset in {work_dir}")
+
+    stages = {}
+    fasta_path = os.path.join(work_dir, 'export.fasta')
+    stages['exporter'] = bench_exporter(dataset_path, fasta_path, args.compression)
+    stages['format'] = bench_format(fasta_path)
+    common = {'max_workers': args.workers, 'transfer_workers': args.transfer_workers, 'logging_level': log_level}
+    stages['extract-to-fasta'] = bench_recipe(
+        'extract-to-fasta', {'input_dataset': ['sequences']}, {'fasta_output': ['fasta']},
+        dict(common, id_column='ID', sequence_column='Sequence', compression=args.compression), os.path.getsize(dataset_path), folders['fasta'])
+    stages['meme-streme-tool'] = bench_recipe(
+        'meme-streme-tool', {'input_fasta': ['fasta']}, {'streme_output': ['streme']},
+        dict(common, streme_exec_path=FAKE_STREME, streme_options={'minw': '6', 'maxw': '12'},
+             output_profile=args.output_profile, resume=False, collapse_duplicates=args.collapse_duplicates,
+             max_sequences=args.max_sequences), directory_stats(folders['fasta'])[1], folders['streme'])
+    stages['meme-fimo-tool'] = bench_recipe(
+        'meme-fimo-tool', {'input_fasta': ['fasta'], 'input_streme': ['streme']}, {'fimo_output': ['fimo']},
+        dict(common, fimo_exec_path=FAKE_FIMO, fimo_options={'thresh': '1e-4'}, batch_mode=args.fimo_batch,
+             output_profile=args.output_profile),
+        directory_stats(folders['fasta'])[1] + directory_stats(folders['streme'])[1], folders['fimo'])
+
+    print(f"{'stage':<18} {'seconds':>9} {'MB/s':>9} {'records/s':>11} {'files out':>10}")
+    for name, result in stages.items():
+        records_per_s = f"{result['records_per_s']:.0f}" if result.get('records_per_s') else ''
+        print(f"{name:<18} {result['seconds']:9.3f} {result['input_mb_per_s'] or 0:9.2f} "
+              f"{records_per_s:>11} {result.get('output_files', ''):>10}")
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'work_dir')},
+        'sample_sizes': sizes,
+        'stages': stages,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.output}")
+    if not args.keep and not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Makespan benchmark of the PipelinedExecutor scheduling on a skewed partition.
+
+Runs sleep jobs whose duration follows their simulated input size, with a few
+huge samples listed last (the os.walk order worst case), first in submission
+order and then ordered and admitted with memetools.scheduler cost estimates.
+
+Usage: python benchmarks/bench_scheduler.py [--workers 4] [--small 24] [--large 2]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python-lib'))
+
+from memetools.pipeline import PipelinedExecutor  # noqa: E402
+from memetools.scheduler import streme_cost  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def run_job(job):
+    """Sleep for the simulated run time of a sample, 10 ms per MB."""
+    time.sleep(job[1] / MB * 0.01)
+    return job
+
+
+def measure(name, jobs, workers, cost=None, memory_budget=None):
+    start = time.perf_counter()
+    PipelinedExecutor(run_job, max_workers=workers, max_in_flight=len(jobs), cost=cost,
+                      memory_budget=memory_budget).run(jobs)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<22} {elapsed:8.2f} s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--small', type=int, default=24)
+    parser.add_argument('--large', type=int, default=2)
+    args = parser.parse_args()
+
+    jobs = [(f"small_{index}", 20 * MB) for index in range(args.small)]
+    jobs += [(f"large_{index}", 200 * MB) for index in range(args.large)]
+    seconds = [size / MB * 0.01 for _, size in jobs]
+    ideal = max(sum(seconds) / args.workers, max(seconds))
+    print(f"{args.small} small and {args.large} large jobs on {args.workers} workers, ideal makespan {ideal:.2f} s")
+    fifo = measure('submission order', jobs, args.workers)
+    scheduled = measure('longest first', jobs, args.workers, cost=lambda job: streme_cost(job[1]))
+    print(f"Makespan reduction: {(1 - scheduled / fifo) * 100:.0f}%")
+
+
+if __name__ == '__main__':
+    main()
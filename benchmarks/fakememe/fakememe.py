@@ -0,0 +1,243 @@
+"""
+Fake STREME and FIMO executables for the benchmarks.
+
+They take the same command lines as the MEME suite tools, sleep for a time
+that grows with their input like the real tools, and write output files of
+the same names, formats and rough sizes: motifs in MEME text format for
+STREME, hits in FIMO's TSV format for FIMO, along with html, xml and gff
+files. Results are deterministic for a given input.
+
+Run time model, in seconds, tunable through the environment:
+    FAKEMEME_STARTUP_SECONDS (0.05) + input MB * FAKEMEME_STREME_SECONDS_PER_MB (1.0)
+    FAKEMEME_STARTUP_SECONDS (0.05) + input MB * motifs * FAKEMEME_FIMO_SECONDS_PER_MB (0.02)
+"""
+import hashlib
+import os
+import random
+import sys
+import time
+
+VERSION = '5.5.5'
+ALPHABET = 'ACGT'
+COMPLEMENT = str.maketrans('ACGTN', 'TGCAN')
+MB = 1024 * 1024
+FIMO_COLUMNS = ['motif_id', 'motif_alt_id', 'sequence_name', 'start', 'stop', 'strand', 'score', 'p-value',
+                'q-value', 'matched_sequence']
+# Hits per strand and motif per 10 kb of sequence at the default threshold
+HIT_RATE = 1.0
+
+
+def env_float(name, default):
+    return float(os.environ.get(name, default))
+
+
+def parse_options(args):
+    """{option: value} of `--option value` and `--flag` arguments, and the remaining positional arguments."""
+    options = {}
+    positional = []
+    index = 0
+    while index < len(args):
+        arg = args[index]
+        if arg.startswith('--'):
+            if index + 1 < len(args) and not args[index + 1].startswith('--'):
+                options[arg[2:]] = args[index + 1]
+                index += 2
+                continue
+            options[arg[2:]] = 'true'
+        else:
+            positional.append(arg)
+        index += 1
+    return options, positional
+
+
+def read_fasta(path):
+    """(name, sequence) records of a FASTA file."""
+    records = []
+    name, chunks = None, []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('>'):
+                if name is not None:
+                    records.append((name, ''.join(chunks)))
+                name, chunks = line[1:].split(maxsplit=1)[0] if len(line) > 1 else '', []
+            elif line:
+                chunks.append(line.upper())
+    if name is not None:
+        records.append((name, ''.join(chunks)))
+    return records
+
+
+def file_seed(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(MB), b''):
+            digest.update(block)
+    return int(digest.hexdigest()[:16], 16)
+
+
+def simulate(seconds):
+    time.sleep(max(0.0, seconds))
+
+
+def meme_text(motifs, frequencies):
+    lines = [f"MEME version {VERSION}", '', f"ALPHABET= {ALPHABET}", '', 'strands: + -', '',
+             'Background letter frequencies',
+             ' '.join(f"{letter} {frequencies[letter]:.3f}" for letter in ALPHABET), '']
+    for motif_id, alt_id, matrix, nsites, evalue in motifs:
+        lines.append(f"MOTIF {motif_id} {alt_id}")
+        lines.append(f"letter-probability matrix: alength= 4 w= {len(matrix)} nsites= {nsites} E= {evalue:.1e}")
+        lines.extend(' ' + ' '.join(f"{p:.6f}" for p in row) for row in matrix)
+        lines.append('')
+    return '\n'.join(lines) + '\n'
+
+
+def filler(name, text, size):
+    """A markup file embedding text, padded to roughly `size` bytes like the real reports."""
+    padding = max(0, size - len(text))
+    return f"<!-- {name} -->\n<pre>\n{text}</pre>\n<!-- {'.' * padding} -->\n"
+
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def streme(args):
+    options, _ = parse_options(args)
+    if 'version' in options:
+        print(VERSION)
+        return 0
+    fasta_path = options['p']
+    output_dir = options.get('oc') or options.get('o') or 'streme_out'
+    size = os.path.getsize(fasta_path)
+    records = read_fasta(fasta_path)
+    rng = random.Random(file_seed(fasta_path))
+    sequence = ''.join(sequence for _, sequence in records) or ALPHABET
+    frequencies = {letter: (sequence.count(letter) + 1) / (len(sequence) + 4) for letter in ALPHABET}
+
+    motifs = []
+    minw, maxw = int(options.get('minw', 8)), int(options.get('maxw', 15))
+    for index in range(int(options.get('nmotifs', 5))):
+        width = rng.randint(minw, max(minw, maxw))
+        start = rng.randrange(max(1, len(sequence) - width))
+        consensus = sequence[start:start + width].ljust(width, 'A')
+        matrix = [[0.85 if letter == base else 0.05 for letter in ALPHABET] for base in consensus]
+        motifs.append((f"{index + 1}-{consensus}", f"STREME-{index + 1}", matrix, rng.randint(10, 500),
+                       10 ** -rng.uniform(1, 20)))
+    simulate(env_float('FAKEMEME_STARTUP_SECONDS', 0.05) + size / MB * env_float('FAKEMEME_STREME_SECONDS_PER_MB', 1.0))
+
+    text = meme_text(motifs, frequencies)
+    if options.get('text') == 'true':
+        sys.stdout.write(text)
+        return 0
+    os.makedirs(output_dir, exist_ok=True)
+    write(os.path.join(output_dir, 'streme.txt'), text)
+    write(os.path.join(output_dir, 'streme.html'), filler('streme.html', text, 150000))
+    write(os.path.join(output_dir, 'streme.xml'), filler('streme.xml', text, 40000))
+    write(os.path.join(output_dir, 'sequences.tsv'), 'motif_id\tmotif_alt_id\tseq_id\tseq_score\tseq_class\n' + ''.join(
+        f"{motifs[i % len(motifs)][0]}\t{motifs[i % len(motifs)][1]}\t{name}\t{rng.uniform(5, 20):.2f}\ttp\n"
+        for i, (name, _) in enumerate(records[:2000])) if motifs else '')
+    write(os.path.join(output_dir, 'site_distr.txt'), '# site distribution\n' + ''.join(
+        f"{motif[0]}\t{rng.randint(0, 100)}\n" for motif in motifs))
+    return 0
+
+
+def read_meme_motifs(path):
+    """(motif_id, alt_id, consensus) of the motifs of a MEME text file."""
+    motifs = []
+    with open(path) as f:
+        lines = f.read().splitlines()
+    motif_id, alt_id = None, ''
+    index = 0
+    while index < len(lines):
+        line = lines[index].strip()
+        if line.startswith('MOTIF'):
+            fields = line.split()
+            motif_id, alt_id = fields[1], fields[2] if len(fields) > 2 else ''
+        elif line.startswith('letter-probability matrix'):
+            width = int(line.split('w=')[1].split()[0])
+            consensus = ''
+            while len(consensus) < width:
+                index += 1
+                values = [float(value) for value in lines[index].split()]
+                if values:
+                    consensus += ALPHABET[values.index(max(values))]
+            motifs.append((motif_id, alt_id, consensus))
+        index += 1
+    return motifs
+
+
+def fimo(args):
+    options, positional = parse_options(args)
+    if 'version' in options:
+        print(VERSION)
+        return 0
+    motif_path, fasta_path = positional[-2], positional[-1]
+    output_dir = options.get('oc') or options.get('o') or 'fimo_out'
+    threshold = float(options.get('thresh', 1e-4))
+    max_stored = int(options.get('max-stored-scores', 100000))
+    both_strands = options.get('norc') != 'true'
+    text_mode = options.get('text') == 'true'
+
+    motifs = read_meme_motifs(motif_path)
+    records = read_fasta(fasta_path)
+    size = os.path.getsize(fasta_path)
+    rng = random.Random(file_seed(motif_path) ^ file_seed(fasta_path))
+    simulate(env_float('FAKEMEME_STARTUP_SECONDS', 0.05)
+             + size / MB * max(1, len(motifs)) * env_float('FAKEMEME_FIMO_SECONDS_PER_MB', 0.02))
+
+    # Fewer hits at stricter thresholds, as many as a real scan at the default one
+    rate = HIT_RATE * threshold / 1e-4 / 10000
+    hits = []
+    for motif_id, alt_id, consensus in motifs:
+        width = len(consensus)
+        for name, sequence in records:
+            if len(sequence) < width:
+                continue
+            expected = rate * (len(sequence) - width + 1) * (2 if both_strands else 1)
+            count = int(expected) + (1 if rng.random() < expected - int(expected) else 0)
+            for _ in range(count):
+                start = rng.randrange(len(sequence) - width + 1)
+                strand = '-' if both_strands and rng.random() < 0.5 else '+'
+                score = rng.uniform(8, 22)
+                pvalue = min(threshold, 10 ** -(score / 4 + 1.5))
+                matched = sequence[start:start + width]
+                if strand == '-':
+                    matched = matched[::-1].translate(COMPLEMENT)
+                hits.append([motif_id, alt_id, name, start + 1, start + width, strand, score, pvalue, matched])
+    hits.sort(key=lambda hit: hit[7])
+    hits = hits[:max_stored]
+    for rank, hit in enumerate(hits, start=1):
+        hit.insert(8, '' if text_mode else f"{min(1.0, hit[7] * len(hits) / rank):.3g}")
+
+    rows = ''.join('\t'.join([hit[0], hit[1], hit[2], str(hit[3]), str(hit[4]), hit[5], f"{hit[6]:.5g}",
+                              f"{hit[7]:.3g}", hit[8], hit[9]]) + '\n' for hit in hits)
+    tsv = '\t'.join(FIMO_COLUMNS) + '\n' + rows
+    if text_mode:
+        sys.stdout.write(tsv)
+        return 0
+    command = ' '.join(['fimo'] + args)
+    tsv += f"\n# FIMO (Find Individual Motif Occurrences): Version {VERSION}\n# The format of this file is described at https://meme-suite.org/meme/doc/fimo-output-format.html.\n# {command}\n"
+    os.makedirs(output_dir, exist_ok=True)
+    write(os.path.join(output_dir, 'fimo.tsv'), tsv)
+    write(os.path.join(output_dir, 'fimo.gff'), '##gff-version 3\n' + ''.join(
+        f"{hit[2]}\tfimo\tnucleotide_motif\t{hit[3]}\t{hit[4]}\t{hit[6]:.1f}\t{hit[5]}\t.\tName={hit[0]};pvalue={hit[7]:.3g}\n"
+        for hit in hits))
+    write(os.path.join(output_dir, 'fimo.xml'), filler('fimo.xml', '', 8000 + 60 * len(motifs)))
+    write(os.path.join(output_dir, 'cisml.xml'), filler('cisml.xml', rows, int(len(rows) * 2.5)))
+    write(os.path.join(output_dir, 'fimo.html'), filler('fimo.html', rows[:50000], 120000))
+    return 0
+
+
+def main(tool):
+    args = sys.argv[1:]
+    try:
+        return streme(args) if tool == 'streme' else fimo(args)
+    except (IndexError, KeyError, OSError, ValueError) as e:
+        sys.stderr.write(f"{tool}: {e}\n")
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(os.path.basename(sys.argv[0])))
@@ -0,0 +1,108 @@
+"""
+Local stand-in for the parts of the dataiku package used by the plugin.
+
+Managed folders are directories and datasets are CSV files, both under
+directories registered by the benchmark harness. Only meant to run the
+plugin components outside of DSS, in the benchmarks.
+"""
+import json
+import os
+
+import pandas as pd
+
+from memetools.localfolder import LocalFolder
+
+# Flow variables of the running recipe, DKU_DST_<dimension> holds the output partition
+dku_flow_variables = {}
+
+# Folder and dataset names to their location, see register_folder and register_dataset
+_folders = {}
+_datasets = {}
+
+
+def register_folder(name, root, remote=False):
+    """
+    Map a managed folder name to a local directory. A remote folder hides its
+    path, so the plugin goes through the download and upload streams as it
+    does with cloud storage.
+    """
+    _folders[name] = (root, remote)
+
+
+def register_dataset(name, path):
+    """Map a dataset name to a CSV file, its schema being kept next to it."""
+    _datasets[name] = path
+
+
+class Folder(LocalFolder):
+
+    def __init__(self, name):
+        root, remote = _folders[name]
+        LocalFolder.__init__(self, root, short_name=name)
+        self.remote = remote
+
+    def get_info(self):
+        info = LocalFolder.get_info(self)
+        if self.remote:
+            info = {'name': self.short_name, 'type': 'S3'}
+        return info
+
+    def get_path(self):
+        if self.remote:
+            raise Exception(f"Folder {self.short_name} is not stored on the local filesystem")
+        return LocalFolder.get_path(self)
+
+
+class DatasetWriter(object):
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self._header = True
+        self._stream = open(dataset.path, 'w', newline='')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_dataframe(self, df):
+        df.to_csv(self._stream, index=False, header=self._header)
+        self._header = False
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+
+class Dataset(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.path = _datasets[name]
+
+    @property
+    def _schema_path(self):
+        return self.path + '.schema.json'
+
+    def read_schema(self):
+        if os.path.exists(self._schema_path):
+            with open(self._schema_path) as f:
+                return json.load(f)
+        columns = pd.read_csv(self.path, nrows=0).columns
+        return [{'name': column, 'type': 'string'} for column in columns]
+
+    def write_schema(self, schema):
+        with open(self._schema_path, 'w') as f:
+            json.dump(schema, f)
+
+    def iter_dataframes(self, chunksize=10000, columns=None):
+        for chunk in pd.read_csv(self.path, chunksize=chunksize, usecols=columns, dtype=str, keep_default_na=False):
+            yield chunk
+
+    def get_dataframe(self, columns=None):
+        return pd.read_csv(self.path, usecols=columns, dtype=str, keep_default_na=False)
+
+    def get_writer(self):
+        return DatasetWriter(self)
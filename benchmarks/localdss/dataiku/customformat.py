@@ -0,0 +1,26 @@
+"""Base classes of custom formats."""
+
+
+class Formatter(object):
+
+    def __init__(self, config, plugin_config):
+        self.config = config
+        self.plugin_config = plugin_config
+
+
+class OutputFormatter(object):
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write_header(self):
+        pass
+
+    def write_footer(self):
+        pass
+
+
+class FormatExtractor(object):
+
+    def __init__(self, stream):
+        self.stream = stream
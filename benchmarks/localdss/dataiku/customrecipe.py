@@ -0,0 +1,31 @@
+"""Recipe roles and settings of the running recipe, set by the benchmark harness with configure()."""
+
+_inputs = {}
+_outputs = {}
+_config = {}
+
+
+def configure(inputs, outputs, config):
+    """
+    :param inputs: {role: [names]} of the input roles
+    :param outputs: {role: [names]} of the output roles
+    :param config: the recipe parameters
+    """
+    _inputs.clear()
+    _inputs.update(inputs)
+    _outputs.clear()
+    _outputs.update(outputs)
+    _config.clear()
+    _config.update(config)
+
+
+def get_input_names_for_role(role):
+    return list(_inputs.get(role, []))
+
+
+def get_output_names_for_role(role):
+    return list(_outputs.get(role, []))
+
+
+def get_recipe_config():
+    return _config
@@ -0,0 +1,8 @@
+"""Base class of custom exporters."""
+
+
+class Exporter(object):
+
+    def __init__(self, config, plugin_config):
+        self.config = config
+        self.plugin_config = plugin_config
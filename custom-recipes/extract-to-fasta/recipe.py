@@ -4,6 +4,12 @@ import dataiku
 import pandas as pd
 import logging
 import os
+import shutil
+import tempfile
+from memetools.fasta import FastaWriter
+from memetools.demux import UNASSIGNED_SAMPLE, SampleDemultiplexer
+from memetools.compression import NONE, CompressedWriter, fasta_file_name
+from memetools.faidx import FAI_SUFFIX, FastaIndex, write_fai
 
 # Set up logging
 logging_level = get_recipe_config().get('logging_level', "INFO")
@@ -38,14 +44,6 @@ input_dataset_name = get_input_names_for_role('input_dataset')[0]
 input_dataset = dataiku.Dataset(input_dataset_name)
 logger.info(f"Input dataset: {input_dataset_name}")
 
-# Read recipe inputs as a DataFrame, if the input dataset is partitioned, then here we will only get the selected partition data.
-try:
-    input_dataset_df = input_dataset.get_dataframe()
-    logger.info(f"Input dataset shape: {input_dataset_df.shape}")
-except Exception as e:
-    logger.error(f"Error reading input dataset: {e}")
-    raise
-
 # Get output folder
 logger.info(f"Output folders: {get_output_names_for_role('fasta_output')}")
 fasta_output = get_output_names_for_role('fasta_output')[0]
@@ -61,6 +59,25 @@ if not sequence_id_column_name or not sequence_column_name:
 
 logger.info(f"ID column: {sequence_id_column_name}, Sequence column: {sequence_column_name}")
 
+# Number of rows held in memory at once, the partition is never loaded as a whole
+chunk_size = int(get_recipe_config().get('chunk_size', 100000))
+logger.info(f"Chunk size: {chunk_size}")
+
+# Bounds of the sample demultiplexing: per-sample files kept open at once and threads writing them
+max_open_files = int(get_recipe_config().get('max_open_files', 256))
+write_workers = int(get_recipe_config().get('write_workers', 1))
+logger.info(f"Max open files: {max_open_files}, write workers: {write_workers}")
+
+# Compression of the FASTA files written, none, gzip, bgzf or zstd
+compression = get_recipe_config().get('compression', 'none')
+logger.info(f"Compression: {compression}")
+
+# Write a samtools .fai index next to every FASTA file, only uncompressed files can be indexed
+write_index = get_recipe_config().get('write_index', True) and compression == NONE
+if get_recipe_config().get('write_index', True) and not write_index:
+    logger.info(f"FASTA files are compressed with {compression}, no .fai index is written")
+logger.info(f"Write index: {write_index}")
+
 # Get the current partition ID
 partition_id = next((dataiku.dku_flow_variables[key] for key in dataiku.dku_flow_variables if "DKU_DST_" in key), None)
 if not partition_id:
@@ -80,57 +97,107 @@ except Exception as e:
 # Get the output path for the FASTA file
 partition_root_path = fasta_output_folder.get_partition_folder(partition_id)
 
-# Ensure the necessary columns are present in the input DataFrame
-if sequence_column_name not in input_dataset_df.columns or sequence_id_column_name not in input_dataset_df.columns:
-    logger.error("Input DataFrame does not contain the required columns")
+# Ensure the necessary columns are present in the input dataset
+try:
+    input_columns = [column['name'] for column in input_dataset.read_schema()]
+except Exception as e:
+    logger.error(f"Error reading input dataset schema: {e}")
+    raise
+if sequence_column_name not in input_columns or sequence_id_column_name not in input_columns:
+    logger.error("Input dataset does not contain the required columns")
     raise KeyError(f"Columns {sequence_id_column_name} or {sequence_column_name} missing")
 
-def to_fasta(df, id_column, sequence_column):
-    """Convert a DataFrame to FASTA format using vectorized operations."""
-    headers = df[id_column].apply(lambda x: f">{x}").values
-    sequences = df[sequence_column].values
-    return "\n".join(f"{header}\n{sequence}" for header, sequence in zip(headers, sequences))
+has_sample_id = 'sample_id' in input_columns
+read_columns = [sequence_id_column_name, sequence_column_name] + (['sample_id'] if has_sample_id else [])
 
-def process_fasta_and_write(df, fasta_output_folder, path_upload_file, sequence_id_column_name, sequence_column_name, sample_id=None):
-    """Helper function to convert DataFrame to FASTA and write to output folder."""
-    
-    # Convert the DataFrame to FASTA and handle errors
+def iter_input_chunks():
+    """Read the input dataset in chunks, if the input dataset is partitioned, then here we will only get the selected partition data."""
     try:
-        fasta_data = to_fasta(df, sequence_id_column_name, sequence_column_name)
-        logger.debug(f"dataframe : {df}")
-        logger.info(f"FASTA data prepared for sample_id: {sample_id}" if sample_id else "FASTA data prepared for full dataset")
+        for chunk_df in input_dataset.iter_dataframes(chunksize=chunk_size, columns=read_columns):
+            logger.debug(f"Read chunk of shape: {chunk_df.shape}")
+            yield chunk_df
     except Exception as e:
-        error_msg = f"Error generating FASTA data for sample_id {sample_id}: {e}" if sample_id else f"Error generating FASTA data: {e}"
-        logger.error(error_msg)
-        raise RuntimeError(error_msg)
-
-    # Write the FASTA data to the output folder
+        logger.error(f"Error reading input dataset: {e}")
+        raise
+
+def write_fasta(df, fasta_writer, id_column, sequence_column):
+    """Append the DataFrame rows in FASTA format through the shared buffered writer."""
+    fasta_writer.write_columns(df[id_column].values, df[sequence_column].values)
+
+def process_chunks_and_write(chunks, fasta_output_folder, sequence_id_column_name, sequence_column_name):
+    """Stream the input chunks into a single FASTA file for the partition, each chunk is written as soon as it has been read."""
+    path_upload_file = f"{partition_root_path}/{fasta_file_name(partition_id, compression)}"
+    rows = 0
+    # The index is filled by the writer as it formats the records, the file is never read back
+    index = FastaIndex() if write_index else None
     try:
-        with fasta_output_folder.get_writer(path_upload_file) as writer:
-            writer.write(fasta_data.encode('utf-8'))
-        logger.info(f"FASTA file written to: {path_upload_file}")
+        with fasta_output_folder.get_writer(path_upload_file) as writer, CompressedWriter(writer, compression) as stream:
+            fasta_writer = FastaWriter(stream, index=index)
+            for chunk_df in chunks:
+                rows += len(chunk_df)
+                write_fasta(chunk_df, fasta_writer, sequence_id_column_name, sequence_column_name)
+                logger.info(f"Processed {rows} rows")
+        logger.info(f"FASTA file written to: {path_upload_file} ({fasta_writer.records_written} records)")
+        if index is not None:
+            with fasta_output_folder.get_writer(path_upload_file + FAI_SUFFIX) as writer:
+                index.write(writer)
+            logger.info(f"FASTA index written to: {path_upload_file + FAI_SUFFIX} ({len(index)} sequences)")
     except Exception as e:
-        error_msg = f"Error writing FASTA file for sample_id {sample_id}: {e}" if sample_id else f"Error writing FASTA file: {e}"
+        error_msg = f"Error writing FASTA file: {e}"
         logger.error(error_msg)
         raise RuntimeError(error_msg)
 
+def demultiplex_chunks_and_write(chunks, fasta_output_folder, sequence_id_column_name, sequence_column_name):
+    """
+    Route the rows of every chunk to their sample's FASTA file in a single pass. Managed folder writers
+    cannot be reopened for append, so the per-sample files are spooled to local disk and uploaded once complete.
+    """
+    spool_dir = tempfile.mkdtemp()
+    logger.info(f"Created spool directory: {spool_dir}")
+
+    def local_sample_path(sample_id):
+        return os.path.join(spool_dir, str(sample_id), fasta_file_name(sample_id, compression))
+
+    # A reopened file gets a new gzip member, BGZF blocks or zstd frame appended, which readers read through
+    def open_sample_stream(sample_id, append):
+        local_file_path = local_sample_path(sample_id)
+        os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
+        return CompressedWriter(open(local_file_path, 'ab' if append else 'wb'), compression, close_stream=True)
+
+    rows = 0
+    try:
+        with SampleDemultiplexer(open_sample_stream, max_open_files=max_open_files, max_workers=write_workers) as demultiplexer:
+            for chunk_df in chunks:
+                rows += len(chunk_df)
+                demultiplexer.write_dataframe(chunk_df, 'sample_id', sequence_id_column_name, sequence_column_name)
+                logger.info(f"Processed {rows} rows, {len(demultiplexer.samples)} samples")
+        logger.info(f"Demultiplexed {rows} rows into {len(demultiplexer.samples)} samples ({demultiplexer.evictions} file reopenings)")
+        if demultiplexer.unassigned:
+            logger.warning(f"{demultiplexer.unassigned} rows had no sample_id, they were written to sample {UNASSIGNED_SAMPLE}")
+
+        for sample_id in demultiplexer.samples:
+            path_upload_file = f"{partition_root_path}/{sample_id}/{fasta_file_name(sample_id, compression)}"
+            try:
+                # Sample files may have been reopened for append, so they are indexed once complete
+                if write_index:
+                    index = write_fai(local_sample_path(sample_id))
+                    fasta_output_folder.upload_file(path_upload_file + FAI_SUFFIX, local_sample_path(sample_id) + FAI_SUFFIX)
+                    logger.debug(f"FASTA index written to: {path_upload_file + FAI_SUFFIX} ({len(index)} sequences)")
+                fasta_output_folder.upload_file(path_upload_file, local_sample_path(sample_id))
+                os.remove(local_sample_path(sample_id))
+                logger.info(f"FASTA file written to: {path_upload_file} ({demultiplexer.records_written(sample_id)} records)")
+            except Exception as e:
+                error_msg = f"Error writing FASTA file for sample_id {sample_id}: {e}"
+                logger.error(error_msg)
+                raise RuntimeError(error_msg)
+    finally:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+        logger.info(f"Removed spool directory: {spool_dir}")
+
 
 # Main logic
-if 'sample_id' in input_dataset_df.columns:
-    # Iterate over unique sample IDs and apply the FASTA conversion for each
-    for sample_id in input_dataset_df['sample_id'].unique():
-        # Filter the DataFrame for the current sample_id
-        logger.info(f"processing sample_id: {sample_id}")
-        sample_df = input_dataset_df[input_dataset_df['sample_id'] == sample_id]
-        
-        # Generate the path for the FASTA file
-        path_upload_file = f"{partition_root_path}/{sample_id}/{sample_id}.fasta"
-        
-        # Call the helper function to process and write FASTA
-        process_fasta_and_write(sample_df, fasta_output_folder, path_upload_file, sequence_id_column_name, sequence_column_name, sample_id)
+if has_sample_id:
+    demultiplex_chunks_and_write(iter_input_chunks(), fasta_output_folder, sequence_id_column_name, sequence_column_name)
 else:
-    # Apply the code to the entire DataFrame (no sample_id filtering, parition_id is the sample_id)
-    path_upload_file = f"{partition_root_path}/{partition_id}.fasta"
-    
-    # Call the helper function to process and write FASTA
-    process_fasta_and_write(input_dataset_df, fasta_output_folder, path_upload_file, sequence_id_column_name, sequence_column_name)
+    # No sample_id filtering, parition_id is the sample_id
+    process_chunks_and_write(iter_input_chunks(), fasta_output_folder, sequence_id_column_name, sequence_column_name)
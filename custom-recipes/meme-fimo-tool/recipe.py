@@ -1,10 +1,31 @@
 import dataiku
 import os
+import posixpath
 import shutil
 import subprocess
-import concurrent.futures
+import functools
+import io
 import tempfile
+import time
 import logging
+from memetools.pipeline import PipelinedExecutor
+from memetools.runner import Command, CommandRunner
+from memetools.scheduler import count_sequences, cpu_limit, default_memory_budget, default_workers, fimo_cost
+from memetools.transfer import FolderTransfer, local_folder_path
+from memetools.fimo import (MANIFEST_NAME, STREME_FILE_NAME, FIMO_TSV_NAME, PairManifest, build_pairs, gather_pair_inputs,
+                            path_fingerprint, split_fimo_tsv, write_tagged_fasta)
+from memetools.cache import cache_key, file_digest, tool_version
+from memetools.scanner import DEFAULT_PSEUDOCOUNT, DEFAULT_THRESHOLD, SCANNER_VERSION, MotifScanner, scanner_options
+from memetools.motifs import MOTIF_STORE_NAME, MotifSet, read_meme, write_meme
+from memetools.cluster import HitExpander, cluster_motifs
+from memetools.background import BackgroundCache, content_key
+from memetools.hits import HitsWriter
+from memetools.occupancy import OCCUPANCY_NAME, OccupancyMatrix
+from memetools.metrics import RUN_METRICS_NAME, RunMetrics
+from memetools.faidx import FAI_SUFFIX
+from memetools.checkpoint import MARKER_PREFIX, STAGING_SUFFIX, commit_staged, staging_dir
+from memetools.dedup import SEQUENCE_MAP_NAME
+from memetools.compression import NONE, compression_of_path, decompress_file, is_fasta, plain_fasta_path
 from dataiku.customrecipe import get_input_names_for_role, get_output_names_for_role, get_recipe_config
 
 # Set up logging
@@ -36,11 +57,54 @@ logging.getLogger('urllib3').setLevel(logging.INFO)
 logging.getLogger('urllib3.connectionpool').setLevel(logging.INFO)
 
 # Process roles and parameters
-max_workers = int(get_recipe_config().get('max_workers', 1))
+max_workers = default_workers(get_recipe_config().get('max_workers', 0))
+memory_budget = default_memory_budget(float(get_recipe_config().get('memory_budget_gb', 0) or 0) * 1024 ** 3)
 fimo_exec = get_recipe_config().get('fimo_exec_path', "/usr/local/meme/bin/fimo")
 fimo_options = get_recipe_config().get('fimo_options', {})
+timeout_minutes = int(get_recipe_config().get('timeout_minutes', 0) or 0)
+transfer_workers = int(get_recipe_config().get('transfer_workers', 4))
+incremental = bool(get_recipe_config().get('incremental', False))
+batch_mode = bool(get_recipe_config().get('batch_mode', False))
+engine = get_recipe_config().get('engine', 'fimo')
+deduplicate_motifs = bool(get_recipe_config().get('deduplicate_motifs', False))
+motif_similarity = float(get_recipe_config().get('motif_similarity', 0.95))
+dedup_threshold_slack = float(get_recipe_config().get('dedup_threshold_slack', 10) or 1)
+background_mode = get_recipe_config().get('background', 'motif')
+background_order = int(get_recipe_config().get('background_order', 0))
+background_cache_dir = get_recipe_config().get('background_cache_dir', '')
+hits_max_pvalue = float(get_recipe_config().get('hits_max_pvalue', 0) or 0)
+hits_max_qvalue = float(get_recipe_config().get('hits_max_qvalue', 0) or 0)
+output_profile = get_recipe_config().get('output_profile', 'full')
+write_occupancy = bool(get_recipe_config().get('occupancy_matrix', True))
+metrics_hook = get_recipe_config().get('metrics_hook', '')
+
+# The minimal output profile only keeps fimo.tsv: FIMO runs in --text mode, writing no other file,
+# and its stdout is streamed straight into fimo.tsv
+if output_profile == 'minimal':
+    fimo_options = dict(fimo_options, text='true')
 
 logger.info(f"FIMO options: {fimo_options}")
+logger.info(f"Output profile: {output_profile}")
+logger.info(f"Running up to {max_workers} FIMO jobs within a memory budget of {memory_budget / 1024 ** 3:.1f} GB")
+logger.info(f"Scan engine: {engine}")
+logger.info(f"Background: {background_mode}")
+
+# Options results depend on, part of the incremental mode keys
+result_options = dict(fimo_options)
+if background_mode != 'motif':
+    result_options['memetools-background'] = f"{background_mode}:{background_order}"
+if engine == 'memetools' and batch_mode:
+    logger.info("Batch mode only applies to the fimo engine, the memetools scanner has no process startup to amortize")
+    batch_mode = False
+if engine == 'memetools' and background_mode != 'motif' and background_order > 0:
+    logger.error("The memetools scanner only supports zero-order backgrounds")
+    raise ValueError(f"Background order {background_order} is not supported by the memetools scanner, use the fimo engine or order 0")
+if deduplicate_motifs and background_mode != 'motif' and background_order > 0:
+    logger.error("Motif deduplication rescores hits with zero-order backgrounds only")
+    raise ValueError(f"Background order {background_order} is not supported with motif deduplication, disable it or use order 0")
+if deduplicate_motifs and incremental:
+    logger.info("Motif deduplication scans each FASTA file against the motifs of all samples, it is disabled in incremental mode")
+    deduplicate_motifs = False
 
 # Input and Output folder handling
 def get_folder(role_name, role_type='input'):
@@ -58,6 +122,14 @@ fasta_folder = get_folder('input_fasta')
 streme_folder = get_folder('input_streme')
 fimo_folder = get_folder('fimo_output', role_type='output')
 
+# Optional dataset receiving the hits of every pair, written as the pairs finish
+hits_writer = None
+hits_names = get_output_names_for_role('fimo_hits')
+if hits_names:
+    hits_writer = HitsWriter(dataiku.Dataset(hits_names[0]), max_pvalue=hits_max_pvalue or None,
+                             max_qvalue=hits_max_qvalue or None)
+    logger.info(f"Writing FIMO hits to dataset {hits_names[0]}")
+
 # Get current sample partition ID
 partition_id = next((dataiku.dku_flow_variables[key] for key in dataiku.dku_flow_variables if "DKU_DST_" in key), None)
 if not partition_id:
@@ -65,6 +137,12 @@ if not partition_id:
     raise ValueError("Partition ID not found in flow variables")
 logger.info(f"Partition ID (Partition): {partition_id}")
 
+# Timings of the run and of every FIMO job, written to run_metrics.json at the partition root
+run_metrics = RunMetrics('meme-fimo-tool', partition_id, {
+    'max_workers': max_workers, 'memory_budget_bytes': memory_budget, 'transfer_workers': transfer_workers,
+    'cpu_limit': cpu_limit(), 'engine': engine, 'batch_mode': batch_mode, 'incremental': incremental,
+    'output_profile': output_profile, 'fimo_options': fimo_options})
+
 # Create a temporary directory
 tmp_dir_name = tempfile.mkdtemp()
 logger.info(f"Created temporary directory: {tmp_dir_name}")
@@ -72,24 +150,42 @@ logger.info(f"Created temporary directory: {tmp_dir_name}")
 # Function to copy files from folders to a temporary directory
 def copy_files_to_temp(folder, partition_id=None):
     try:
-        for file_name in folder.list_paths_in_partition(partition_id):
-            local_file_path = os.path.join(tmp_dir_name, file_name.lstrip('/'))
-            os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
-            with folder.get_download_stream(file_name) as f_remote, open(local_file_path, 'wb') as f_local:
-                shutil.copyfileobj(f_remote, f_local)
-                logger.debug(f"Copied {file_name} to {local_file_path}")
-                
-        logger.info(f"Copied from {folder.short_name} to {tmp_dir_name}")
+        start = time.perf_counter()
+        with run_metrics.timer('staging'), FolderTransfer(folder, max_workers=transfer_workers) as transfer:
+            transfer.download_partition(tmp_dir_name, partition_id)
+        logger.info(f"Copied from {folder.short_name} to {tmp_dir_name}: {transfer.downloaded.describe(time.perf_counter() - start)}")
     except Exception as e:
         logger.error(f"Error while copying files from {folder}: {e}")
         shutil.rmtree(tmp_dir_name)
         raise RuntimeError("Failed to copy files to temporary directory.")
 
-# Copy files from streme and fasta folders
-copy_files_to_temp(streme_folder, partition_id)
-copy_files_to_temp(fasta_folder)
-
-logger.info("Fasta and Streme files copied to temporary directory")
+# FIMO reads plain text: a compressed FASTA file is replaced by its decompressed copy once staged
+def decompress_staged_fasta(local_path):
+    if compression_of_path(local_path) == NONE:
+        return local_path
+    plain_path = plain_fasta_path(local_path)
+    try:
+        with run_metrics.timer('decompress'):
+            decompress_file(local_path, plain_path)
+        os.remove(local_path)
+    except Exception as e:
+        logger.error(f"Failed to decompress {local_path}: {e}")
+        raise RuntimeError(f"Failed to decompress {local_path}")
+    return plain_path
+
+# Copy files from streme and fasta folders, files of local folders are linked instead of copied.
+# In incremental mode only the inputs of the pairs to compute are staged, later on.
+if incremental:
+    logger.info("Incremental mode, inputs are staged on demand")
+else:
+    copy_files_to_temp(streme_folder, partition_id)
+    copy_files_to_temp(fasta_folder)
+    for root, _, file_names in os.walk(tmp_dir_name):
+        for file_name in file_names:
+            if is_fasta(file_name):
+                decompress_staged_fasta(os.path.join(root, file_name))
+
+    logger.info("Fasta and Streme files copied to temporary directory")
 
 # List the contents of the temp directory
 def list_directory_contents(directory):
@@ -113,116 +209,552 @@ def build_fimo_command(fimo_exec, output_dir, streme_file, fasta_file, options_d
     fimo_command.extend([f'--oc', output_dir, streme_file, fasta_file])
     return fimo_command
 
-# Function to apply FIMO tool
-def apply_fimo(streme_file, fasta_file, output_dir, fimo_exec, streme_options):
-    fimo_command = build_fimo_command(fimo_exec, output_dir, streme_file, fasta_file, streme_options)
+# FIMO command of one run, executed by the command runner. With --text FIMO writes its TSV to stdout,
+# which is streamed into <output_dir>/fimo.tsv like the default output
+def fimo_command(streme_file, fasta_file, output_dir, fimo_exec, options, result):
+    stdout_path = None
+    if str(options.get('text', 'false')).lower() == 'true':
+        os.makedirs(output_dir, exist_ok=True)
+        stdout_path = os.path.join(output_dir, FIMO_TSV_NAME)
     logger.info(f"Running FIMO for {streme_file} and {fasta_file} with output_dir {output_dir}")
-
+    return Command(build_fimo_command(fimo_exec, output_dir, streme_file, fasta_file, options),
+                   description=f"FIMO {streme_file} x {fasta_file}", stdout_path=stdout_path, result=result)
+
+# Command of one (streme_file, fasta_file, output_dir, manifest_entry) job
+def fimo_job_command(job, fimo_exec, fimo_options, backgrounds=None):
+    streme_file, fasta_file, output_dir, _ = job
+    return fimo_command(streme_file, fasta_file, output_dir, fimo_exec,
+                        with_background(fimo_options, backgrounds, fasta_file), job)
+
+# FIMO options of a run over fasta_file, with its precomputed background file if any
+def with_background(fimo_options, backgrounds, fasta_file):
+    if not backgrounds or fasta_file not in backgrounds:
+        return fimo_options
+    options = dict(fimo_options)
+    options['bfile'] = backgrounds[fasta_file]
+    return options
+
+# Process-pool entry point running the in-process memetools scanner instead of the fimo executable
+def apply_scanner_job(job, fimo_options, backgrounds=None):
+    streme_file, fasta_file, output_dir, _ = job
+    kwargs, ignored = scanner_options(with_background(fimo_options, backgrounds, fasta_file))
+    if ignored:
+        logger.warning(f"FIMO options not supported by the memetools scanner, ignored: {ignored}")
+    logger.info(f"Scanning {fasta_file} with the motifs of {streme_file}, output_dir {output_dir}")
     try:
-        fimo_process = subprocess.run(
-            fimo_command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            check=True  # Raise an error if the command fails
-        )
-        logger.info(f"FIMO succeeded for {streme_file} and {fasta_file}")
-        logger.debug(f"FIMO output: {fimo_process.stdout.decode()}")
-    except subprocess.CalledProcessError as e:
-        logger.error(f"FIMO failed for {streme_file} and {fasta_file}")
-        logger.debug(f"FIMO error output: {e.stderr.decode()}")
-        raise RuntimeError(f"FIMO execution failed for {streme_file} and {fasta_file}")
+        os.makedirs(output_dir, exist_ok=True)
+        hits = MotifScanner(streme_file, **kwargs).write_tsv(fasta_file, os.path.join(output_dir, FIMO_TSV_NAME))
+    except Exception as e:
+        logger.error(f"Scan failed for {streme_file} and {fasta_file}: {e}")
+        raise RuntimeError(f"Motif scan failed for {streme_file} and {fasta_file}")
+    logger.info(f"Scan succeeded for {streme_file} and {fasta_file}: {hits} hits")
+    return job
+
+# FIMO keeps this many hits by default, a batched run shares it across all of its targets
+FIMO_MAX_STORED_SCORES = 100000
+
+# Command of one (streme_file, targets_fasta, batch_dir, [(tag, output_dir, manifest_entry)]) job: a single FIMO run
+# over the concatenated targets, its hits are split back into the per-pair output directories by split_batch_results
+def fimo_batch_job_command(job, fimo_exec, fimo_options, backgrounds=None):
+    streme_file, targets_fasta, batch_dir, pairs = job
+    options = dict(with_background(fimo_options, backgrounds, targets_fasta))
+    if 'max-stored-scores' not in options:
+        options['max-stored-scores'] = str(FIMO_MAX_STORED_SCORES * len(pairs))
+    return fimo_command(streme_file, targets_fasta, batch_dir, fimo_exec, options, job)
+
+# Split the hits of a batched FIMO run into its pairs' output directories
+def split_batch_results(job):
+    streme_file, _, batch_dir, pairs = job
+    try:
+        counts = split_fimo_tsv(os.path.join(batch_dir, FIMO_TSV_NAME), {tag: output_dir for tag, output_dir, _ in pairs})
+    except Exception as e:
+        logger.error(f"Failed to split the FIMO hits of {streme_file}: {e}")
+        raise RuntimeError(f"Failed to split the FIMO hits of {streme_file}")
+    logger.info(f"Split {sum(counts.values())} FIMO hits of {streme_file} into {len(pairs)} pairs")
+    shutil.rmtree(batch_dir)
 
 # Function to gather files from subdirectories
 def gather_files(tmp_dir_name):
-    subfolders = {}
-    
-    for root, dirs, files in os.walk(tmp_dir_name):
-        streme_file = None
-        fasta_file = None
-
-        for file_name in files:
-            if file_name == 'streme.txt':
-                streme_file = os.path.join(root, file_name)
-            elif file_name.endswith('.fasta'):
-                fasta_file = os.path.join(root, file_name)
-        if fasta_file:
-            subfolders[root] = (streme_file, fasta_file)
-    
+    paths = [os.path.join(root, file_name) for root, dirs, files in os.walk(tmp_dir_name) for file_name in files]
+    subfolders = gather_pair_inputs(paths)
     logger.debug(f"Gathered subfolders with streme and fasta files: {subfolders}")
     return subfolders
 
-# Function to process each subfolder and apply FIMO tool between files concurrently
-def process_folders_fimo(tmp_dir_name, max_workers, fimo_exec, streme_options):
+# When the output folder lives on the local filesystem, FIMO results are staged and moved in place
+output_root_dir = local_folder_path(fimo_folder)
+if output_root_dir:
+    logger.info(f"Output folder is local, writing FIMO results to {output_root_dir}")
+
+def get_output_base_dir(subfolder):
+    if output_root_dir is None:
+        return subfolder
+    return os.path.join(output_root_dir, os.path.relpath(subfolder, tmp_dir_name))
+
+# Pair results are written to a staging directory and moved in place once complete, like the STREME results:
+# next to the pair directory when the output folder is local, the temporary directory being the staging area otherwise
+pair_staging_dirs = []
+
+def get_pair_staging_dir(output_dir):
+    if output_root_dir is None:
+        return output_dir
+    staging = staging_dir(output_dir)
+    pair_staging_dirs.append(staging)
+    return staging
+
+def get_pair_output_dir(staging):
+    if output_root_dir is None:
+        return staging
+    return staging[:-len(STAGING_SUFFIX)]
+
+# Function to list the (streme_file, fasta_file, output_dir, manifest_entry) jobs to run FIMO on
+def build_fimo_jobs(tmp_dir_name):
     subfolders = gather_files(tmp_dir_name)
     logger.debug(f"Processing subfolders: {subfolders}")
-    
-    tasks = []
-    exceptions = []
-
-    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
-        for subfolder1, (streme_file, _) in subfolders.items():
-            if streme_file:
-                for subfolder2, (_, fasta_file) in subfolders.items():
-                    if subfolder1 != subfolder2 and fasta_file:
-                        fasta_file_name = os.path.basename(fasta_file)
-                        fasta_file_base_name = os.path.splitext(fasta_file_name)[0]
-                        output_dir = os.path.join(subfolder1, fasta_file_base_name)
-
-                        tasks.append(executor.submit(apply_fimo, streme_file, fasta_file, output_dir, fimo_exec, streme_options))
-                        logger.info(f"Task submitted for streme_file: {streme_file}, fasta_file: {fasta_file} with output_dir {output_dir}")
-                    else:
-                        logger.debug(f"Skipping pairing for subfolder {subfolder1} and {subfolder2} due to conditions.")
-            else:
-                logger.debug(f"No valid streme_file in subfolder: {subfolder1}. Skipping task submission.")
-
-        for future in concurrent.futures.as_completed(tasks):
-            try:
-                future.result()
-            except Exception as e:
-                logger.error(f"Task failed with exception: {e}")
-                exceptions.append(e)
-
-    if exceptions:
-        # Aggregate all exceptions into a single exception and raise it
-        combined_message = "FIMO processing failed with the following errors:\n" + "\n".join(str(e) for e in exceptions)
-        logger.error(combined_message)
-        raise RuntimeError(combined_message)
-# Usage
-process_folders_fimo(tmp_dir_name, max_workers=max_workers, fimo_exec=fimo_exec, streme_options=fimo_options)
-
-# List the directory structure after processing
-list_directory_contents(tmp_dir_name)
 
-# Clean up the previous result
-try:
-    fimo_folder.clear_partition(partition_id)
-    logger.info(f"Previous results under {partition_id} removed")
-except Exception as e:
-    logger.error(f"Failed to clear partition {partition_id}: {e}")
-    raise RuntimeError(f"Failed to clear previous results for partition {partition_id}")
+    jobs = []
+    for streme_file, fasta_file, pair_dir in build_pairs(subfolders):
+        output_base_dir = get_output_base_dir(os.path.dirname(pair_dir))
+        os.makedirs(output_base_dir, exist_ok=True)
+        output_dir = get_pair_staging_dir(os.path.join(output_base_dir, os.path.basename(pair_dir)))
+        jobs.append((streme_file, fasta_file, output_dir, None))
+        logger.debug(f"Task created for streme_file: {streme_file}, fasta_file: {fasta_file} with output_dir {output_dir}")
+    return jobs
+
+# Pairs left untouched by an incremental run, their hits are read back from the output folder
+up_to_date_pairs = []
+# Every pair of the partition, in incremental mode
+partition_pairs = []
+# Staged target FASTA files of the partition background, in incremental mode
+partition_targets = []
+
+# Function to list the jobs of the pairs whose inputs or options changed since they were last computed,
+# staging only the inputs these pairs need
+def build_incremental_fimo_jobs(manifest, fimo_version):
+    streme_transfer = FolderTransfer(streme_folder, max_workers=transfer_workers)
+    fasta_transfer = FolderTransfer(fasta_folder, max_workers=transfer_workers)
+    sources = {}
+    for path in streme_folder.list_paths_in_partition(partition_id):
+        if os.path.basename(path) == STREME_FILE_NAME:
+            sources[path] = ('streme', streme_folder, streme_transfer)
+    for path in fasta_folder.list_paths_in_partition():
+        if is_fasta(path):
+            sources[path] = ('fasta', fasta_folder, fasta_transfer)
+    subfolders = gather_pair_inputs(list(sources))
+    logger.debug(f"Gathered remote subfolders with streme and fasta files: {subfolders}")
+
+    staged = {}
+    def stage(path):
+        if path not in staged:
+            local_path = os.path.join(tmp_dir_name, path.lstrip('/'))
+            sources[path][2].download_file(path, local_path)
+            staged[path] = decompress_staged_fasta(local_path)
+        return staged[path]
+
+    def digest(path):
+        role, folder, _ = sources[path]
+        name = f"{role}:{path}"
+        fingerprint = path_fingerprint(folder, path)
+        file_hash = manifest.known_digest(name, fingerprint)
+        if file_hash is None:
+            file_hash = file_digest(stage(path))
+            manifest.remember_digest(name, fingerprint, file_hash)
+        return file_hash
+
+    jobs = []
+    pairs = build_pairs(subfolders)
+    partition_pairs.extend(pair_path for _, _, pair_path in pairs)
+    target_paths = sorted({fasta_path for _, fasta_path, _ in pairs})
+    options = result_options
+    if background_mode == 'partition' and target_paths:
+        # The partition background is computed over every target FASTA file, so is part of the key of every pair
+        options = dict(result_options)
+        options['memetools-background'] += f":{content_key(digest(path) for path in target_paths)}"
+    for streme_path, fasta_path, pair_path in pairs:
+        key = cache_key(f"{digest(streme_path)}:{digest(fasta_path)}", options, fimo_version)
+        if manifest.is_current(pair_path, key):
+            up_to_date_pairs.append(pair_path)
+            continue
+        output_base_dir = get_output_base_dir(os.path.join(tmp_dir_name, os.path.dirname(pair_path).lstrip('/')))
+        os.makedirs(output_base_dir, exist_ok=True)
+        output_dir = get_pair_staging_dir(os.path.join(output_base_dir, os.path.basename(pair_path)))
+        jobs.append((stage(streme_path), stage(fasta_path), output_dir, (pair_path, key)))
+    if jobs and background_mode == 'partition':
+        partition_targets.extend(stage(path) for path in target_paths)
+    logger.info(f"Incremental mode: {len(pairs) - len(jobs)} of {len(pairs)} pairs up to date, {len(staged)} files staged")
+    return jobs
+
+# Function to turn pair jobs into one job per motif file, run over the concatenation of its target FASTA files.
+# Target sequence IDs are tagged with the index of their file so the hits can be split back per pair.
+# A motif file scanning all targets but at most one (its own sample) uses the concatenation of every target and
+# drops the extra hits, so a full run writes the concatenated FASTA only once.
+def build_batched_fimo_jobs(jobs, batch_root):
+    groups = {}
+    for streme_file, fasta_file, output_dir, manifest_entry in jobs:
+        groups.setdefault(streme_file, []).append((fasta_file, output_dir, manifest_entry))
+    all_targets = tuple(sorted({fasta_file for _, fasta_file, _, _ in jobs}))
+
+    concatenated = {}
+    batched_jobs = []
+    for streme_file, targets in groups.items():
+        target_files = tuple(sorted({fasta_file for fasta_file, _, _ in targets}))
+        if len(target_files) >= len(all_targets) - 1:
+            target_files = all_targets
+        if target_files not in concatenated:
+            targets_fasta = os.path.join(batch_root, f"targets_{len(concatenated)}.fasta")
+            tags = write_tagged_fasta(target_files, targets_fasta)
+            concatenated[target_files] = (targets_fasta, dict(zip(target_files, tags)))
+            logger.debug(f"Concatenated {len(target_files)} FASTA files into {targets_fasta}")
+        targets_fasta, tag_of = concatenated[target_files]
+        pairs = [(tag_of[fasta_file], output_dir, manifest_entry) for fasta_file, output_dir, manifest_entry in targets]
+        batched_jobs.append((streme_file, targets_fasta, os.path.join(batch_root, f"fimo_{len(batched_jobs)}"), pairs))
+    logger.info(f"Batched {len(jobs)} pairs into {len(batched_jobs)} FIMO runs over {len(concatenated)} "
+                f"concatenated FASTA files")
+    return batched_jobs
+
+# Function to replace the pair jobs by one job per FASTA file, scanned against the representatives of the motifs
+# of every sample. Near-identical motifs are clustered across samples, and the hits of each representative are
+# expanded into hits of its members when results are published. Returns the jobs and {scan output_dir: pair outputs}.
+def build_deduplicated_fimo_jobs(jobs, dedup_root):
+    streme_files = sorted({streme_file for streme_file, _, _, _ in jobs})
+    motif_set = MotifSet.concatenate(read_meme(streme_file, streme_file) for streme_file in streme_files)
+    clusters = cluster_motifs(motif_set, motif_similarity)
+    representatives = clusters.representatives
+    motif_file = os.path.join(dedup_root, 'representatives.txt')
+    with open(motif_file, 'w') as f:
+        write_meme(motif_set, f, representatives, ids=[str(index) for index in representatives])
+
+    pair_outputs = {}
+    for streme_file, fasta_file, output_dir, _ in jobs:
+        pair_outputs.setdefault(fasta_file, {})[streme_file] = output_dir
+    dedup_jobs = []
+    expansions = {}
+    for index, (fasta_file, outputs) in enumerate(sorted(pair_outputs.items())):
+        scan_dir = os.path.join(dedup_root, f"scan_{index}")
+        dedup_jobs.append((motif_file, fasta_file, scan_dir, None))
+        expansions[scan_dir] = outputs
+    logger.info(f"Motif deduplication: {len(motif_set)} motifs of {len(streme_files)} samples reduced to "
+                f"{len(representatives)}, {len(jobs)} pairs replaced by {len(dedup_jobs)} scans")
+    options = scanner_options(fimo_options)[0]
+    expander = HitExpander(motif_set, clusters, options.get('threshold', DEFAULT_THRESHOLD),
+                           options.get('pseudocount', DEFAULT_PSEUDOCOUNT), slack=dedup_threshold_slack)
+    logger.info(f"Scanning representatives at p-value {expander.scan_threshold:g}, their members are kept at "
+                f"{expander.threshold:g}")
+    return dedup_jobs, expansions, expander
+
+# Function to compute the background of every scanned FASTA file once, cached by content, and shared by all the
+# runs scanning it: per scanned file, or one over all target FASTA files of the partition
+def compute_backgrounds(jobs, target_files, background_dir):
+    cache = BackgroundCache(background_dir, order=background_order)
+    scanned_files = sorted({job[1] for job in jobs})
+    start = time.perf_counter()
+    if background_mode == 'partition':
+        backgrounds = dict.fromkeys(scanned_files, cache.path(target_files))
+    else:
+        backgrounds = {fasta_file: cache.path(fasta_file) for fasta_file in scanned_files}
+    logger.info(f"Backgrounds of {len(scanned_files)} scanned FASTA files ready in {time.perf_counter() - start:.1f} s")
+    for job in jobs:
+        if batch_mode:
+            for _, output_dir, _ in job[3]:
+                scan_backgrounds[output_dir] = backgrounds[job[1]]
+        else:
+            scan_backgrounds[job[2]] = backgrounds[job[1]]
+    return backgrounds
+
+# Clean up the previous result, pair results are uploaded as soon as they are produced.
+# In incremental mode previous results are kept and tracked by the manifest.
+manifest = None
+if incremental:
+    manifest = PairManifest(fimo_folder, f"{fimo_folder.get_partition_folder(partition_id)}/{MANIFEST_NAME}")
+else:
+    try:
+        fimo_folder.clear_partition(partition_id)
+        logger.info(f"Previous results under {partition_id} removed")
+    except Exception as e:
+        logger.error(f"Failed to clear partition {partition_id}: {e}")
+        raise RuntimeError(f"Failed to clear previous results for partition {partition_id}")
+
+# Concurrent, retried transfers to the output folder
+upload_transfer = FolderTransfer(fimo_folder, max_workers=transfer_workers)
 
-# Upload the results to the output folder
+# Motif sample and FASTA file of a pair, from its path in the output folder: <partition>/<sample>/<target>
+def get_pair_samples(pair_path):
+    sample_path = posixpath.dirname(pair_path)
+    return posixpath.relpath(sample_path, fimo_folder.get_partition_folder(partition_id)), posixpath.basename(pair_path)
+
+# Stream the hits of one pair into the hits dataset
+def write_pair_hits(tsv, pair_path):
+    sample, target = get_pair_samples(pair_path)
+    try:
+        rows = hits_writer.write_tsv(tsv, sample, target)
+        logger.debug(f"Wrote {rows} hits of {pair_path} to the hits dataset")
+    except Exception as e:
+        logger.error(f"Failed to write the hits of {pair_path}: {e}")
+        raise RuntimeError(f"Failed to write the hits of {pair_path} to the hits dataset")
+
+# Sample x motif hit summary of the partition, updated as pairs finish and merged with the previous runs
+occupancy = None
+occupancy_path = f"{fimo_folder.get_partition_folder(partition_id)}/{OCCUPANCY_NAME}"
+if write_occupancy:
+    occupancy = OccupancyMatrix()
+    if manifest is not None:
+        try:
+            with fimo_folder.get_download_stream(occupancy_path) as f:
+                occupancy = OccupancyMatrix.load(io.BytesIO(f.read()))
+            logger.info(f"Loaded occupancy matrix {occupancy_path}: {occupancy.shape[0]} targets, {occupancy.shape[1]} motifs")
+        except Exception:
+            logger.info(f"No occupancy matrix found at {occupancy_path}, it is rebuilt from the pair results")
+
+# Add the hits of one pair to the occupancy matrix
+def record_pair_occupancy(tsv, pair_path):
+    sample, target = get_pair_samples(pair_path)
+    try:
+        occupancy.add_fimo_tsv(tsv, sample, target)
+    except Exception as e:
+        logger.error(f"Failed to summarize the hits of {pair_path}: {e}")
+        raise RuntimeError(f"Failed to add the hits of {pair_path} to the occupancy matrix")
+
+# Write the occupancy matrix at the partition root
+def upload_occupancy():
+    try:
+        with tempfile.TemporaryFile() as f:
+            occupancy.save(f)
+            f.seek(0)
+            fimo_folder.upload_stream(occupancy_path, f)
+        logger.info(f"Wrote occupancy matrix {occupancy_path}: {occupancy.shape[0]} targets, {occupancy.shape[1]} motifs")
+    except Exception as e:
+        logger.error(f"Failed to write the occupancy matrix {occupancy_path}: {e}")
+        raise RuntimeError(f"Failed to write the occupancy matrix {occupancy_path}")
+
+# Move the results of one pair in place or upload them to the output folder, then free the local disk.
+# The files of a previous computation of the pair, e.g. under another output profile, are removed
+def publish_pair_results(output_dir, manifest_entry):
+    pair_dir = get_pair_output_dir(output_dir)
+    pair_path = '/' + os.path.relpath(pair_dir, output_root_dir or tmp_dir_name).replace(os.sep, '/')
+    if hits_writer is not None or occupancy is not None:
+        tsv = os.path.join(output_dir, FIMO_TSV_NAME)
+        if hits_writer is not None:
+            write_pair_hits(tsv, pair_path)
+        if occupancy is not None:
+            record_pair_occupancy(tsv, pair_path)
+    if output_root_dir is not None:
+        try:
+            moved = set(commit_staged(output_dir, pair_dir))
+            for root, _, file_names in os.walk(pair_dir):
+                for file_name in file_names:
+                    if os.path.join(root, file_name) not in moved:
+                        os.remove(os.path.join(root, file_name))
+        except Exception as e:
+            logger.error(f"Failed to move FIMO results to {pair_dir}: {e}")
+            raise RuntimeError(f"Failed to move FIMO results to {pair_dir}")
+        logger.info(f"FIMO results moved in place to {pair_dir}")
+    else:
+        try:
+            if manifest is not None:
+                fimo_folder.delete_path(pair_path)
+            upload_transfer.upload_directory(output_dir, tmp_dir_name)
+            shutil.rmtree(output_dir)
+            logger.info(f"Uploaded FIMO results from {output_dir}")
+        except Exception as e:
+            logger.error(f"Failed to upload files from {output_dir}: {e}")
+            raise RuntimeError(f"Failed to upload files from {output_dir} to FIMO folder")
+    if manifest is not None and manifest_entry is not None:
+        manifest.mark_done(*manifest_entry)
+        manifest.checkpoint()
+
+# Hit expansion of deduplicated scans, set when motif deduplication is enabled
+dedup_expansions = None
+dedup_expander = None
+# Background file used by the scan that produced each output directory, when backgrounds are precomputed
+scan_backgrounds = {}
+# Background file given with --bfile in the FIMO options, used by every scan when backgrounds are not precomputed
+options_background = scanner_options(fimo_options)[0].get('background')
+if options_background is not None and not os.path.isfile(options_background):
+    options_background = None
+
+# Publish the results of a scan: a pair, or every pair of a deduplicated scan once its hits are expanded
+def publish_results(output_dir, manifest_entry):
+    if dedup_expansions is None:
+        publish_pair_results(output_dir, manifest_entry)
+        return
+    outputs = dedup_expansions[output_dir]
+    try:
+        counts = dedup_expander.expand(os.path.join(output_dir, FIMO_TSV_NAME), outputs,
+                                       background=scan_backgrounds.get(output_dir, options_background))
+        logger.info(f"Expanded {sum(counts.values())} hits of representative motifs into {len(outputs)} pairs")
+    except Exception as e:
+        logger.error(f"Failed to expand the hits of {output_dir}: {e}")
+        raise RuntimeError(f"Failed to expand the hits of {output_dir}")
+    shutil.rmtree(output_dir, ignore_errors=True)
+    for pair_output_dir in outputs.values():
+        publish_pair_results(pair_output_dir, None)
+
+def upload_pair_results(job):
+    publish_results(job[2], job[3])
+
+def upload_batch_results(job):
+    split_batch_results(job)
+    for _, output_dir, manifest_entry in job[3]:
+        publish_results(output_dir, manifest_entry)
+
+# Estimated cost of a scan from the size of its FASTA and motif files
+def estimate_fimo_cost(job):
+    return fimo_cost(os.path.getsize(job[1]), os.path.getsize(job[0]))
+
+# Input size and number of scanned sequences of a scan, for its run metrics record. A FASTA file is scanned
+# against many motif files, its sequences are counted once
+@functools.lru_cache(maxsize=None)
+def count_fasta_sequences(fasta_file):
+    return count_sequences(fasta_file)
+
+def fimo_job_info(job):
+    return {'input_bytes': os.path.getsize(job[0]) + os.path.getsize(job[1]), 'sequences': count_fasta_sequences(job[1])}
+
+# Function to run FIMO on every pair concurrently, each pair's results are uploaded as soon as FIMO is done
+def process_folders_fimo(tmp_dir_name, max_workers, fimo_exec, fimo_options):
+    global dedup_expansions, dedup_expander
+    if manifest is not None:
+        if engine == 'memetools':
+            version = SCANNER_VERSION
+        else:
+            version = tool_version(fimo_exec)
+        with run_metrics.timer('staging'):
+            jobs = build_incremental_fimo_jobs(manifest, version)
+    else:
+        jobs = build_fimo_jobs(tmp_dir_name)
+    logger.info(f"Running FIMO on {len(jobs)} pairs")
+
+    dedup_root = None
+    if deduplicate_motifs and jobs:
+        dedup_root = tempfile.mkdtemp(prefix='fimo_dedup_')
+        jobs, dedup_expansions, dedup_expander = build_deduplicated_fimo_jobs(jobs, dedup_root)
+        # Representatives are scanned at the looser threshold, the expansion filters every hit at the real one
+        fimo_options = {key: value for key, value in fimo_options.items() if str(key).strip().lstrip('-') != 'thresh'}
+        fimo_options['thresh'] = f"{dedup_expander.scan_threshold:g}"
+
+    target_files = partition_targets or sorted({job[1] for job in jobs})
+    batch_root = None
+    if batch_mode and jobs:
+        batch_root = tempfile.mkdtemp(prefix='fimo_batch_')
+        jobs = build_batched_fimo_jobs(jobs, batch_root)
+
+    backgrounds = None
+    background_root = None
+    if background_mode != 'motif' and jobs:
+        background_root = background_cache_dir or tempfile.mkdtemp(prefix='fimo_background_')
+        with run_metrics.timer('backgrounds'):
+            backgrounds = compute_backgrounds(jobs, target_files, background_root)
+
+    # The fimo executable runs from the command runner, the memetools scanner in the process pool
+    runner = None
+    if engine != 'memetools':
+        runner = CommandRunner(max_workers, timeout=timeout_minutes * 60 if timeout_minutes > 0 else None)
+        runner.start()
+
+    if batch_mode and jobs:
+        executor = PipelinedExecutor(
+            functools.partial(fimo_batch_job_command, fimo_exec=fimo_exec, fimo_options=fimo_options,
+                              backgrounds=backgrounds),
+            upload=upload_batch_results,
+            max_workers=max_workers,
+            transfer_workers=transfer_workers,
+            cost=estimate_fimo_cost,
+            memory_budget=memory_budget,
+            runner=runner,
+            metrics=run_metrics,
+            job_info=fimo_job_info
+        )
+        describe = lambda job: f"{job[0]} x {len(job[3])} targets"
+    else:
+        if engine == 'memetools':
+            process = functools.partial(apply_scanner_job, fimo_options=fimo_options, backgrounds=backgrounds)
+        else:
+            process = functools.partial(fimo_job_command, fimo_exec=fimo_exec, fimo_options=fimo_options,
+                                        backgrounds=backgrounds)
+        executor = PipelinedExecutor(
+            process,
+            upload=upload_pair_results,
+            max_workers=max_workers,
+            transfer_workers=transfer_workers,
+            cost=estimate_fimo_cost,
+            memory_budget=memory_budget,
+            runner=runner,
+            metrics=run_metrics,
+            job_info=fimo_job_info
+        )
+        describe = lambda job: f"{job[0]} x {job[1]}"
+    start = time.perf_counter()
+    try:
+        if hits_writer is not None:
+            hits_writer.open()
+        executor.run(jobs, describe=describe)
+        for pair_path in up_to_date_pairs:
+            if hits_writer is not None:
+                with fimo_folder.get_download_stream(f"{pair_path}/{FIMO_TSV_NAME}") as tsv:
+                    write_pair_hits(tsv, pair_path)
+            if occupancy is not None and not occupancy.has_pair(*get_pair_samples(pair_path)):
+                with fimo_folder.get_download_stream(f"{pair_path}/{FIMO_TSV_NAME}") as tsv:
+                    record_pair_occupancy(tsv, pair_path)
+        if occupancy is not None and manifest is not None:
+            occupancy.retain_pairs([get_pair_samples(pair_path) for pair_path in partition_pairs])
+    finally:
+        if runner is not None:
+            runner.close()
+        if hits_writer is not None:
+            hits_writer.close()
+        # Pairs completed before a failure are kept in the occupancy matrix, like in the manifest
+        if occupancy is not None:
+            with run_metrics.timer('occupancy'):
+                upload_occupancy()
+        # Pairs completed before a failure are not recomputed by the next run
+        if manifest is not None:
+            manifest.save()
+        if batch_root is not None:
+            shutil.rmtree(batch_root, ignore_errors=True)
+        if dedup_root is not None:
+            shutil.rmtree(dedup_root, ignore_errors=True)
+        if background_root is not None and not background_cache_dir:
+            shutil.rmtree(background_root, ignore_errors=True)
+        # Staging directories of the pairs not completed, their partial results never reach the output folder
+        for staging in pair_staging_dirs:
+            shutil.rmtree(staging, ignore_errors=True)
+        upload_transfer.close()
+    logger.info(f"Uploaded {upload_transfer.uploaded.describe(time.perf_counter() - start)}")
+
+# Files staged with the inputs that are not copied to the output folder: the FASTA files and their indexes, and
+# the files the STREME recipe keeps for itself. Its run metrics are left out too, the partition root gets the ones
+# of this run, and its completion markers would be taken for markers of this recipe by a later run
+def is_internal_file(file_name):
+    return (is_fasta(file_name) or file_name.endswith(FAI_SUFFIX) or file_name.startswith(MARKER_PREFIX)
+            or file_name in (RUN_METRICS_NAME, MOTIF_STORE_NAME, SEQUENCE_MAP_NAME))
+
+# Upload the remaining staged files (the source streme results) to the output folder
 def upload_results(tmp_dir_name, output_folder):
     try:
-        for root, dirs, file_names in os.walk(tmp_dir_name):
-            for file_name in file_names:
-                if not file_name.endswith('.fasta'):
-                    file_path = os.path.join(root, file_name)
-                    relative_subfolder = os.path.relpath(root, tmp_dir_name)
-                    output_path = f"/{relative_subfolder}/{file_name}"
-                    output_folder.upload_file(output_path, file_path)
-                    logger.debug(f"Uploaded {file_path} to FIMO folder under {relative_subfolder}")
+        with FolderTransfer(output_folder, max_workers=transfer_workers) as transfer:
+            transfer.upload_directory(tmp_dir_name, tmp_dir_name, exclude=is_internal_file)
         logger.info(f"Uploaded from {tmp_dir_name} to FIMO folder")
     except Exception as e:
         logger.error(f"Failed to upload files: {e}")
         raise RuntimeError("Failed to upload files to FIMO folder")
 
-upload_results(tmp_dir_name, fimo_folder)
-
-# Clean up the temporary directory
-try:
-    shutil.rmtree(tmp_dir_name)
-    logger.info(f"Temporary directory {tmp_dir_name} removed")
-except Exception as e:
-    logger.error(f"Failed to remove temporary directory {tmp_dir_name}: {e}")
-    raise RuntimeError("Failed to remove temporary directory")
\ No newline at end of file
+# The run metrics are written whether the run succeeds or fails
+with run_metrics.report(fimo_folder, f"{fimo_folder.get_partition_folder(partition_id)}/{RUN_METRICS_NAME}",
+                        hook=metrics_hook):
+    process_folders_fimo(tmp_dir_name, max_workers=max_workers, fimo_exec=fimo_exec, fimo_options=fimo_options)
+
+    # List the directory structure after processing
+    list_directory_contents(tmp_dir_name)
+
+    # The minimal output profile only publishes the FIMO results, the source streme results stay in their folder
+    if output_profile != 'minimal':
+        with run_metrics.timer('upload'):
+            upload_results(tmp_dir_name, fimo_folder)
+
+    # Clean up the temporary directory
+    with run_metrics.timer('cleanup'):
+        try:
+            shutil.rmtree(tmp_dir_name)
+            logger.info(f"Temporary directory {tmp_dir_name} removed")
+        except Exception as e:
+            logger.error(f"Failed to remove temporary directory {tmp_dir_name}: {e}")
+            raise RuntimeError("Failed to remove temporary directory")
@@ -1,11 +1,28 @@
 import dataiku
+import json
 import os
+import posixpath
 import shutil
 import subprocess
-import concurrent.futures
+import functools
 from pathlib import Path
 import tempfile
+import time
 import logging
+import threading
+from memetools.pipeline import PipelinedExecutor
+from memetools.runner import Command, CommandRunner
+from memetools.scheduler import (count_sequences, cpu_limit, default_memory_budget, default_workers, estimate_sequences,
+                                 streme_cost)
+from memetools.transfer import FolderTransfer
+from memetools.localfolder import LocalFolder
+from memetools.cache import ResultCache, cache_key, file_digest, tool_version
+from memetools.checkpoint import Checkpoints, commit_staged, staging_dir
+from memetools.fimo import path_fingerprint
+from memetools.motifs import MOTIF_STORE_NAME, MotifSet, parse_meme, read_meme
+from memetools.metrics import RUN_METRICS_NAME, RunMetrics
+from memetools.dedup import SEQUENCE_MAP_NAME, collapse_fasta
+from memetools.compression import NONE, compression_of_path, decompress_file, fasta_stem, is_fasta, plain_fasta_path
 # Import the helpers for custom recipes
 from dataiku.customrecipe import get_input_names_for_role, get_output_names_for_role, get_recipe_config
 
@@ -38,11 +55,35 @@ logging.getLogger('urllib3').setLevel(logging.INFO)
 logging.getLogger('urllib3.connectionpool').setLevel(logging.INFO)
 
 # Process roles and parameters
-max_workers = int(get_recipe_config().get('max_workers', 1))
+max_workers = default_workers(get_recipe_config().get('max_workers', 0))
+memory_budget = default_memory_budget(float(get_recipe_config().get('memory_budget_gb', 0) or 0) * 1024 ** 3)
 streme_exec = get_recipe_config().get('streme_exec_path', "/usr/local/meme/bin/streme")
 streme_options = get_recipe_config().get('streme_options')
+timeout_minutes = int(get_recipe_config().get('timeout_minutes', 0) or 0)
+transfer_workers = int(get_recipe_config().get('transfer_workers', 4))
+cache_dir = get_recipe_config().get('cache_dir', '')
+cache_max_size_gb = float(get_recipe_config().get('cache_max_size_gb', 0) or 0)
+write_motif_store = bool(get_recipe_config().get('motif_store', True))
+resume = bool(get_recipe_config().get('resume', True))
+output_profile = get_recipe_config().get('output_profile', 'full')
+streme_artifacts = [name.strip() for name in get_recipe_config().get('streme_artifacts', 'streme.txt').split(',') if name.strip()]
+metrics_hook = get_recipe_config().get('metrics_hook', '')
+collapse_duplicates = bool(get_recipe_config().get('collapse_duplicates', False))
+max_sequences = int(get_recipe_config().get('max_sequences', 0) or 0)
+subsample_seed = int(get_recipe_config().get('subsample_seed', 0) or 0)
 
 logger.info(f"STREME options: {streme_options}")
+logger.info(f"Output profile: {output_profile}")
+
+# Options results depend on, part of the result cache and completion marker keys
+result_options = dict(streme_options)
+if output_profile == 'minimal':
+    result_options['memetools-artifacts'] = ','.join(sorted(streme_artifacts))
+    logger.info(f"Keeping only these STREME files: {streme_artifacts}")
+if collapse_duplicates:
+    result_options['memetools-collapse'] = f"{max_sequences}:{subsample_seed}"
+    logger.info(f"Collapsing duplicate sequences before STREME, keeping up to {max_sequences or 'all'} distinct sequences")
+logger.info(f"Running up to {max_workers} STREME jobs within a memory budget of {memory_budget / 1024 ** 3:.1f} GB")
 
 # Input and Output folder
 input_fasta = get_input_names_for_role('input_fasta')[0]
@@ -57,6 +98,20 @@ except Exception as e:
 streme_output = get_output_names_for_role('streme_output')[0]
 streme_folder = dataiku.Folder(streme_output)
 
+# Optional STREME result cache, either a managed folder or a local directory
+cache_folder = None
+cache_names = get_output_names_for_role('streme_cache')
+if cache_names:
+    cache_folder = dataiku.Folder(cache_names[0])
+    logger.info(f"STREME cache folder: {cache_names[0]}")
+elif cache_dir:
+    cache_folder = LocalFolder(cache_dir, short_name='streme_cache')
+    logger.info(f"STREME cache directory: {cache_dir}")
+
+# Concurrent, retried transfers from the input folder and to the output folder
+download_transfer = FolderTransfer(fasta_folder, max_workers=transfer_workers)
+upload_transfer = FolderTransfer(streme_folder, max_workers=transfer_workers)
+
 # Get current sample partition ID
 partition_id = next((dataiku.dku_flow_variables[key] for key in dataiku.dku_flow_variables if "DKU_DST_" in key), None)
 if not partition_id:
@@ -64,6 +119,11 @@ if not partition_id:
     raise ValueError("Partition ID not found in flow variables")
 logger.info(f"Partition ID (Partition): {partition_id}")
 
+# Timings of the run and of every STREME job, written to run_metrics.json at the partition root
+run_metrics = RunMetrics('meme-streme-tool', partition_id, {
+    'max_workers': max_workers, 'memory_budget_bytes': memory_budget, 'transfer_workers': transfer_workers,
+    'cpu_limit': cpu_limit(), 'output_profile': output_profile, 'streme_options': streme_options})
+
 # Create temporary directory
 try:
     tmp_dir_name = tempfile.mkdtemp()
@@ -72,20 +132,6 @@ except Exception as e:
     logger.error(f"Failed to create temporary directory: {e}")
     raise OSError("Could not create temporary directory.")
 
-# Copy files from the remote folder to the local temp directory
-for file_name in fasta_folder.list_paths_in_partition(partition_id):
-    local_file_path = os.path.join(tmp_dir_name, file_name.lstrip('/'))
-    os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
-    
-    try:
-        with fasta_folder.get_download_stream(file_name) as f_remote, open(local_file_path, 'wb') as f_local:
-            shutil.copyfileobj(f_remote, f_local)
-            logger.debug(f"Copied file {file_name} to {local_file_path}")
-        logger.info(f"Copied files from {input_fasta} to {tmp_dir_name}")
-    except Exception as e:
-        logger.error(f"Error copying file {file_name}: {e}")
-        raise IOError(f"Failed to copy file {file_name}")
-
 # List the contents of the temp directory
 def list_directory_contents(directory):
     try:
@@ -95,8 +141,6 @@ def list_directory_contents(directory):
         logger.error(f"Failed to list directory contents: {e}")
         raise RuntimeError("Failed to list contents of the temporary directory.")
 
-list_directory_contents(tmp_dir_name)        
-        
 
 # Command builder function
 def build_streme_command(streme_exec, output_dir, file_path, options_dict):
@@ -109,88 +153,317 @@ def build_streme_command(streme_exec, output_dir, file_path, options_dict):
     streme_command.extend([f"--oc", str(output_dir), f"--p", str(file_path)])
     return streme_command
 
-# Function to apply the STREME tool
-def apply_streme(file_path, streme_exec, streme_options):
-    # output_dir = os.path.dirname(file_path)
-    
-    file_name = os.path.basename(file_path)
+# Function to locate the STREME output directory of a FASTA file, relative to a root directory
+def get_streme_output_dir(file_name, root_dir):
+    file_path = os.path.join(root_dir, file_name.lstrip('/'))
     parent_folder = os.path.basename(os.path.dirname(file_path))
-
-
-    file_name_no_ext = os.path.splitext(file_name)[0]
+    file_name_no_ext = fasta_stem(file_path)
 
     if file_name_no_ext != parent_folder:
         # Create a subfolder inside the parent folder
-        output_dir = os.path.join(os.path.dirname(file_path), file_name_no_ext)
-        os.makedirs(output_dir, exist_ok=True)
-    else:
-        # If the file name matches the parent folder name, keep output_dir as the parent folder
-        output_dir = os.path.dirname(file_path)
-    
-    streme_command = build_streme_command(streme_exec, output_dir, file_path, streme_options)
+        return os.path.join(os.path.dirname(file_path), file_name_no_ext)
+    # If the file name matches the parent folder name, keep output_dir as the parent folder
+    return os.path.dirname(file_path)
+
+# Path of the STREME results of a FASTA file in the output folder
+def get_streme_output_path(file_name):
+    return get_streme_output_dir(file_name, '/').replace(os.sep, '/')
 
+# STREME command of one job, executed by the command runner which streams its output to the log.
+# STREME writes into a staging directory, its results are moved in place once it succeeded
+def streme_job_command(job, streme_exec, streme_options):
+    file_path, output_dir = job['input_path'], job['staging_dir']
+    streme_command = build_streme_command(streme_exec, output_dir, file_path, streme_options)
     logger.info(f"Processing {file_path} with STREME command: {streme_command}")
+    return Command(streme_command, description=f"STREME {job['file_path']}", result=job)
+
+# Find the files completed by previous runs, or clear previous results in output folder.
+# Results are uploaded as soon as each file has been processed, and marked completed once uploaded
+checkpoints = None
+if resume:
     try:
-        streme_process = subprocess.run(streme_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-        logger.info(f"STREME succeeded for {file_path}")
-        logger.debug(f"STREME output:\n{streme_process.stdout.decode()}")
-    except subprocess.CalledProcessError as e:
-        logger.error(f"STREME failed for {file_path}: {e.stderr.decode()}")
-        raise RuntimeError(f"STREME execution failed for {file_path}")
+        checkpoints = Checkpoints(streme_folder, partition_id)
+    except Exception as e:
+        logger.error(f"Failed to list previous results of partition {partition_id}: {e}")
+        raise RuntimeError(f"Unable to list previous results of partition {partition_id}")
+else:
+    try:
+        streme_folder.clear_partition(partition_id)
+        logger.info(f"Cleared previous results for partition {partition_id}")
+    except Exception as e:
+        logger.error(f"Failed to clear partition {partition_id}: {e}")
+        raise RuntimeError(f"Unable to clear partition {partition_id}")
 
-# Process files in parallel using ProcessPoolExecutor
-def process_directory_streme(tmp_dir_name, max_workers, streme_exec, streme_options):
-    files = [os.path.join(root, file_name) for root, _, file_names in os.walk(tmp_dir_name) for file_name in file_names if file_name.endswith('.fasta')]
-    logger.info(f"Processing {len(files)} files with STREME")
-    
-    tasks = []
-
-    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
-        tasks = {}
-        for file in files:
-            logger.info(f"Submitting STREME task for file: {file}")
-            tasks[executor.submit(apply_streme, file, streme_exec, streme_options)] = file
-            
-        for future in concurrent.futures.as_completed(tasks):
-            try:
-                future.result()
-            except Exception as e:
-                logger.error(f"Task failed for {futures[future]}: {e}")
-                raise RuntimeError(f"Task failed for {futures[future]}: {e}")
-
-# Process the files in the directory
-process_directory_streme(tmp_dir_name, max_workers, streme_exec, streme_options)
-
-# List the directory structure after processing
-list_directory_contents(tmp_dir_name)
-
-# Clear previous results in output folder
-try:
-    streme_folder.clear_partition(partition_id)
-    logger.info(f"Cleared previous results for partition {partition_id}")
-except Exception as e:
-    logger.error(f"Failed to clear partition {partition_id}: {e}")
-    raise RuntimeError(f"Unable to clear partition {partition_id}")
+# When the folders live on the local filesystem, STREME reads the original files and writes its results in place
+if download_transfer.local_root:
+    logger.info(f"Input folder is local, reading FASTA files from {download_transfer.local_root}")
+if upload_transfer.local_root:
+    logger.info(f"Output folder is local, writing STREME results to {upload_transfer.local_root}")
+output_root_dir = upload_transfer.local_root or tmp_dir_name
+
+# STREME version, part of the result cache and completion marker keys
+streme_version = None
+if cache_folder is not None or checkpoints is not None:
+    try:
+        streme_version = tool_version(streme_exec)
+    except Exception as e:
+        logger.warning(f"Failed to get the STREME version, results are neither cached nor resumed: {e}")
+        cache_folder, checkpoints = None, None
 
-# Upload processed files back to the Dataiku folder
-for root, _, file_names in os.walk(tmp_dir_name):
-    for file_name in file_names:
-        if not file_name.endswith('.fasta'):
+# Set up the result cache, keyed by input content, options and STREME version
+result_cache = None
+if cache_folder is not None:
+    try:
+        result_cache = ResultCache(cache_folder, max_size=int(cache_max_size_gb * 1024 ** 3) if cache_max_size_gb > 0 else None)
+        logger.info(f"STREME result cache enabled for STREME version {streme_version}, {len(result_cache.index)} entries")
+    except Exception as e:
+        logger.warning(f"STREME result cache disabled: {e}")
+
+# Key of the completion marker of a FASTA file, from its size and modification time when the folder provides them
+def get_checkpoint_key(file_name):
+    fingerprint = path_fingerprint(fasta_folder, file_name)
+    if fingerprint is None:
+        local_file_path = download_transfer.local_path(file_name)
+        if local_file_path is None or not os.path.isfile(local_file_path):
+            return None
+        fingerprint = file_digest(local_file_path)
+    return cache_key(json.dumps(fingerprint), result_options, streme_version)
+
+checkpoint_keys = {}
+
+# STREME reads plain text: a compressed FASTA file is decompressed into the temporary directory,
+# a downloaded one is removed once decompressed
+def decompress_fasta(file_name, local_file_path):
+    plain_path = plain_fasta_path(os.path.join(tmp_dir_name, file_name.lstrip('/')))
+    try:
+        with run_metrics.timer('decompress'):
+            decompress_file(local_file_path, plain_path)
+    except Exception as e:
+        logger.error(f"Failed to decompress {file_name}: {e}")
+        raise RuntimeError(f"Failed to decompress {file_name}")
+    if local_file_path.startswith(tmp_dir_name):
+        os.remove(local_file_path)
+    return plain_path
+
+# Make one FASTA file available locally and prepare its staging directory, restoring cached results if any
+def stage_fasta(file_name):
+    local_file_path = download_transfer.local_path(file_name)
+    if local_file_path is None:
+        local_file_path = os.path.join(tmp_dir_name, file_name.lstrip('/'))
+        download_transfer.download_file(file_name, local_file_path)
+    if compression_of_path(file_name) != NONE:
+        local_file_path = decompress_fasta(file_name, local_file_path)
+    output_dir = get_streme_output_dir(file_name, output_root_dir)
+    job = {'file_path': local_file_path, 'input_path': local_file_path, 'output_dir': output_dir,
+           'staging_dir': staging_dir(output_dir),
+           'output_path': get_streme_output_path(file_name), 'checkpoint_key': checkpoint_keys.get(file_name),
+           'cache_key': None, 'cached': False}
+    if checkpoints is not None:
+        checkpoints.invalidate(job['output_path'])
+    if result_cache is not None:
+        job['cache_key'] = cache_key(file_digest(local_file_path), result_options, streme_version)
+        job['cached'] = result_cache.restore(job['cache_key'], job['staging_dir'])
+        if job['cached']:
+            logger.info(f"Restored STREME results for {file_name} from cache")
+    if collapse_duplicates and not job['cached']:
+        job['input_path'] = collapse_sequences(file_name, local_file_path, job['staging_dir'])
+    return job
+
+# Collapse the identical sequences of a FASTA file, optionally subsampled, into the file STREME runs on.
+# The mapping from every sequence to the one it was collapsed into is kept with the STREME results
+def collapse_sequences(file_name, local_file_path, staging):
+    collapsed_path = os.path.join(tmp_dir_name, 'collapsed', file_name.lstrip('/'))
+    try:
+        stats = collapse_fasta(local_file_path, collapsed_path, os.path.join(staging, SEQUENCE_MAP_NAME),
+                               max_sequences=max_sequences or None, seed=subsample_seed)
+    except Exception as e:
+        logger.error(f"Failed to collapse the sequences of {file_name}: {e}")
+        raise RuntimeError(f"Failed to collapse the sequences of {file_name}")
+    logger.info(f"Collapsed {file_name}: {stats.describe()}")
+    return collapsed_path
+
+# Motifs of every sample of the partition, gathered while results are uploaded
+partition_folder = streme_folder.get_partition_folder(partition_id).rstrip('/')
+partition_motifs = []
+partition_motifs_lock = threading.Lock()
+
+def collect_motifs(output_dir, output_path):
+    streme_file = os.path.join(output_dir, 'streme.txt')
+    if not os.path.isfile(streme_file):
+        return
+    sample = posixpath.relpath(output_path, partition_folder)
+    try:
+        motifs = read_meme(streme_file, sample)
+    except Exception as e:
+        logger.warning(f"Failed to parse motifs of {streme_file}, not adding them to the motif store: {e}")
+        return
+    with partition_motifs_lock:
+        partition_motifs.append(motifs)
+
+# Motifs of a file completed by a previous run, read back from the output folder
+def collect_completed_motifs(output_path):
+    streme_file = f"{output_path}/streme.txt"
+    try:
+        with streme_folder.get_download_stream(streme_file) as f:
+            motifs = parse_meme(f.read().decode('utf-8'), posixpath.relpath(output_path, partition_folder))
+    except Exception as e:
+        logger.warning(f"Failed to read motifs of {streme_file}, not adding them to the motif store: {e}")
+        return
+    with partition_motifs_lock:
+        partition_motifs.append(motifs)
+
+# Write the motifs of the partition to a single binary store at the partition root. The store is an optional
+# artifact: when it cannot be built or written, e.g. for samples with different alphabets, it is skipped
+def upload_motif_store():
+    if not partition_motifs:
+        logger.info("No motifs found, no motif store written")
+        return
+    store_path = f"{streme_folder.get_partition_folder(partition_id)}/{MOTIF_STORE_NAME}"
+    try:
+        motifs = MotifSet.concatenate(sorted(partition_motifs, key=lambda motif_set: motif_set.samples[0]))
+        with tempfile.TemporaryFile() as store:
+            motifs.save(store)
+            store.seek(0)
+            streme_folder.upload_stream(store_path, store)
+        logger.info(f"Wrote {len(motifs)} motifs of {len(motifs.samples)} samples to {store_path}")
+    except Exception as e:
+        logger.warning(f"Failed to write the motif store {store_path}, skipping it: {e}")
+
+# Remove the STREME files not kept by the minimal output profile, before they are cached or uploaded
+def prune_streme_outputs(staging):
+    removed = 0
+    for root, _, file_names in os.walk(staging):
+        for file_name in file_names:
             file_path = os.path.join(root, file_name)
-            #relative_subfolder = os.path.basename(root)
-            relative_subfolder = os.path.relpath(root, tmp_dir_name)
-            try:
-                streme_folder.upload_file(f"/{relative_subfolder}/{file_name}", file_path)
-                logger.debug(f"Uploaded file: {file_path} to folder: {relative_subfolder}")
-            except Exception as e:
-                logger.error(f"Failed to upload file {file_path}: {e}")
-                raise IOError(f"Error uploading file {file_path} to folder")
-logger.debug(f"Uploaded file from {tmp_dir_name} to folder: {streme_output}")
-                
-# Clean up the temp directory
-try:
-    shutil.rmtree(tmp_dir_name)
-    logger.info(f"Removed temporary directory: {tmp_dir_name}")
-except Exception as e:
-    logger.error(f"Failed to remove temporary directory: {e}")
-    raise OSError("Failed to remove temporary directory.")
\ No newline at end of file
+            relative_path = os.path.relpath(file_path, staging).replace(os.sep, '/')
+            if relative_path not in streme_artifacts and relative_path != SEQUENCE_MAP_NAME:
+                os.remove(file_path)
+                removed += 1
+    logger.debug(f"Removed {removed} STREME files from {staging}")
+
+# Move the STREME results of one file in place or upload them to the Dataiku folder, then free the local disk.
+# The file is marked completed once all of its results are in the folder
+def upload_streme_results(job):
+    file_path, staging, output_path = job['file_path'], job['staging_dir'], job['output_path']
+    if write_motif_store:
+        collect_motifs(staging, output_path)
+    if output_profile == 'minimal':
+        prune_streme_outputs(staging)
+    if result_cache is not None and not job['cached']:
+        try:
+            result_cache.store(job['cache_key'], staging,
+                               description=f"{partition_id}:{posixpath.relpath(output_path, partition_folder)}")
+        except Exception as e:
+            logger.warning(f"Failed to cache STREME results for {file_path}: {e}")
+    if upload_transfer.local_root is not None:
+        files = commit_staged(staging, job['output_dir'])
+        files = ['/' + os.path.relpath(path, upload_transfer.local_root).replace(os.sep, '/') for path in files]
+    else:
+        pairs = []
+        for root, _, file_names in os.walk(staging):
+            for name in file_names:
+                local_path = os.path.join(root, name)
+                pairs.append((local_path, f"{output_path}/{os.path.relpath(local_path, staging).replace(os.sep, '/')}"))
+        upload_transfer.upload_files(pairs)
+        files = [remote_path for _, remote_path in pairs]
+        shutil.rmtree(staging, ignore_errors=True)
+        logger.info(f"Uploaded STREME results for {file_path}")
+    if checkpoints is not None:
+        checkpoints.mark_done(output_path, job['checkpoint_key'], files, description=file_path)
+    if file_path.startswith(tmp_dir_name):
+        os.remove(file_path)
+    if job['input_path'] != file_path:
+        os.remove(job['input_path'])
+
+# Estimated cost of running STREME on a FASTA file, from its size and, when it is local, its number of sequences
+# estimated from the first MB, so ordering the jobs does not read every input
+def estimate_streme_cost(file_name):
+    local_file_path = download_transfer.local_path(file_name)
+    if local_file_path is not None and os.path.isfile(local_file_path):
+        if compression_of_path(file_name) != NONE:
+            # Sequences of a compressed file are only counted once it is decompressed
+            return streme_cost(os.path.getsize(local_file_path))
+        return streme_cost(os.path.getsize(local_file_path), estimate_sequences(local_file_path))
+    try:
+        size = fasta_folder.get_path_details(file_name).get('size') or 0
+    except Exception as e:
+        logger.debug(f"No size available for {file_name}: {e}")
+        size = 0
+    return streme_cost(size)
+
+# Input size and number of sequences of a STREME job, for its run metrics record
+def streme_job_info(job):
+    return {'input_bytes': os.path.getsize(job['input_path']), 'sequences': count_sequences(job['input_path'])}
+
+# Download, process and upload each file in a pipeline: a file is submitted to STREME as soon as it has been
+# downloaded, and its results are uploaded and removed locally as soon as STREME is done
+def process_partition_streme(max_workers, streme_exec, streme_options):
+    files = [file_name for file_name in fasta_folder.list_paths_in_partition(partition_id) if is_fasta(file_name)]
+    if checkpoints is not None:
+        # Results of FASTA files removed or renamed since a previous run would otherwise stay in the partition
+        try:
+            stale = checkpoints.remove_stale([get_streme_output_path(file_name) for file_name in files], partition_folder)
+        except Exception as e:
+            logger.error(f"Failed to remove stale results of partition {partition_id}: {e}")
+            raise RuntimeError(f"Unable to remove stale results of partition {partition_id}")
+        if stale:
+            logger.info(f"Removed {len(stale)} files of previous results whose FASTA file no longer exists")
+        for file_name in files:
+            checkpoint_keys[file_name] = get_checkpoint_key(file_name)
+        completed = {file_name for file_name in files
+                     if checkpoints.is_done(get_streme_output_path(file_name), checkpoint_keys[file_name])}
+        if completed:
+            logger.info(f"Skipping {len(completed)} files completed by a previous run")
+        if write_motif_store:
+            for file_name in sorted(completed):
+                collect_completed_motifs(get_streme_output_path(file_name))
+        files = [file_name for file_name in files if file_name not in completed]
+    logger.info(f"Processing {len(files)} files with STREME")
+
+    runner = CommandRunner(max_workers, timeout=timeout_minutes * 60 if timeout_minutes > 0 else None)
+    executor = PipelinedExecutor(
+        functools.partial(streme_job_command, streme_exec=streme_exec, streme_options=streme_options),
+        download=stage_fasta,
+        upload=upload_streme_results,
+        max_workers=max_workers,
+        transfer_workers=transfer_workers,
+        bypass=lambda job: job['cached'],
+        cost=estimate_streme_cost,
+        memory_budget=memory_budget,
+        runner=runner,
+        metrics=run_metrics,
+        job_info=streme_job_info
+    )
+    start = time.perf_counter()
+    try:
+        with runner:
+            executor.run(files)
+    finally:
+        download_transfer.close()
+        upload_transfer.close()
+        if result_cache is not None:
+            result_cache.save_index()
+            logger.info(f"STREME result cache: {result_cache.hits} hits, {result_cache.misses} misses, {result_cache.size} bytes")
+    if write_motif_store:
+        with run_metrics.timer('motif_store'):
+            upload_motif_store()
+    elapsed = time.perf_counter() - start
+    logger.info(f"Downloaded {download_transfer.downloaded.describe(elapsed)}")
+    logger.info(f"Uploaded {upload_transfer.uploaded.describe(elapsed)}")
+
+# The run metrics are written whether the run succeeds or fails
+with run_metrics.report(streme_folder, f"{partition_folder}/{RUN_METRICS_NAME}", hook=metrics_hook):
+    process_partition_streme(max_workers, streme_exec, streme_options)
+    logger.debug(f"Uploaded file from {tmp_dir_name} to folder: {streme_output}")
+
+    # List the directory structure after processing
+    list_directory_contents(tmp_dir_name)
+
+    # Clean up the temp directory
+    with run_metrics.timer('cleanup'):
+        try:
+            shutil.rmtree(tmp_dir_name)
+            logger.info(f"Removed temporary directory: {tmp_dir_name}")
+        except Exception as e:
+            logger.error(f"Failed to remove temporary directory: {e}")
+            raise OSError("Failed to remove temporary directory.")
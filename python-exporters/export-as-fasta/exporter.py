@@ -1,4 +1,6 @@
 from dataiku.exporter import Exporter
+from memetools.fasta import FastaWriter
+from memetools.compression import CompressedWriter
 
 class FastaExporter(Exporter):
     """
@@ -14,16 +16,20 @@ class FastaExporter(Exporter):
         self.id_column = config.get('id_column', 'ID')
         self.sequence_column = config.get('sequence_column', 'Sequence')
         self.comment_column = config.get('comment_column', None)
+        self.compression = config.get('compression', 'none') or 'none'
         self.f = None
 
     def open_to_file(self, schema, destination_file_path):
         """
-        Open the file for writing in FASTA format.
+        Open the file for writing in FASTA format, compressed as configured.
         """
-        self.f = open(destination_file_path, 'w')
-        # Map column names to their indices for quick access
-        self.column_indices = {col['name']: idx for idx, col in enumerate(schema['columns'])}
-
+        self.f = CompressedWriter(open(destination_file_path, 'wb'), self.compression, close_stream=True)
+        self.writer = FastaWriter(self.f)
+        # Resolve the column indices once, write_row is called for every row
+        column_indices = {col['name']: idx for idx, col in enumerate(schema['columns'])}
+        self.id_idx = column_indices[self.id_column]
+        self.sequence_idx = column_indices[self.sequence_column]
+        self.comment_idx = column_indices.get(self.comment_column, None) if self.config.get('comment_column') != "None" else None
 
     def write_row(self, row):
         """
@@ -31,24 +37,15 @@ class FastaExporter(Exporter):
         - The FASTA format requires each entry to begin with a '>'
         followed by the identifier, then the optional comment, 
         and finally the sequence itself on the next line.
+        Rows are buffered by the writer and reach the file in large blocks.
         """
-        # Extract indices of columns
-        id_idx = self.column_indices[self.id_column]
-        sequence_idx = self.column_indices[self.sequence_column]
-        comment_idx = self.column_indices.get(self.comment_column, None) if self.config.get('comment_column') != "None" else None
-
-        # Extract values from the row
-        id_value = row[id_idx]
-        sequence_value = row[sequence_idx]
-        comment_value = row[comment_idx] if comment_idx is not None else ""
-
-        # Write the FASTA formatted entry
-        fasta_entry = f">{id_value} {comment_value}\n{sequence_value}\n"
-        self.f.write(fasta_entry)
+        comment_value = row[self.comment_idx] if self.comment_idx is not None else None
+        self.writer.write_record(row[self.id_idx], row[self.sequence_idx], comment_value)
 
     def close(self):
         """
         Close the file after finishing writing all the rows.
         """
         if self.f:
-            self.f.close()
\ No newline at end of file
+            self.writer.close()
+            self.f.close()
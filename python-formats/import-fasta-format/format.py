@@ -1,5 +1,7 @@
 from dataiku.customformat import Formatter, OutputFormatter, FormatExtractor
 import pandas as pd
+from memetools.fasta import FastaReader, FastaWriter
+from memetools.compression import compressed_reader
 
 class FastaFormatter(Formatter):
     def __init__(self, config, plugin_config):
@@ -9,7 +11,7 @@ class FastaFormatter(Formatter):
         Formatter.__init__(self, config, plugin_config)
 
     def get_output_formatter(self, stream, schema):
-        return FastaOutputFormatter(stream, schema)
+        return FastaOutputFormatter(stream, schema, self.config)
 
     def get_format_extractor(self, stream, schema=None):
         return FastaFormatExtractor(stream, schema)
@@ -32,6 +34,8 @@ class FastaOutputFormatter(OutputFormatter):
         self.sequence_column = config.get('sequence_column', 'Sequence')
         self.comment_column = config.get('comment_column', None)
         self.file_extension = config.get('file_extension', '.fasta')
+        # Split sequences into 60-character lines as per FASTA convention
+        self.writer = FastaWriter(stream, line_width=60)
 
     def write_row(self, row):
         # Each row must contain an ID and a Sequence at minimum
@@ -39,17 +43,14 @@ class FastaOutputFormatter(OutputFormatter):
         sequence = row.get(self.sequence_column, '')
         comment = row.get(self.comment_column, '') if self.comment_column else ''
 
-        # Write FASTA entry in the form:
+        # Buffer FASTA entry in the form:
         # >ID COMMENT
         # SEQUENCE
-        self.stream.write(f">{sequence_id} {comment}\n")
-        # Split sequence into 60-character lines as per FASTA convention
-        for i in range(0, len(sequence), 60):
-            self.stream.write(sequence[i:i+60] + '\n')
+        self.writer.write_record(sequence_id, sequence, comment)
 
     def write_footer(self):
-        # No footer required for FASTA
-        pass
+        # No footer required for FASTA, flush the buffered entries
+        self.writer.flush()
 
 
 
@@ -61,42 +62,20 @@ class FastaFormatExtractor(FormatExtractor):
         FormatExtractor.__init__(self, stream)
         self.stream = stream
         self.columns = ['ID', 'Comment', 'Sequence']
+        # Records are located in large byte blocks and decoded one at a time. gzip, BGZF and zstd
+        # files are decompressed on the fly, detected from their first bytes
+        self.reader = FastaReader(compressed_reader(stream))
 
     def read_row(self):
-        sequence_id = None
-        sequence = []
-        comment = ''
-        
-        for line in self.stream:
-            # Decode line if it's in bytes (common in binary streams)
-            if isinstance(line, bytes):
-                line = line.decode('utf-8')
-                
-            line = line.strip()
-            if line.startswith('>'):
-                if sequence_id is not None:
-                    # Yield previous sequence
-                    return {
-                        'ID': sequence_id,
-                        'Comment': comment,
-                        'Sequence': ''.join(sequence)
-                    }
-                # New sequence identifier
-                parts = line[1:].split(maxsplit=1)
-                sequence_id = parts[0]
-                comment = parts[1] if len(parts) > 1 else ''
-                sequence = []
-            else:
-                sequence.append(line)
-        
-        # Return the last sequence if any
-        if sequence_id is not None:
-            return {
-                'ID': sequence_id,
-                'Comment': comment,
-                'Sequence': ''.join(sequence)
-            }
-        return None
+        record = self.reader.read_record()
+        if record is None:
+            return None
+        sequence_id, comment, sequence = record
+        return {
+            'ID': sequence_id,
+            'Comment': comment,
+            'Sequence': sequence
+        }
 
     def read_schema(self):
         # This method returns the schema as the list of columns (ID, Comment, Sequence)
@@ -0,0 +1,142 @@
+import hashlib
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+from memetools.cache import file_digest
+from memetools.scanner import DNA_ALPHABET, INVALID_CODE, encode, iter_sequence_chunks
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ORDER = 0
+# Added to every k-mer count so that unseen k-mers keep a non-zero frequency
+DEFAULT_PSEUDOCOUNT = 1.0
+
+
+def _reverse_complement_indices(k):
+    """Index of the reverse complement of every k-mer, k-mers being base-4 numbers over ACGT."""
+    indices = np.arange(4 ** k)
+    digits = [(indices // 4 ** (k - 1 - position)) % 4 for position in range(k)]
+    complement = np.zeros_like(indices)
+    for position, digit in enumerate(digits):
+        # Complement of ACGT codes is 3 - code, and the last letter becomes the first
+        complement += (3 - digit) * 4 ** position
+    return complement
+
+
+def count_kmers(fasta_paths, order=DEFAULT_ORDER):
+    """
+    Counts of every k-mer for k = 1 .. order + 1 over FASTA files, as a list
+    of arrays indexed by base-4 k-mer numbers. Windows holding anything but
+    A, C, G or T, or spanning two sequences, are not counted.
+    """
+    counts = [np.zeros(4 ** k, dtype=np.int64) for k in range(1, order + 2)]
+    for fasta_path in fasta_paths:
+        for _, _, raw in iter_sequence_chunks(fasta_path):
+            codes = encode(raw).astype(np.int64)
+            invalid = np.concatenate(([0], np.cumsum(codes == INVALID_CODE)))
+            for k in range(1, order + 2):
+                windows = len(codes) - k + 1
+                if windows <= 0:
+                    continue
+                valid = invalid[k:k + windows] == invalid[:windows]
+                kmers = np.zeros(windows, dtype=np.int64)
+                for position in range(k):
+                    kmers = kmers * 4 + codes[position:position + windows]
+                counts[k - 1] += np.bincount(kmers[valid], minlength=4 ** k)
+    return counts
+
+
+class MarkovBackground(object):
+    """Frequencies of the k-mers of every length up to order + 1, in MEME background file format."""
+
+    def __init__(self, frequencies):
+        self.frequencies = frequencies
+
+    @property
+    def order(self):
+        return len(self.frequencies) - 1
+
+    @classmethod
+    def from_fasta(cls, fasta_paths, order=DEFAULT_ORDER, both_strands=True, pseudocount=DEFAULT_PSEUDOCOUNT):
+        """Model of the sequences of one or more FASTA files, counting both strands unless both_strands is False."""
+        frequencies = []
+        for k, kmer_counts in enumerate(count_kmers(fasta_paths, order), start=1):
+            kmer_counts = kmer_counts.astype(np.float64)
+            if both_strands:
+                kmer_counts = kmer_counts + kmer_counts[_reverse_complement_indices(k)]
+            kmer_counts += pseudocount
+            frequencies.append(kmer_counts / kmer_counts.sum())
+        return cls(frequencies)
+
+    def zero_order(self):
+        """Letter frequencies, in ACGT order."""
+        return self.frequencies[0]
+
+    def write(self, stream, comment=''):
+        if comment:
+            stream.write(f"# {comment}\n")
+        for k, frequencies in enumerate(self.frequencies, start=1):
+            stream.write(f"# order {k - 1}\n")
+            for index, frequency in enumerate(frequencies):
+                kmer = ''.join(DNA_ALPHABET[(index // 4 ** (k - 1 - position)) % 4] for position in range(k))
+                stream.write(f"{kmer} {frequency:.3e}\n")
+
+    @classmethod
+    def read(cls, path):
+        """Read a MEME background file, as written by write() or fasta-get-markov."""
+        by_length = {}
+        with open(path) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 2 or line.startswith('#'):
+                    continue
+                by_length.setdefault(len(fields[0]), {})[fields[0].upper()] = float(fields[1])
+        frequencies = []
+        for k in sorted(by_length):
+            values = by_length[k]
+            frequencies.append(np.array([
+                values.get(''.join(DNA_ALPHABET[(index // 4 ** (k - 1 - position)) % 4] for position in range(k)), 0.0)
+                for index in range(4 ** k)]))
+        return cls(frequencies)
+
+
+def content_key(digests):
+    """Key of the background of sequences given by the content digests of their FASTA files, in any order."""
+    digests = sorted(digests)
+    return digests[0] if len(digests) == 1 else hashlib.sha256(':'.join(digests).encode('utf-8')).hexdigest()
+
+
+class BackgroundCache(object):
+    """
+    Background files computed once per sequence content and kept in a
+    directory under <content digest>-o<order>.bg, so every FIMO run over the
+    same sequences shares one file, across runs when the directory persists.
+    """
+
+    def __init__(self, directory, order=DEFAULT_ORDER, both_strands=True):
+        self.directory = directory
+        self.order = order
+        self.both_strands = both_strands
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, fasta_paths):
+        """Background file of the sequences of one or more FASTA files, computed on first use."""
+        if isinstance(fasta_paths, str):
+            fasta_paths = [fasta_paths]
+        key = content_key(file_digest(fasta_path) for fasta_path in fasta_paths)
+        strands = '' if self.both_strands else '-norc'
+        path = os.path.join(self.directory, f"{key}-o{self.order}{strands}.bg")
+        if os.path.exists(path):
+            logger.debug(f"Background of {len(fasta_paths)} FASTA files found at {path}")
+            return path
+        model = MarkovBackground.from_fasta(fasta_paths, self.order, self.both_strands)
+        # Written under a temporary name first, so a concurrent reader never sees a partial file
+        fd, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            model.write(f, comment=f"{self.order}-order Markov frequencies of {len(fasta_paths)} FASTA files")
+        os.replace(temporary_path, path)
+        logger.info(f"Computed the background of {len(fasta_paths)} FASTA files into {path}")
+        return path
@@ -0,0 +1,232 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+HASH_BUFFER_SIZE = 8 * 1024 * 1024
+# Archives larger than this are spooled to disk while being built
+SPOOL_MAX_SIZE = 64 * 1024 * 1024
+
+
+def file_digest(path, algorithm='sha256'):
+    """Hex digest of a file's content, read in large blocks."""
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BUFFER_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def normalize_options(options):
+    """
+    Canonical form of a tool options map, so that equivalent settings give the
+    same cache key: keys without leading dashes, values as stripped strings,
+    'false' flags dropped (they are never passed to the tool), sorted by key.
+    """
+    normalized = {}
+    for key, value in (options or {}).items():
+        value = str(value).strip()
+        if value.lower() == 'false':
+            continue
+        normalized[str(key).strip().lstrip('-')] = value.lower() if value.lower() == 'true' else value
+    return sorted(normalized.items())
+
+
+def tool_version(exec_path):
+    """Output of `<exec_path> --version`, part of every cache key so upgrades invalidate results."""
+    result = subprocess.run([exec_path, '--version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=True)
+    return result.stdout.decode('utf-8', 'replace').strip()
+
+
+def cache_key(input_digest, options, version):
+    """Key of a tool run from the input content digest, the normalized options and the tool version."""
+    payload = json.dumps({'input': input_digest, 'options': normalize_options(options), 'version': version},
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResultCache(object):
+    """
+    Content-addressed cache of tool output directories.
+
+    Each entry is a gzipped tar archive of an output directory, stored in a
+    managed folder (dataiku.Folder or memetools.localfolder.LocalFolder for a
+    local directory) under `<key[:2]>/<key>.tar.gz`. An `index.json` file
+    records the size and last use of every entry; once the total size exceeds
+    `max_size` bytes, the least recently used entries are evicted.
+
+    Several runs may share a cache folder: save_index() merges the index
+    with the one saved by other runs since this one loaded it, and adopts
+    the archives no index knows of, so every entry is accounted for in
+    `max_size`. Folders have no locking, two runs saving at the very same
+    time can still lose an index update, whose archives are adopted by the
+    next save.
+    """
+
+    INDEX_PATH = '/index.json'
+
+    def __init__(self, folder, max_size=None):
+        """
+        :param folder: the folder holding the cache entries
+        :param max_size: maximum total size of the entries in bytes, None for no limit
+        """
+        self.folder = folder
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.index = self._load_index()
+        if self.index is None:
+            logger.info("No cache index found, starting an empty cache")
+            self.index = {}
+        # Entries this instance added and removed, applied over the saved index when merging
+        self._added = set()
+        self._removed = set()
+
+    def _load_index(self):
+        try:
+            with self.folder.get_download_stream(self.INDEX_PATH) as f:
+                return json.loads(f.read().decode('utf-8'))
+        except Exception:
+            return None
+
+    def _merge_index(self, saved):
+        """
+        This instance's view merged into the saved index: entries removed
+        here are dropped, entries added here are kept, and entries known to
+        both keep their latest use. Entries missing from the saved index that
+        this instance did not add were evicted by another run.
+        """
+        merged = {key: entry for key, entry in saved.items() if key not in self._removed}
+        for key, entry in self.index.items():
+            if key in merged:
+                merged[key] = dict(merged[key], last_used=max(merged[key]['last_used'], entry['last_used']))
+            elif key in self._added:
+                merged[key] = entry
+        return merged
+
+    def _adopt_orphans(self, index):
+        """Add the archives of the folder missing from the index, e.g. after a lost index update."""
+        for path in self.folder.list_paths_in_partition():
+            name = path.rsplit('/', 1)[-1]
+            if not name.endswith('.tar.gz'):
+                continue
+            key = name[:-len('.tar.gz')]
+            if key in index or key in self._removed or path != self._entry_path(key):
+                continue
+            details = self.folder.get_path_details(path)
+            index[key] = {'size': details.get('size') or 0,
+                          'last_used': (details.get('lastModified') or 0) / 1000.0, 'description': ''}
+            logger.info(f"Adopted cache entry {key} missing from the index")
+
+    def save_index(self):
+        """Merge the index with the one saved by other runs, evict entries over max_size, then save it."""
+        saved = self._load_index() or {}
+        with self._lock:
+            self.index = self._merge_index(saved)
+        try:
+            self._adopt_orphans(self.index)
+        except Exception as e:
+            logger.warning(f"Failed to look for cache entries missing from the index: {e}")
+        self.evict()
+        with self._lock:
+            data = json.dumps(self.index, sort_keys=True).encode('utf-8')
+        self.folder.upload_stream(self.INDEX_PATH, io.BytesIO(data))
+
+    @staticmethod
+    def _entry_path(key):
+        return f"/{key[:2]}/{key}.tar.gz"
+
+    @property
+    def size(self):
+        with self._lock:
+            return sum(entry['size'] for entry in self.index.values())
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self.index
+
+    def restore(self, key, output_dir):
+        """Extract the entry into output_dir. Returns False on a miss."""
+        with self._lock:
+            if key not in self.index:
+                self.misses += 1
+                return False
+        try:
+            os.makedirs(output_dir, exist_ok=True)
+            with self.folder.get_download_stream(self._entry_path(key)) as stream:
+                with tarfile.open(fileobj=stream, mode='r|gz') as archive:
+                    for member in archive:
+                        # Entries are written by store(), still refuse anything escaping output_dir
+                        if not member.isfile() or member.name.startswith('/') or '..' in member.name.split('/'):
+                            continue
+                        archive.extract(member, output_dir)
+        except Exception as e:
+            logger.warning(f"Failed to restore cache entry {key}, ignoring it: {e}")
+            with self._lock:
+                self.index.pop(key, None)
+                self._removed.add(key)
+                self.misses += 1
+            return False
+        with self._lock:
+            self.index[key]['last_used'] = time.time()
+            self.hits += 1
+        logger.debug(f"Restored cache entry {key} into {output_dir}")
+        return True
+
+    def store(self, key, output_dir, exclude=None, description=''):
+        """
+        Archive the files of output_dir as the entry `key`, then evict least recently used entries.
+        :param exclude: optional predicate on file names, matching files are not archived
+        :param description: what the entry holds, e.g. the partition and sample it was computed for
+        """
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as spool:
+            with tarfile.open(fileobj=spool, mode='w:gz') as archive:
+                for root, _, file_names in os.walk(output_dir):
+                    for file_name in file_names:
+                        if exclude is not None and exclude(file_name):
+                            continue
+                        path = os.path.join(root, file_name)
+                        archive.add(path, arcname=os.path.relpath(path, output_dir).replace(os.sep, '/'))
+            size = spool.tell()
+            spool.seek(0)
+            self.folder.upload_stream(self._entry_path(key), spool)
+        with self._lock:
+            self.index[key] = {'size': size, 'last_used': time.time(), 'description': description}
+            self._added.add(key)
+            self._removed.discard(key)
+        logger.debug(f"Stored cache entry {key} ({size} bytes)")
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits in max_size."""
+        if self.max_size is None:
+            return
+        with self._lock:
+            total = sum(entry['size'] for entry in self.index.values())
+            victims = []
+            for key, entry in sorted(self.index.items(), key=lambda item: item[1]['last_used']):
+                if total <= self.max_size:
+                    break
+                if key == keep:
+                    continue
+                victims.append(key)
+                total -= entry['size']
+            for key in victims:
+                del self.index[key]
+                self._removed.add(key)
+                self._added.discard(key)
+        for key in victims:
+            try:
+                self.folder.delete_path(self._entry_path(key))
+                logger.info(f"Evicted cache entry {key}")
+            except Exception as e:
+                logger.warning(f"Failed to delete evicted cache entry {key}: {e}")
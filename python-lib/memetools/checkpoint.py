@@ -0,0 +1,137 @@
+import json
+import logging
+import os
+import posixpath
+import shutil
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Completion marker of a job, named after the key its results were computed with
+MARKER_PREFIX = '.memetools-done-'
+# Suffix of the directory a job writes into before its results are moved in place
+STAGING_SUFFIX = '.partial'
+
+
+def staging_dir(output_dir):
+    """Empty staging directory next to output_dir, any leftover of an interrupted run being removed."""
+    staging = output_dir.rstrip(os.sep) + STAGING_SUFFIX
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    return staging
+
+
+def commit_staged(staging, output_dir, exclude=None):
+    """
+    Move the files of a staging directory into output_dir, replacing existing
+    files, then remove the staging directory. Each file is renamed in one
+    step, so readers of output_dir never see a partially written file.
+    Returns the list of moved files, in output_dir.
+    """
+    moved = []
+    for root, _, file_names in os.walk(staging):
+        for file_name in file_names:
+            if exclude is not None and exclude(file_name):
+                continue
+            source = os.path.join(root, file_name)
+            destination = os.path.join(output_dir, os.path.relpath(source, staging))
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            os.replace(source, destination)
+            moved.append(destination)
+    shutil.rmtree(staging, ignore_errors=True)
+    return moved
+
+
+class Checkpoints(object):
+    """
+    Completion markers of the jobs of a partition, kept in the output folder.
+
+    Once all results of a job are in the folder, a marker file named after the
+    job key (a hash of its input, options and tool version) is written in the
+    job output path. A job is done when its output path holds the marker of
+    its current key, so a run that failed or was killed keeps every job it
+    completed, and the next run only redoes the others. Markers are found by
+    listing the partition, none of them is read.
+    """
+
+    def __init__(self, folder, partition_id=None):
+        self.folder = folder
+        self._lock = threading.Lock()
+        self.markers = {}
+        # Output paths of the current jobs, set by remove_stale(), a job does not own the results nested in another's
+        self.output_paths = set()
+        self.paths = set(folder.list_paths_in_partition(partition_id))
+        for path in self.paths:
+            name = posixpath.basename(path)
+            if name.startswith(MARKER_PREFIX):
+                self.markers.setdefault(posixpath.dirname(path), set()).add(name[len(MARKER_PREFIX):])
+        logger.info(f"Found {sum(len(keys) for keys in self.markers.values())} completed jobs in {partition_id}")
+
+    @staticmethod
+    def _marker_path(output_path, key):
+        return f"{output_path.rstrip('/')}/{MARKER_PREFIX}{key}"
+
+    def is_done(self, output_path, key):
+        return key is not None and key in self.markers.get(output_path.rstrip('/'), ())
+
+    def invalidate(self, output_path):
+        """
+        Remove the markers and the previous results of a job about to be
+        recomputed, so no file of an earlier run under other options survives
+        next to the new results. Results nested in the output path of another
+        job are left alone.
+        """
+        output_path = output_path.rstrip('/')
+        with self._lock:
+            keys = self.markers.pop(output_path, set())
+            outputs = self.output_paths | set(self.markers) | {output_path}
+            owned = [path for path in self.paths if _owner(path, outputs) == output_path]
+            self.paths.difference_update(owned)
+        for key in keys:
+            self.folder.delete_path(self._marker_path(output_path, key))
+        marker_paths = {self._marker_path(output_path, key) for key in keys}
+        for path in sorted(owned):
+            if path not in marker_paths:
+                self.folder.delete_path(path)
+
+    def mark_done(self, output_path, key, files=(), description=''):
+        """Write the marker of a completed job, once all of its files are in the folder."""
+        if key is None:
+            return
+        output_path = output_path.rstrip('/')
+        data = json.dumps({'key': key, 'description': description, 'files': sorted(files)}, sort_keys=True)
+        self.folder.upload_data(self._marker_path(output_path, key), data.encode('utf-8'))
+        with self._lock:
+            self.markers[output_path] = {key}
+
+    def remove_stale(self, output_paths, root):
+        """
+        Delete the results of previous runs whose input is gone: every path
+        found under root that is outside the output paths of the current
+        jobs, or inside the output path of a marked job that is not current.
+        Files directly in root are left alone. Returns the deleted paths.
+        """
+        current = {output_path.rstrip('/') for output_path in output_paths}
+        self.output_paths = current
+        stale_outputs = [output_path for output_path in self.markers if output_path not in current]
+        root = root.rstrip('/')
+        removed = []
+        for path in sorted(self.paths):
+            if posixpath.dirname(path) == root:
+                continue
+            owner = _owner(path, current)
+            stale_owner = _owner(path, stale_outputs)
+            if owner is None or (stale_owner is not None and len(stale_owner) > len(owner)):
+                self.folder.delete_path(path)
+                removed.append(path)
+        with self._lock:
+            self.paths.difference_update(removed)
+            for output_path in stale_outputs:
+                self.markers.pop(output_path, None)
+        return removed
+
+
+def _owner(path, output_paths):
+    """Longest of output_paths holding path, None when none does."""
+    owners = [output_path for output_path in output_paths if path.startswith(output_path + '/')]
+    return max(owners, key=len) if owners else None
@@ -0,0 +1,241 @@
+import logging
+import os
+
+import numpy as np
+
+from memetools.background import MarkovBackground
+from memetools.scanner import ScoredMotif, encode, reverse_complement, INVALID_CODE, DEFAULT_PSEUDOCOUNT
+
+logger = logging.getLogger(__name__)
+
+# Mean column Pearson correlation above which a motif is merged into a representative
+DEFAULT_SIMILARITY = 0.95
+# Representatives are scanned at threshold times this, so windows passing for a member but not quite for its
+# representative are still found
+DEFAULT_THRESHOLD_SLACK = 10.0
+
+
+def _normalized_columns(probabilities):
+    """Centered, unit-norm rows, so the Pearson correlation of two motif columns is a dot product."""
+    centered = probabilities - probabilities.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(centered, axis=1, keepdims=True)
+    return np.divide(centered, norms, out=np.zeros_like(centered), where=norms > 0)
+
+
+class MotifClusters(object):
+    """
+    Assignment of every motif of a MotifSet to a representative motif.
+
+    Motif i is found inside its representative representative[i], starting at
+    column offset[i] of the representative, on the opposite strand when
+    reverse[i] is true. Representatives are their own representative.
+    """
+
+    def __init__(self, representative, offset, reverse, similarity):
+        self.representative = representative
+        self.offset = offset
+        self.reverse = reverse
+        self.similarity = similarity
+
+    @property
+    def representatives(self):
+        return np.nonzero(self.representative == np.arange(len(self.representative)))[0]
+
+    def members(self, representative):
+        return np.nonzero(self.representative == representative)[0]
+
+
+def cluster_motifs(motif_set, min_similarity=DEFAULT_SIMILARITY):
+    """
+    Greedy clustering of near-identical motifs, across all samples of a MotifSet.
+
+    Motifs are visited from the widest to the narrowest, and by increasing
+    E-value. Each one is aligned against the representatives found so far, at
+    every offset where it fits entirely inside them and on both strands, like
+    Tomtom with the Pearson correlation of columns. It joins the best
+    alignment when the mean column correlation reaches min_similarity, and
+    becomes a representative otherwise. All alignments of one motif are
+    scored at once from the column correlation matrix.
+    """
+    count = len(motif_set)
+    widths = motif_set.widths
+    normalized = _normalized_columns(np.asarray(motif_set.probabilities))
+    # Reverse complement of a DNA matrix: reversed positions and reversed ACGT columns
+    complementable = motif_set.alphabet == 'ACGT'
+
+    representative = np.arange(count)
+    offset = np.zeros(count, dtype=np.int64)
+    reverse = np.zeros(count, dtype=bool)
+    similarity = np.ones(count)
+
+    rep_rows = np.zeros(0, dtype=np.int64)
+    rep_of_row = np.zeros(0, dtype=np.int64)
+    order = sorted(range(count), key=lambda index: (-widths[index], np.nan_to_num(motif_set.evalues[index], nan=np.inf)))
+    for index in order:
+        width = int(widths[index])
+        query = normalized[motif_set.offsets[index]:motif_set.offsets[index + 1]]
+        windows = len(rep_rows) - width + 1
+        best = (-np.inf, None, 0, False)
+        if windows > 0 and width > 0:
+            # An alignment starts at a representative row and covers `width` rows of that same representative
+            valid = rep_of_row[:windows] == rep_of_row[width - 1:width - 1 + windows]
+            targets = normalized[rep_rows]
+            orientations = [(query, False)]
+            if complementable:
+                orientations.append((query[::-1, ::-1], True))
+            for oriented, is_reverse in orientations:
+                correlations = targets @ oriented.T
+                scores = np.zeros(windows)
+                for column in range(width):
+                    scores += correlations[column:column + windows, column]
+                scores = np.where(valid, scores / width, -np.inf)
+                start = int(np.argmax(scores))
+                if scores[start] > best[0]:
+                    rep = int(rep_of_row[start])
+                    first_row = int(np.searchsorted(rep_of_row, rep))
+                    best = (scores[start], rep, start - first_row, is_reverse)
+        if best[1] is not None and best[0] >= min_similarity:
+            similarity[index], representative[index], offset[index], reverse[index] = best
+        else:
+            rows = np.arange(motif_set.offsets[index], motif_set.offsets[index + 1])
+            rep_rows = np.concatenate((rep_rows, rows))
+            rep_of_row = np.concatenate((rep_of_row, np.full(len(rows), index)))
+    clusters = MotifClusters(representative, offset, reverse, similarity)
+    logger.info(f"Clustered {count} motifs into {len(clusters.representatives)} representatives")
+    return clusters
+
+
+def _member_hit(fields, width, rep_width, offset, is_reverse):
+    """Coordinates, strand and matched sequence of a member motif inside a hit of its representative."""
+    start, stop, strand, matched = int(fields[3]), int(fields[4]), fields[5], fields[9]
+    if len(matched) != rep_width:
+        return None
+    # The matched sequence reads in the representative's orientation, the member is a slice of it
+    sub = matched[offset:offset + width]
+    if strand == '+':
+        start = start + offset
+    else:
+        start = stop - offset - width + 1
+    if is_reverse:
+        strand = '-' if strand == '+' else '+'
+        sub = reverse_complement(sub.encode('ascii')).decode('ascii')
+    return start, start + width - 1, strand, sub
+
+
+class HitExpander(object):
+    """
+    Turns the hits of the representative motifs into hits of every member.
+
+    The scan runs on a MEME file holding only the representatives, whose motif
+    IDs are their index in the MotifSet (see write_meme), at the looser
+    `scan_threshold`. A member's occurrence is derived from each hit of its
+    representative; its score and p-value are recomputed with the member's own
+    matrix and background and kept when they pass threshold. Representatives
+    keep FIMO's values when the scan used a background file, and are rescored
+    the same way otherwise, since the representatives file holds the mean
+    background of all samples. Rescored hits have an empty q-value. Like the
+    scanner, rescoring only supports zero-order backgrounds.
+
+    A member window is only found when its representative passes the scan
+    threshold there, so the expansion can still miss hits that a scan of the
+    member itself would report.
+    """
+
+    def __init__(self, motif_set, clusters, threshold, pseudocount=DEFAULT_PSEUDOCOUNT,
+                 slack=DEFAULT_THRESHOLD_SLACK):
+        self.motif_set = motif_set
+        self.clusters = clusters
+        self.threshold = threshold
+        self.pseudocount = pseudocount
+        self.scan_threshold = min(threshold * max(slack, 1.0), 1.0)
+        self._scorers = {}
+
+    def _scorer(self, index, background=None):
+        key = (index, background)
+        if key not in self._scorers:
+            frequencies = self.motif_set.background(index)
+            if background is not None:
+                model = MarkovBackground.read(background)
+                if model.order > 0:
+                    raise ValueError(f"Hits can only be rescored with zero-order backgrounds, {background} has order "
+                                     f"{model.order}")
+                frequencies = model.zero_order()
+            self._scorers[key] = ScoredMotif(self.motif_set.motif(index), frequencies, self.pseudocount)
+        return self._scorers[key]
+
+    def _rescore(self, index, matched, background=None):
+        scorer = self._scorer(index, background)
+        codes = encode(matched)
+        if (codes == INVALID_CODE).any():
+            return None
+        score = int(scorer.forward[np.arange(len(codes)), codes].sum())
+        pvalue = float(scorer.pvalues[score])
+        if pvalue > self.threshold:
+            return None
+        return scorer.raw_score(score), pvalue
+
+    def expand(self, tsv_path, outputs, file_name='fimo.tsv', background=None):
+        """
+        Write the hits of every member motif to <outputs[sample]>/<file_name>,
+        for the samples present in outputs. Returns {sample: number of hits}.
+        :param background: background file the scan used instead of the motif backgrounds, if any
+        """
+        motif_set, clusters = self.motif_set, self.clusters
+        hits = {}
+        comments = []
+        with open(tsv_path) as f:
+            header = f.readline()
+            for line in f:
+                if not line.strip():
+                    continue
+                if line.startswith('#'):
+                    comments.append(line)
+                    continue
+                fields = line.rstrip('\n').split('\t')
+                hits.setdefault(int(fields[0]), []).append(fields)
+
+        counts = dict.fromkeys(outputs, 0)
+        streams = {}
+        try:
+            for sample, output_dir in outputs.items():
+                os.makedirs(output_dir, exist_ok=True)
+                streams[sample] = open(os.path.join(output_dir, file_name), 'w')
+                streams[sample].write(header)
+            for index in range(len(motif_set)):
+                sample = motif_set.sample(index)
+                rep = int(clusters.representative[index])
+                if sample not in streams or rep not in hits:
+                    continue
+                stream = streams[sample]
+                motif_id, alt_id = motif_set.ids[index], motif_set.alt_ids[index]
+                if rep == index and background is not None:
+                    for fields in hits[rep]:
+                        if float(fields[7]) <= self.threshold:
+                            stream.write('\t'.join([motif_id, alt_id] + fields[2:]) + '\n')
+                            counts[sample] += 1
+                    continue
+                width, rep_width = int(motif_set.widths[index]), int(motif_set.widths[rep])
+                rows = []
+                for fields in hits[rep]:
+                    member = _member_hit(fields, width, rep_width, int(clusters.offset[index]),
+                                         bool(clusters.reverse[index]))
+                    if member is None:
+                        continue
+                    start, stop, strand, matched = member
+                    scored = self._rescore(index, matched, background)
+                    if scored is None:
+                        continue
+                    score, pvalue = scored
+                    rows.append((pvalue, [motif_id, alt_id, fields[2], str(start), str(stop), strand,
+                                          f"{score:.6g}", f"{pvalue:.3g}", '', matched]))
+                rows.sort(key=lambda row: row[0])
+                stream.writelines('\t'.join(row) + '\n' for _, row in rows)
+                counts[sample] += len(rows)
+            if comments:
+                for stream in streams.values():
+                    stream.write('\n')
+                    stream.writelines(comments)
+        finally:
+            for stream in streams.values():
+                stream.close()
+        return counts
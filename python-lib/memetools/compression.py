@@ -0,0 +1,277 @@
+import gzip
+import io
+import logging
+import os
+import shutil
+import struct
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    # Optional, zstd files can only be read and written when it is installed
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+NONE = 'none'
+GZIP = 'gzip'
+BGZF = 'bgzf'
+ZSTD = 'zstd'
+COMPRESSIONS = (NONE, GZIP, BGZF, ZSTD)
+
+# File name suffix of each compression; BGZF files are gzip files, as written by bgzip
+SUFFIXES = {NONE: '', GZIP: '.gz', BGZF: '.gz', ZSTD: '.zst'}
+COMPRESSED_SUFFIXES = ('.gz', '.bgz', '.zst')
+FASTA_SUFFIXES = ('.fasta', '.fa')
+DEFAULT_LEVELS = {GZIP: 6, BGZF: 6, ZSTD: 3}
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+COPY_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Uncompressed bytes per BGZF block, the size bgzip uses so that any block fits the 64 KB limit once compressed
+BGZF_BLOCK_SIZE = 0xff00
+# Empty block terminating a BGZF file
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+
+def compression_of_path(path):
+    """Compression of a file from its name: gzip for .gz and .bgz (BGZF files are read as gzip), zstd for .zst."""
+    if path.endswith(('.gz', '.bgz')):
+        return GZIP
+    if path.endswith('.zst'):
+        return ZSTD
+    return NONE
+
+
+def strip_compression_suffix(path):
+    for suffix in COMPRESSED_SUFFIXES:
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+
+def is_fasta(path):
+    """Whether a file name is a FASTA file: .fasta or .fa, optionally compressed (.gz, .bgz, .zst)."""
+    return strip_compression_suffix(path).endswith(FASTA_SUFFIXES)
+
+
+def fasta_stem(path):
+    """File name of a FASTA file without its FASTA and compression extensions, e.g. S1 for /P1/S1/S1.fasta.gz."""
+    name = strip_compression_suffix(os.path.basename(path))
+    for suffix in FASTA_SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return os.path.splitext(name)[0]
+
+
+def plain_fasta_path(path):
+    """Path of the uncompressed copy of a FASTA file, always ending in .fasta."""
+    return os.path.join(os.path.dirname(path), fasta_stem(path) + '.fasta')
+
+
+def fasta_file_name(stem, compression=NONE):
+    return f"{stem}.fasta{SUFFIXES[compression]}"
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise RuntimeError("zstd compression requires the zstandard package, add it to the plugin code environment")
+
+
+class _PrefixedStream(io.RawIOBase):
+    """A readable stream returning `prefix` and then the rest of `stream`, to sniff non-seekable streams."""
+
+    def __init__(self, prefix, stream):
+        self._prefix = prefix
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._prefix:
+            count = min(len(buffer), len(self._prefix))
+            buffer[:count] = self._prefix[:count]
+            self._prefix = self._prefix[count:]
+            return count
+        data = self._stream.read(len(buffer))
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def _read_prefix(stream, size):
+    prefix = b''
+    while len(prefix) < size:
+        data = stream.read(size - len(prefix))
+        if not data:
+            break
+        prefix += data.encode('utf-8') if isinstance(data, str) else data
+    return prefix
+
+
+def compressed_reader(stream):
+    """
+    A binary stream of the decompressed content of `stream`, whose compression
+    (gzip, BGZF, zstd or none) is detected from its first bytes, so any
+    readable stream works, seekable or not. Closing it does not close `stream`.
+    """
+    prefix = _read_prefix(stream, len(ZSTD_MAGIC))
+    raw = io.BufferedReader(_PrefixedStream(prefix, stream), buffer_size=COPY_BUFFER_SIZE)
+    if prefix.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+    if prefix.startswith(ZSTD_MAGIC):
+        _require_zstandard()
+        return zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+    return raw
+
+
+def is_compressed_file(path):
+    with open(path, 'rb') as f:
+        prefix = f.read(len(ZSTD_MAGIC))
+    return prefix.startswith(GZIP_MAGIC) or prefix.startswith(ZSTD_MAGIC)
+
+
+class BgzfWriter(io.RawIOBase):
+    """
+    Writes BGZF, the blocked gzip of bgzip and htslib: a series of gzip
+    members of at most 64 KB each carrying its size, ended by an empty block.
+    Any gzip reader can read it, and htslib tools can seek in it.
+    """
+
+    def __init__(self, stream, level=DEFAULT_LEVELS[BGZF]):
+        self._stream = stream
+        self._level = level
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= BGZF_BLOCK_SIZE:
+            self._write_block(bytes(self._buffer[:BGZF_BLOCK_SIZE]))
+            del self._buffer[:BGZF_BLOCK_SIZE]
+        return len(data)
+
+    def _write_block(self, data):
+        compressor = zlib.compressobj(self._level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        compressed = compressor.compress(data) + compressor.flush()
+        # Gzip header with the BC extra field holding the total block size minus 1
+        header = struct.pack('<4BI2BH2BHH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, 66, 67, 2, len(compressed) + 25)
+        self._stream.write(header + compressed + struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data)))
+
+    def close(self):
+        if not self.closed:
+            if self._buffer:
+                self._write_block(bytes(self._buffer))
+                del self._buffer[:]
+            self._stream.write(BGZF_EOF)
+        super(BgzfWriter, self).close()
+
+
+class CompressedWriter(object):
+    """
+    A binary writable stream compressing what is written to `stream`. close()
+    finishes the compressed data, and closes `stream` with close_stream=True.
+    Appending to a file holding complete compressed data gives a valid file:
+    gzip members, BGZF blocks and zstd frames can be concatenated.
+    """
+
+    def __init__(self, stream, compression, level=None, close_stream=False):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unsupported compression {compression}, use one of {', '.join(COMPRESSIONS)}")
+        self.stream = stream
+        self.compression = compression
+        self.close_stream = close_stream
+        level = level if level is not None else DEFAULT_LEVELS.get(compression)
+        if compression == GZIP:
+            self._writer = gzip.GzipFile(fileobj=stream, mode='wb', compresslevel=level, mtime=0)
+        elif compression == BGZF:
+            self._writer = BgzfWriter(stream, level)
+        elif compression == ZSTD:
+            _require_zstandard()
+            self._writer = zstandard.ZstdCompressor(level=level).stream_writer(stream, closefd=False)
+        else:
+            self._writer = None
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, data):
+        if self._writer is None:
+            return self.stream.write(data)
+        return self._writer.write(data)
+
+    def flush(self):
+        # Flushing a compressor mid-stream only hurts the ratio, the compressed data is complete on close()
+        if self._writer is None and hasattr(self.stream, 'flush'):
+            self.stream.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._writer is not None:
+            self._writer.close()
+        if self.close_stream:
+            self.stream.close()
+
+
+def open_compressed(path, mode='rb', compression=None, level=None):
+    """
+    Open a local file for reading, decompressing it whatever its compression,
+    or for writing ('wb') or appending ('ab'), compressing with `compression`,
+    by default the one of its name.
+    """
+    if mode == 'rb':
+        f = open(path, 'rb')
+        reader = compressed_reader(f)
+        if reader is f:
+            return f
+        return _ClosingReader(reader, f)
+    if compression is None:
+        compression = compression_of_path(path)
+    return CompressedWriter(open(path, mode), compression, level, close_stream=True)
+
+
+class _ClosingReader(io.RawIOBase):
+    """A decompressing reader closing the underlying file with itself."""
+
+    def __init__(self, reader, f):
+        self._reader = reader
+        self._file = f
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        return self._reader.read(size)
+
+    def readinto(self, buffer):
+        data = self._reader.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._reader.close()
+            self._file.close()
+        super(_ClosingReader, self).close()
+
+
+def decompress_file(source, destination):
+    """Write the decompressed content of `source` to `destination`, returns the number of bytes written."""
+    os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+    with open_compressed(source) as reader, open(destination, 'wb') as out:
+        shutil.copyfileobj(reader, out, COPY_BUFFER_SIZE)
+        size = out.tell()
+    logger.debug(f"Decompressed {source} to {destination} ({size} bytes)")
+    return size
@@ -0,0 +1,146 @@
+import hashlib
+import logging
+import os
+import random
+
+from memetools.fasta import DEFAULT_CHUNK_SIZE, FastaReader
+
+logger = logging.getLogger(__name__)
+
+# Written next to the STREME results: which representative each input sequence was collapsed into
+SEQUENCE_MAP_NAME = 'sequence_map.tsv'
+SEQUENCE_MAP_COLUMNS = ('sequence_id', 'representative_id')
+
+# Size in bytes of the sequence digests, collisions are negligible at 128 bits
+DIGEST_SIZE = 16
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+def sequence_digest(sequence):
+    """Digest of a sequence given as bytes without line breaks, ignoring case."""
+    return hashlib.blake2b(sequence.upper(), digest_size=DIGEST_SIZE).digest()
+
+
+class CollapseStats(object):
+    """Number of records and residues read, distinct, and written by collapse_fasta."""
+
+    def __init__(self):
+        self.records = 0
+        self.unique = 0
+        self.kept = 0
+        self.residues = 0
+        self.unique_residues = 0
+        self.kept_residues = 0
+
+    def describe(self):
+        ratio = self.residues / self.kept_residues if self.kept_residues else 0
+        return (f"{self.records} sequences, {self.unique} distinct, {self.kept} kept: "
+                f"{self.residues} residues reduced to {self.kept_residues} ({ratio:.1f}x)")
+
+
+def collapse_fasta(source, destination, map_path=None, max_sequences=None, seed=0, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Write the distinct sequences of a FASTA file to `destination`, each under
+    the header of its first occurrence, in input order.
+
+    Sequences are compared by a digest of their residues (line breaks removed,
+    case ignored), so only digests and IDs are kept in memory: a first pass
+    hashes every record and writes the mapping, a second pass copies the kept
+    records. With `max_sequences`, that many distinct sequences are drawn
+    uniformly with a random generator seeded by `seed`, so a given input is
+    always reduced to the same sequences.
+
+    :param source: path of the FASTA file to collapse
+    :param destination: path of the collapsed FASTA file
+    :param map_path: optional path of a TSV file receiving, for every input
+                     sequence, the ID of the sequence it was collapsed into. Kept
+                     for every input sequence, including the ones of distinct
+                     sequences left out by subsampling
+    :param max_sequences: maximum number of distinct sequences written, None for all
+    :param seed: seed of the subsampling
+    :return: a CollapseStats
+    """
+    stats = CollapseStats()
+    representatives = {}
+    # Ordinal in the input of the first occurrence of every distinct sequence, and its length
+    first_records = []
+    lengths = []
+
+    map_file = None
+    if map_path is not None:
+        os.makedirs(os.path.dirname(map_path) or '.', exist_ok=True)
+        map_file = open(map_path, 'w', buffering=WRITE_BUFFER_SIZE)
+        map_file.write('\t'.join(SEQUENCE_MAP_COLUMNS) + '\n')
+    try:
+        representative_ids = []
+        with open(source, 'rb') as f:
+            reader = FastaReader(f, chunk_size=chunk_size)
+            while True:
+                raw = reader.read_record_bytes()
+                if raw is None:
+                    break
+                header, sequence = raw
+                digest = sequence_digest(sequence)
+                index = representatives.get(digest)
+                if index is None:
+                    index = representatives[digest] = len(first_records)
+                    first_records.append(stats.records)
+                    lengths.append(len(sequence))
+                    if map_file is not None:
+                        representative_ids.append(_header_id(header))
+                if map_file is not None:
+                    map_file.write(f"{_header_id(header)}\t{representative_ids[index]}\n")
+                stats.records += 1
+                stats.residues += len(sequence)
+    finally:
+        if map_file is not None:
+            map_file.close()
+
+    stats.unique = len(first_records)
+    stats.unique_residues = sum(lengths)
+    selected = range(stats.unique)
+    if max_sequences is not None and 0 < max_sequences < stats.unique:
+        selected = sorted(random.Random(seed).sample(range(stats.unique), max_sequences))
+    kept = {first_records[index] for index in selected}
+    stats.kept = len(kept)
+    stats.kept_residues = sum(lengths[index] for index in selected)
+
+    os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+    with open(source, 'rb') as f, open(destination, 'wb', buffering=WRITE_BUFFER_SIZE) as out:
+        reader = FastaReader(f, chunk_size=chunk_size)
+        ordinal = 0
+        while True:
+            raw = reader.read_record_bytes()
+            if raw is None:
+                break
+            if ordinal in kept:
+                header, sequence = raw
+                out.write(b'>' + header.rstrip(b'\r') + b'\n' + sequence + b'\n')
+            ordinal += 1
+    logger.debug(f"Collapsed {source}: {stats.describe()}")
+    return stats
+
+
+def _header_id(header):
+    parts = header.split(None, 1)
+    return parts[0].decode('utf-8', 'replace') if parts else ''
+
+
+def read_sequence_map(source):
+    """
+    {representative ID: [IDs of the input sequences it stands for]} from a
+    mapping written by collapse_fasta, given as a path or a binary stream.
+    """
+    members = {}
+    stream = open(source, 'rb') if isinstance(source, str) else source
+    try:
+        header = stream.readline()
+        if tuple(header.decode('utf-8').rstrip('\r\n').split('\t')) != SEQUENCE_MAP_COLUMNS:
+            raise ValueError(f"Not a sequence map: unexpected header {header[:100]!r}")
+        for line in stream:
+            sequence_id, representative_id = line.decode('utf-8').rstrip('\r\n').split('\t')
+            members.setdefault(representative_id, []).append(sequence_id)
+    finally:
+        if stream is not source:
+            stream.close()
+    return members
@@ -0,0 +1,137 @@
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from memetools.fasta import FastaWriter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_OPEN_FILES = 256
+# Sample of the DataFrame rows without a sample ID
+UNASSIGNED_SAMPLE = 'unassigned'
+
+
+class SampleDemultiplexer(object):
+    """
+    Routes FASTA records to one output file per sample in a single pass.
+
+    Output streams are obtained from `open_stream(sample_id, append)` and kept
+    in a bounded pool. When the pool is full the least recently used stream is
+    closed; if its sample shows up again the stream is reopened with
+    append=True, so the factory must support appending (e.g. local files opened
+    in 'ab' mode). Input may arrive in any number of chunks.
+    """
+
+    def __init__(self, open_stream, max_open_files=DEFAULT_MAX_OPEN_FILES, max_workers=1, line_width=None):
+        """
+        :param open_stream: callable (sample_id, append) returning a binary writable stream
+        :param max_open_files: maximum number of streams kept open at the same time
+        :param max_workers: number of threads writing the samples of a chunk in parallel, 1 to write serially
+        :param line_width: wrap sequences to this many residues per line, None to keep one line
+        """
+        if max_open_files < 1:
+            raise ValueError("max_open_files must be at least 1")
+        self.open_stream = open_stream
+        self.max_open_files = max_open_files
+        self.line_width = line_width
+        self._open = OrderedDict()
+        self._records = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers) if max_workers > 1 else None
+        self.evictions = 0
+        self.unassigned = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def samples(self):
+        """Sample IDs in order of first appearance."""
+        return list(self._records)
+
+    def records_written(self, sample_id):
+        return self._records.get(sample_id, 0)
+
+    def _close_stream(self, sample_id):
+        stream, writer = self._open.pop(sample_id)
+        writer.close()
+        stream.close()
+
+    def _acquire(self, sample_id):
+        """Return the writer of a sample, opening (or reopening for append) its stream if needed."""
+        entry = self._open.get(sample_id)
+        if entry is not None:
+            self._open.move_to_end(sample_id)
+            return entry[1]
+        while len(self._open) >= self.max_open_files:
+            evicted = next(iter(self._open))
+            self._close_stream(evicted)
+            self.evictions += 1
+            logger.debug(f"Closed least recently used output for sample {evicted}")
+        append = sample_id in self._records
+        stream = self.open_stream(sample_id, append)
+        writer = FastaWriter(stream, line_width=self.line_width)
+        self._open[sample_id] = (stream, writer)
+        self._records.setdefault(sample_id, 0)
+        return writer
+
+    def write_groups(self, groups):
+        """
+        Write records already grouped by sample, as an iterable of
+        (sample_id, ids, sequences) tuples, typically the groups of one chunk.
+        """
+        groups = list(groups)
+        # Samples are handled at most max_open_files at a time, so acquiring the
+        # writers of a batch never evicts a writer of the same batch
+        for start in range(0, len(groups), self.max_open_files):
+            batch = groups[start:start + self.max_open_files]
+            writers = [self._acquire(sample_id) for sample_id, _, _ in batch]
+            if self._executor is None:
+                for writer, (_, ids, sequences) in zip(writers, batch):
+                    writer.write_columns(ids, sequences)
+            else:
+                futures = [self._executor.submit(writer.write_columns, ids, sequences)
+                           for writer, (_, ids, sequences) in zip(writers, batch)]
+                for future in futures:
+                    future.result()
+            for sample_id, ids, _ in batch:
+                self._records[sample_id] += len(ids)
+
+    def write_records(self, records):
+        """Write an iterable of (sample_id, sequence_id, sequence) tuples."""
+        groups = OrderedDict()
+        for sample_id, sequence_id, sequence in records:
+            group = groups.get(sample_id)
+            if group is None:
+                group = groups[sample_id] = ([], [])
+            group[0].append(sequence_id)
+            group[1].append(sequence)
+        self.write_groups((sample_id, ids, sequences) for sample_id, (ids, sequences) in groups.items())
+
+    def write_dataframe(self, df, sample_column, id_column, sequence_column):
+        """
+        Write a DataFrame chunk, rows are grouped by sample with a single hash pass.
+        Rows without a sample ID (None or NaN) go to the UNASSIGNED_SAMPLE sample.
+        """
+        ids = df[id_column].values
+        sequences = df[sequence_column].values
+        samples = df[sample_column]
+        missing = samples.isna()
+        unassigned = int(missing.sum())
+        if unassigned:
+            samples = samples.astype(object).where(~missing, UNASSIGNED_SAMPLE)
+            self.unassigned += unassigned
+            logger.warning(f"{unassigned} rows without {sample_column}, written to sample {UNASSIGNED_SAMPLE}")
+        indices = samples.groupby(samples, sort=False).indices
+        self.write_groups((sample_id, ids[positions], sequences[positions])
+                          for sample_id, positions in indices.items())
+
+    def close(self):
+        """Close every open stream and stop the writer threads."""
+        while self._open:
+            self._close_stream(next(iter(self._open)))
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
@@ -0,0 +1,222 @@
+import collections
+import io
+import logging
+import mmap
+import os
+
+logger = logging.getLogger(__name__)
+
+FAI_SUFFIX = '.fai'
+
+# One line of a samtools .fai index: sequence name, number of bases, byte offset of the first base,
+# bases per line and bytes per line including the line break
+FaiEntry = collections.namedtuple('FaiEntry', ['name', 'length', 'offset', 'linebases', 'linewidth'])
+
+
+def fai_path(fasta_path):
+    return fasta_path + FAI_SUFFIX
+
+
+def fai_name(sequence_id):
+    """Name a record is indexed under: its ID up to the first whitespace, as samtools does."""
+    parts = str(sequence_id).split(None, 1)
+    return parts[0] if parts else ''
+
+
+class FastaIndex(object):
+    """
+    The samtools faidx index of a plain FASTA file, entries in file order.
+    Like samtools, only the first record of a name is indexed.
+    """
+
+    def __init__(self):
+        self.entries = collections.OrderedDict()
+        self.duplicates = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __getitem__(self, name):
+        return self.entries[name]
+
+    def __iter__(self):
+        return iter(self.entries.values())
+
+    @property
+    def names(self):
+        return list(self.entries)
+
+    def add(self, name, length, offset, linebases, linewidth):
+        if name in self.entries:
+            self.duplicates += 1
+            return
+        self.entries[name] = FaiEntry(name, length, offset, linebases, linewidth)
+
+    def write(self, stream):
+        """Write the index in .fai format to a binary (or text) stream."""
+        text = ''.join(f"{entry.name}\t{entry.length}\t{entry.offset}\t{entry.linebases}\t{entry.linewidth}\n"
+                       for entry in self.entries.values())
+        stream.write(text if isinstance(stream, io.TextIOBase) else text.encode('utf-8'))
+        if self.duplicates:
+            logger.warning(f"{self.duplicates} records with an already indexed name were left out of the index")
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            self.write(f)
+
+    @classmethod
+    def load(cls, source):
+        """Read a .fai index from a path or a binary stream."""
+        index = cls()
+        stream = open(source, 'rb') if isinstance(source, str) else source
+        try:
+            for line in stream:
+                fields = line.decode('utf-8').rstrip('\r\n').split('\t')
+                if len(fields) < 5:
+                    raise ValueError(f"Invalid .fai line: {line[:100]!r}")
+                index.add(fields[0], *(int(value) for value in fields[1:5]))
+        finally:
+            if stream is not source:
+                stream.close()
+        return index
+
+
+def _index_record(index, name, body, offset, path):
+    """Add a record from its sequence bytes `body` (with line breaks) starting at byte `offset` of the file."""
+    end = len(body)
+    while end and body[end - 1] in b'\r\n':
+        end -= 1
+    if not end:
+        index.add(name, 0, offset, 0, 0)
+        return
+    first_break = body.find(b'\n', 0, end)
+    if first_break == -1:
+        index.add(name, end, offset, end, len(body) if len(body) > end else end + 1)
+        return
+    linewidth = first_break + 1
+    linebases = len(body[:first_break].rstrip(b'\r'))
+    # Full lines all end at a multiple of linewidth, the last line may be shorter; checked with C-level slicing
+    breaks = body[linewidth - 1:end:linewidth]
+    last_line = end - len(breaks) * linewidth
+    if (breaks.count(b'\n') != len(breaks) or body.count(b'\n', 0, end) != len(breaks)
+            or last_line > linebases or last_line < 0):
+        raise ValueError(f"Sequence {name} of {path} has lines of different lengths, it cannot be indexed")
+    index.add(name, len(breaks) * linebases + last_line, offset, linebases, linewidth)
+
+
+def build_fai(path):
+    """
+    Index a plain FASTA file in a single pass over a read-only memory map:
+    records are located with mmap.find, and each sequence is only checked for
+    consistent line lengths, with no Python work per line. Raises ValueError
+    when a sequence has lines of different lengths, like samtools faidx.
+    """
+    index = FastaIndex()
+    size = os.path.getsize(path)
+    if not size:
+        return index
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if mm[:1] == b'>':
+            start = 0
+        else:
+            start = mm.find(b'\n>')
+            start = start + 1 if start != -1 else size
+        while start < size:
+            header_end = mm.find(b'\n', start)
+            if header_end == -1:
+                header_end = size
+            next_header = mm.find(b'\n>', header_end)
+            end = next_header + 1 if next_header != -1 else size
+            sequence_start = min(header_end + 1, size)
+            _index_record(index, fai_name(mm[start + 1:header_end].decode('utf-8')), mm[sequence_start:end],
+                          sequence_start, path)
+            start = end
+    return index
+
+
+def write_fai(fasta_path, index_path=None):
+    """Build the index of a FASTA file and save it next to it, returns the FastaIndex."""
+    index = build_fai(fasta_path)
+    index.save(index_path or fai_path(fasta_path))
+    return index
+
+
+class IndexedFasta(object):
+    """
+    Random access to the sequences of a plain FASTA file through its .fai
+    index and a read-only memory map: a sequence or a subrange is located
+    with a few arithmetic operations, and only its own bytes are read.
+
+    The index is loaded from <path>.fai when it exists, else built.
+    """
+
+    def __init__(self, path, index=None):
+        self.path = path
+        if index is None:
+            index = FastaIndex.load(fai_path(path)) if os.path.isfile(fai_path(path)) else build_fai(path)
+        self.index = index
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    @property
+    def names(self):
+        return self.index.names
+
+    def length(self, name):
+        return self.index[name].length
+
+    def _position(self, entry, base):
+        """Byte offset in the file of a 0-based base position of a sequence."""
+        if not entry.linebases:
+            return entry.offset
+        lines, column = divmod(base, entry.linebases)
+        return entry.offset + lines * entry.linewidth + column
+
+    def fetch_bytes(self, name, start=0, end=None):
+        """
+        Bases [start, end) of a sequence, 0-based, as bytes. Out of range
+        bounds are clipped like samtools faidx does.
+        """
+        entry = self.index[name]
+        end = entry.length if end is None else min(end, entry.length)
+        start = max(0, start)
+        if start >= end:
+            return b''
+        data = self._mm[self._position(entry, start):self._position(entry, end - 1) + 1]
+        if start // entry.linebases != (end - 1) // entry.linebases:
+            # The range spans several lines
+            data = data.translate(None, b'\r\n')
+        return data
+
+    def fetch(self, name, start=0, end=None):
+        """Bases [start, end) of a sequence, 0-based, as a string."""
+        return self.fetch_bytes(name, start, end).decode('ascii')
+
+    def region(self, region):
+        """A samtools-style region, 'name', 'name:start' or 'name:start-end' with 1-based inclusive bounds."""
+        if region in self.index:
+            return self.fetch(region)
+        name, _, span = region.rpartition(':')
+        first, _, last = span.replace(',', '').partition('-')
+        return self.fetch(name, int(first) - 1, int(last) if last else None)
+
+    def close(self):
+        if self._mm:
+            self._mm.close()
+            self._mm = b''
+        self._file.close()
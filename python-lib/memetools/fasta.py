@@ -0,0 +1,284 @@
+import io
+from itertools import islice
+
+from memetools.faidx import fai_name
+
+# Size of the blocks pulled from the underlying stream. Large blocks keep the
+# number of Python-level iterations per record low on multi-GB files.
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Bytes removed from sequence bodies: line breaks and stray whitespace
+_SEQUENCE_DELETE = b'\r\n \t'
+
+
+def _find_header(buf, start):
+    """
+    Return the index of the newline preceding the next '>' at a line start,
+    or -1. Single-byte find() is a plain memchr, noticeably faster than
+    searching the two-byte b'\\n>' pattern; '>' inside a line is skipped.
+    """
+    find = buf.find
+    idx = find(b'>', start)
+    while idx != -1:
+        if buf[idx - 1] == 0x0A:
+            return idx - 1
+        idx = find(b'>', idx + 1)
+    return -1
+
+
+class FastaReader(object):
+    """
+    Streaming FASTA record parser working on large byte buffers.
+
+    The stream is read in blocks of `chunk_size` bytes. Record boundaries are
+    located with `bytearray.find`, so the per-byte work happens in C,
+    and only complete records are decoded. Whatever follows the last complete
+    record stays in the buffer as lookahead for the next call.
+    """
+
+    def __init__(self, stream, chunk_size=DEFAULT_CHUNK_SIZE, encoding='utf-8'):
+        """
+        :param stream: a binary (or text) file-like object with a read() method
+        :param chunk_size: number of bytes requested from the stream per read
+        :param encoding: encoding used to decode headers and sequences
+        """
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.encoding = encoding
+        self._buf = bytearray()
+        self._pos = 0
+        self._eof = False
+        self._started = False
+        self.bytes_read = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        record = self.read_record()
+        if record is None:
+            raise StopIteration
+        return record
+
+    def _fill(self):
+        """Drop consumed bytes and append the next block from the stream. Returns False at EOF."""
+        if self._eof:
+            return False
+        if self._pos:
+            del self._buf[:self._pos]
+            self._pos = 0
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        if isinstance(chunk, str):
+            chunk = chunk.encode(self.encoding)
+        self.bytes_read += len(chunk)
+        self._buf += chunk
+        return True
+
+    def _seek_first_header(self):
+        """Skip anything located before the first '>' that starts a line."""
+        while True:
+            buf = self._buf
+            if buf[:1] == b'>':
+                return True
+            idx = buf.find(b'\n>')
+            if idx != -1:
+                self._pos = idx + 1
+                return True
+            # Keep the last byte, it may be the newline preceding a header
+            self._pos = max(len(buf) - 1, 0)
+            if not self._fill():
+                return False
+
+    def read_record_bytes(self):
+        """
+        Return the next raw record as a (header, sequence) tuple of bytearrays,
+        or None once the stream is exhausted.
+        """
+        if not self._started:
+            self._started = True
+            if not self._seek_first_header():
+                return None
+        if self._pos >= len(self._buf) and not self._fill():
+            return None
+
+        scan_from = self._pos + 1
+        while True:
+            buf = self._buf
+            end = _find_header(buf, scan_from)
+            if end != -1:
+                break
+            # Only rescan the tail of the buffer once more data is available,
+            # the offset is kept relative to the record start as _fill() compacts
+            scanned = max(len(buf) - 1 - self._pos, 1)
+            if not self._fill():
+                end = len(self._buf)
+                break
+            scan_from = self._pos + scanned
+
+        buf = self._buf
+        start = self._pos
+        newline = buf.find(b'\n', start, end)
+        if newline == -1:
+            header = buf[start + 1:end]
+            sequence = bytearray()
+        else:
+            header = buf[start + 1:newline]
+            sequence = buf[newline + 1:end].translate(None, _SEQUENCE_DELETE)
+        self._pos = end + 1
+        return header, sequence
+
+    def read_record(self):
+        """
+        Return the next record as an (id, comment, sequence) tuple of strings,
+        or None once the stream is exhausted.
+        """
+        raw = self.read_record_bytes()
+        if raw is None:
+            return None
+        header, sequence = raw
+        parts = header.decode(self.encoding).split(None, 1)
+        sequence_id = parts[0] if parts else ''
+        comment = parts[1].rstrip() if len(parts) > 1 else ''
+        return sequence_id, comment, sequence.decode(self.encoding)
+
+
+# Amount of formatted text accumulated before it is encoded and handed to the
+# stream in a single write() call
+DEFAULT_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+def _as_text(value):
+    """Render a cell value, missing values (None, NaN) become an empty string."""
+    if value is None or (isinstance(value, float) and value != value):
+        return ''
+    return value if isinstance(value, str) else str(value)
+
+
+class FastaWriter(object):
+    """
+    Buffered FASTA writer shared by the exporter, the output formatter and the
+    extract-to-fasta recipe.
+
+    Records are formatted into a reusable in-memory buffer and written to the
+    stream with one write() call each time `buffer_size` characters have been
+    accumulated, and once at the end of every batch.
+    """
+
+    # Number of records formatted per slice of a batch
+    BATCH_RECORDS = 65536
+
+    def __init__(self, stream, line_width=None, buffer_size=DEFAULT_BUFFER_SIZE, encoding='utf-8', index=None):
+        """
+        :param stream: a binary (or text) file-like object with a write() method
+        :param line_width: wrap sequences to this many residues per line, None to keep one line
+        :param buffer_size: number of characters buffered before writing to the stream
+        :param encoding: encoding used for binary streams
+        :param index: optional memetools.faidx.FastaIndex receiving the .fai entry of every record,
+                      for an uncompressed stream written from its start
+        """
+        self.stream = stream
+        self.line_width = line_width or None
+        self.buffer_size = buffer_size
+        self.encoding = encoding
+        self._text = isinstance(stream, io.TextIOBase)
+        self._buffer = []
+        self._buffered = 0
+        self.records_written = 0
+        self.bytes_written = 0
+        self.index = index
+        # Size in bytes of the records indexed so far, including the buffered ones
+        self._indexed_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def format_record(self, sequence_id, sequence, comment=None):
+        """Return the FASTA entry for one record as a string."""
+        # Exact type checks are much cheaper than a call per cell on the common path
+        if sequence_id.__class__ is not str:
+            sequence_id = _as_text(sequence_id)
+        if sequence.__class__ is not str:
+            sequence = _as_text(sequence)
+        width = self.line_width
+        if width and len(sequence) > width:
+            sequence = '\n'.join([sequence[i:i + width] for i in range(0, len(sequence), width)])
+        if comment is not None and comment.__class__ is not str:
+            comment = _as_text(comment)
+        if comment:
+            return f">{sequence_id} {comment}\n{sequence}\n"
+        return f">{sequence_id}\n{sequence}\n"
+
+    def write_record(self, sequence_id, sequence, comment=None):
+        """Buffer one record, the stream is only written once the buffer is full."""
+        entry = self.format_record(sequence_id, sequence, comment)
+        if self.index is not None:
+            self._index_record(sequence_id, sequence, entry)
+        self._buffer.append(entry)
+        self._buffered += len(entry)
+        self.records_written += 1
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def write_records(self, records):
+        """
+        Write a batch of (id, sequence) or (id, sequence, comment) tuples.
+        Records are formatted BATCH_RECORDS at a time, each slice being written
+        to the stream with a single call.
+        """
+        format_record = self.format_record
+        records = iter(records)
+        while True:
+            if self.index is None:
+                entries = [format_record(*record) for record in islice(records, self.BATCH_RECORDS)]
+            else:
+                entries = []
+                for record in islice(records, self.BATCH_RECORDS):
+                    entry = format_record(*record)
+                    self._index_record(record[0], record[1], entry)
+                    entries.append(entry)
+            if not entries:
+                break
+            self._buffer.extend(entries)
+            self.records_written += len(entries)
+            self.flush()
+
+    def _index_record(self, sequence_id, sequence, entry):
+        """Add the .fai entry of a formatted record, its layout is known so nothing is parsed."""
+        if sequence.__class__ is not str:
+            sequence = _as_text(sequence)
+        length = len(sequence)
+        linebases = self.line_width if self.line_width and length > self.line_width else length
+        lines = -(-length // linebases) if linebases else 1
+        size = len(entry.encode(self.encoding))
+        offset = self._indexed_bytes + size - length - lines
+        self.index.add(fai_name(sequence_id), length, offset, linebases, linebases + 1 if linebases else 0)
+        self._indexed_bytes += size
+
+    def write_columns(self, ids, sequences, comments=None):
+        """Write a batch given as column values, e.g. DataFrame columns."""
+        if comments is None:
+            self.write_records(zip(ids, sequences))
+        else:
+            self.write_records(zip(ids, sequences, comments))
+
+    def flush(self):
+        """Write the buffered records to the stream in a single call."""
+        if not self._buffer:
+            return
+        data = ''.join(self._buffer)
+        if not self._text:
+            data = data.encode(self.encoding)
+        self.stream.write(data)
+        self.bytes_written += len(data)
+        del self._buffer[:]
+        self._buffered = 0
+
+    def close(self):
+        """Flush the remaining records, the stream itself is left open for its owner."""
+        self.flush()
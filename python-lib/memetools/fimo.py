@@ -0,0 +1,200 @@
+import io
+import json
+import logging
+import os
+import threading
+import time
+
+from memetools.compression import fasta_stem, is_fasta
+from memetools.fasta import FastaReader, FastaWriter
+
+logger = logging.getLogger(__name__)
+
+STREME_FILE_NAME = 'streme.txt'
+MANIFEST_NAME = 'fimo_manifest.json'
+# Seconds between two saves of the manifest while pairs complete
+MANIFEST_SAVE_INTERVAL = 60
+
+
+def gather_pair_inputs(paths):
+    """
+    Group file paths by directory into {directory: (streme_file, fasta_file)}.
+    Only directories holding a FASTA file (.fasta or .fa, possibly compressed)
+    are kept, the motif file is None when the directory has no streme.txt.
+    """
+    subfolders = {}
+    streme_files = {}
+    for path in paths:
+        directory, file_name = os.path.split(path)
+        if file_name == STREME_FILE_NAME:
+            streme_files[directory] = path
+        elif is_fasta(file_name):
+            subfolders[directory] = path
+    return {directory: (streme_files.get(directory), fasta_file) for directory, fasta_file in subfolders.items()}
+
+
+def build_pairs(subfolders):
+    """
+    Every (streme_file, fasta_file, output_dir) pair FIMO runs on: the motifs of
+    each directory against the FASTA file of every other directory, with the
+    results in <motif directory>/<FASTA file name without extension>.
+    """
+    pairs = []
+    for subfolder1, (streme_file, _) in subfolders.items():
+        if not streme_file:
+            logger.debug(f"No valid streme_file in subfolder: {subfolder1}. Skipping task submission.")
+            continue
+        for subfolder2, (_, fasta_file) in subfolders.items():
+            if subfolder1 != subfolder2 and fasta_file:
+                pairs.append((streme_file, fasta_file, os.path.join(subfolder1, fasta_stem(fasta_file))))
+    return pairs
+
+
+def path_fingerprint(folder, path):
+    """[size, last modified] of a folder file, or None when the folder does not provide them."""
+    try:
+        details = folder.get_path_details(path)
+    except Exception:
+        return None
+    size, last_modified = details.get('size'), details.get('lastModified')
+    if size is None or last_modified is None:
+        return None
+    return [size, last_modified]
+
+
+class PairManifest(object):
+    """
+    Record of the FIMO pairs already computed in an output folder.
+
+    `pairs` maps each pair output path to the key it was computed with (a hash
+    of the motif file, the FASTA file and the options); a pair whose current key
+    differs must be recomputed. `digests` remembers the content digest of input
+    files by fingerprint, so unchanged inputs are neither downloaded nor hashed.
+    """
+
+    def __init__(self, folder, path):
+        self.folder = folder
+        self.path = path
+        self._lock = threading.Lock()
+        self.pairs = {}
+        self.digests = {}
+        self._saved_at = time.monotonic()
+        try:
+            with folder.get_download_stream(path) as f:
+                data = json.loads(f.read().decode('utf-8'))
+            self.pairs = data.get('pairs', {})
+            self.digests = data.get('digests', {})
+            logger.info(f"Loaded FIMO manifest {path}: {len(self.pairs)} pairs")
+        except Exception:
+            logger.info(f"No FIMO manifest found at {path}, all pairs will be computed")
+
+    def known_digest(self, name, fingerprint):
+        """Digest recorded for a file, if its fingerprint did not change."""
+        if fingerprint is None:
+            return None
+        entry = self.digests.get(name)
+        if entry is not None and entry['fingerprint'] == fingerprint:
+            return entry['digest']
+        return None
+
+    def remember_digest(self, name, fingerprint, digest):
+        if fingerprint is not None:
+            with self._lock:
+                self.digests[name] = {'fingerprint': fingerprint, 'digest': digest}
+
+    def is_current(self, output_path, key):
+        return self.pairs.get(output_path) == key
+
+    def mark_done(self, output_path, key):
+        with self._lock:
+            self.pairs[output_path] = key
+
+    def save(self):
+        with self._lock:
+            data = json.dumps({'pairs': self.pairs, 'digests': self.digests}, sort_keys=True).encode('utf-8')
+            self._saved_at = time.monotonic()
+        self.folder.upload_stream(self.path, io.BytesIO(data))
+
+    def checkpoint(self, interval=MANIFEST_SAVE_INTERVAL):
+        """Save the manifest if it was last saved more than `interval` seconds ago, so a killed run keeps its pairs."""
+        with self._lock:
+            due = time.monotonic() - self._saved_at >= interval
+        if due:
+            self.save()
+
+
+# Separator between the target tag and the original sequence ID in batched runs
+TAG_SEPARATOR = '|'
+FIMO_TSV_NAME = 'fimo.tsv'
+# Hits buffered across targets before they are appended to the per-pair files
+SPLIT_BUFFER_SIZE = 8 * 1024 * 1024
+
+
+def write_tagged_fasta(fasta_files, destination):
+    """
+    Concatenate FASTA files into `destination`, prefixing every sequence ID with
+    the index of its file and TAG_SEPARATOR so hits can be traced back.
+    Returns the list of tags, in the order of fasta_files.
+    """
+    tags = []
+    with open(destination, 'wb') as out:
+        writer = FastaWriter(out)
+        for index, fasta_file in enumerate(fasta_files):
+            tag = str(index)
+            with open(fasta_file, 'rb') as f:
+                writer.write_records((f"{tag}{TAG_SEPARATOR}{sequence_id}", sequence, comment)
+                                     for sequence_id, comment, sequence in FastaReader(f))
+            tags.append(tag)
+    return tags
+
+
+def split_fimo_tsv(tsv_path, outputs):
+    """
+    Demultiplex the fimo.tsv of a batched run into one fimo.tsv per target.
+
+    :param outputs: {tag: output_dir}; hits of other tags are dropped
+    :return: {tag: number of hits}
+    """
+    counts = dict.fromkeys(outputs, 0)
+    buffers = {tag: [] for tag in outputs}
+    comments = []
+    buffered = 0
+
+    def flush():
+        for tag, lines in buffers.items():
+            if lines:
+                with open(os.path.join(outputs[tag], FIMO_TSV_NAME), 'a') as f:
+                    f.writelines(lines)
+                del lines[:]
+
+    with open(tsv_path) as f:
+        header = f.readline()
+        for output_dir in outputs.values():
+            os.makedirs(output_dir, exist_ok=True)
+            with open(os.path.join(output_dir, FIMO_TSV_NAME), 'w') as out:
+                out.write(header)
+        for line in f:
+            if not line.strip():
+                continue
+            if line.startswith('#'):
+                comments.append(line)
+                continue
+            fields = line.split('\t', 3)
+            tag, _, sequence_name = fields[2].partition(TAG_SEPARATOR)
+            if tag not in buffers:
+                continue
+            fields[2] = sequence_name
+            line = '\t'.join(fields)
+            buffers[tag].append(line)
+            counts[tag] += 1
+            buffered += len(line)
+            if buffered >= SPLIT_BUFFER_SIZE:
+                flush()
+                buffered = 0
+    flush()
+    if comments:
+        for output_dir in outputs.values():
+            with open(os.path.join(output_dir, FIMO_TSV_NAME), 'a') as out:
+                out.write('\n')
+                out.writelines(comments)
+    return counts
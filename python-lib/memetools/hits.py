@@ -0,0 +1,111 @@
+import logging
+import threading
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Hits parsed and written at a time, bounding memory whatever the size of a fimo.tsv
+DEFAULT_CHUNK_ROWS = 200000
+
+# Columns of a FIMO TSV file, and the name of each one in the hits dataset
+FIMO_TSV_COLUMNS = [
+    ('motif_id', 'motif_id'),
+    ('motif_alt_id', 'motif_alt_id'),
+    ('sequence_name', 'sequence_name'),
+    ('start', 'start'),
+    ('stop', 'stop'),
+    ('strand', 'strand'),
+    ('score', 'score'),
+    ('p-value', 'p_value'),
+    ('q-value', 'q_value'),
+    ('matched_sequence', 'matched_sequence'),
+]
+INTEGER_COLUMNS = ['start', 'stop']
+DOUBLE_COLUMNS = ['score', 'p_value', 'q_value']
+
+# Schema of the hits dataset: the motif sample and FASTA file of the pair, then the FIMO columns
+HIT_SCHEMA = [{'name': 'sample', 'type': 'string'}, {'name': 'target', 'type': 'string'}] + [
+    {'name': name, 'type': 'bigint' if name in INTEGER_COLUMNS else 'double' if name in DOUBLE_COLUMNS else 'string'}
+    for _, name in FIMO_TSV_COLUMNS]
+
+
+def iter_hit_chunks(tsv, chunk_rows=DEFAULT_CHUNK_ROWS, max_pvalue=None, max_qvalue=None):
+    """
+    Typed DataFrames of the hits of a fimo.tsv (a path or a binary stream), at
+    most chunk_rows rows each, keeping the hits with p-value <= max_pvalue and
+    q-value <= max_qvalue when set. Hits without a q-value (fimo --text, or
+    members of deduplicated motifs) are kept by the q-value filter. The
+    trailing '#' comment lines of FIMO are skipped.
+    """
+    # Everything is read as text first: a '#' may appear inside sequence names, so pandas' comment handling is not used
+    reader = pd.read_csv(tsv, sep='\t', dtype=str, chunksize=chunk_rows, keep_default_na=False, na_values=[''])
+    for chunk in reader:
+        if chunk.empty:
+            continue
+        chunk = chunk[~chunk['motif_id'].str.startswith('#', na=True)]
+        chunk = chunk.rename(columns=dict(FIMO_TSV_COLUMNS))
+        for column in INTEGER_COLUMNS:
+            chunk[column] = pd.to_numeric(chunk[column]).astype('int64')
+        for column in DOUBLE_COLUMNS:
+            chunk[column] = pd.to_numeric(chunk[column], errors='coerce')
+        if max_pvalue is not None:
+            chunk = chunk[chunk['p_value'] <= max_pvalue]
+        if max_qvalue is not None:
+            chunk = chunk[chunk['q_value'].isna() | (chunk['q_value'] <= max_qvalue)]
+        if not chunk.empty:
+            yield chunk[[name for _, name in FIMO_TSV_COLUMNS]]
+
+
+class HitsWriter(object):
+    """
+    Streams the hits of FIMO pairs into a single dataset as the pairs finish.
+
+    The dataset writer is opened once for the whole run. Each fimo.tsv is
+    parsed chunk by chunk in the calling thread, only the writes themselves
+    are serialized, so pairs uploaded concurrently can be added concurrently.
+    Columnar storage (e.g. Parquet) comes from the format of the dataset.
+    """
+
+    def __init__(self, dataset, max_pvalue=None, max_qvalue=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+        """
+        :param dataset: the output dataiku.Dataset
+        :param max_pvalue: hits with a larger p-value are not written, None to keep them all
+        :param max_qvalue: hits with a larger q-value are not written, None to keep them all
+        """
+        self.dataset = dataset
+        self.max_pvalue = max_pvalue
+        self.max_qvalue = max_qvalue
+        self.chunk_rows = chunk_rows
+        self.rows = 0
+        self._lock = threading.Lock()
+        self._writer = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        self.dataset.write_schema(HIT_SCHEMA)
+        self._writer = self.dataset.get_writer()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            logger.info(f"Wrote {self.rows} FIMO hits to {self.dataset.name}")
+
+    def write_tsv(self, tsv, sample, target):
+        """Append the hits of one pair's fimo.tsv (a path or a binary stream), returns the number of rows written."""
+        rows = 0
+        for chunk in iter_hit_chunks(tsv, self.chunk_rows, self.max_pvalue, self.max_qvalue):
+            chunk.insert(0, 'target', target)
+            chunk.insert(0, 'sample', sample)
+            with self._lock:
+                self._writer.write_dataframe(chunk)
+                self.rows += len(chunk)
+            rows += len(chunk)
+        return rows
@@ -0,0 +1,80 @@
+import os
+import shutil
+
+
+class LocalFolder(object):
+    """
+    Stand-in for dataiku.Folder backed by a local directory.
+
+    Implements the subset of the managed folder API used by the plugin, so the
+    memetools helpers can be exercised and benchmarked outside of DSS.
+    Partitions map to top-level sub-directories named after the partition ID.
+    """
+
+    def __init__(self, root, short_name='local'):
+        self.root = os.path.abspath(root)
+        self.short_name = short_name
+        os.makedirs(self.root, exist_ok=True)
+
+    def _local(self, path):
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def get_info(self):
+        return {'name': self.short_name, 'type': 'Filesystem', 'path': self.root}
+
+    def get_path(self):
+        return self.root
+
+    def get_partition_folder(self, partition_id):
+        return f"/{partition_id}"
+
+    def list_paths_in_partition(self, partition_id=None):
+        base = self.root if partition_id is None else self._local(self.get_partition_folder(partition_id))
+        paths = []
+        for root, _, file_names in os.walk(base):
+            for file_name in file_names:
+                relative = os.path.relpath(os.path.join(root, file_name), self.root)
+                paths.append('/' + relative.replace(os.sep, '/'))
+        return sorted(paths)
+
+    def get_path_details(self, path):
+        local_path = self._local(path)
+        if not os.path.exists(local_path):
+            return {'exists': False}
+        stat = os.stat(local_path)
+        return {'exists': True, 'directory': os.path.isdir(local_path), 'size': stat.st_size,
+                'lastModified': int(stat.st_mtime * 1000)}
+
+    def get_download_stream(self, path):
+        return open(self._local(path), 'rb')
+
+    def get_writer(self, path):
+        local_path = self._local(path)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        return open(local_path, 'wb')
+
+    def upload_stream(self, path, f):
+        with self.get_writer(path) as writer:
+            shutil.copyfileobj(f, writer)
+
+    def upload_file(self, path, file_path):
+        with open(file_path, 'rb') as f:
+            self.upload_stream(path, f)
+
+    def upload_data(self, path, data):
+        with self.get_writer(path) as writer:
+            writer.write(data)
+
+    def delete_path(self, path):
+        local_path = self._local(path)
+        if os.path.isdir(local_path):
+            shutil.rmtree(local_path)
+        elif os.path.exists(local_path):
+            os.remove(local_path)
+
+    def clear_partition(self, partition_id):
+        self.delete_path(self.get_partition_folder(partition_id))
+
+    def clear(self):
+        for name in os.listdir(self.root):
+            self.delete_path(name)
@@ -0,0 +1,199 @@
+import contextlib
+import importlib
+import json
+import logging
+import resource
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+RUN_METRICS_NAME = 'run_metrics.json'
+RUN_METRICS_VERSION = 1
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+MAXRSS_SCALE = 1 if sys.platform == 'darwin' else 1024
+
+
+def rusage_fields(usage):
+    """CPU times in seconds and peak resident set size in bytes of a resource.struct_rusage."""
+    return {'user_cpu_seconds': usage.ru_utime, 'system_cpu_seconds': usage.ru_stime,
+            'max_rss_bytes': usage.ru_maxrss * MAXRSS_SCALE}
+
+
+def measure_call(func, value):
+    """
+    Call func(value) and return (result, usage): its wall time, the CPU time
+    this process spent in it and the peak RSS of this process. Meant to run in
+    a process pool worker, whose peak RSS covers the jobs it ran before.
+    """
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    result = func(value)
+    usage = rusage_fields(resource.getrusage(resource.RUSAGE_SELF))
+    usage['user_cpu_seconds'] -= before.ru_utime
+    usage['system_cpu_seconds'] -= before.ru_stime
+    usage['seconds'] = time.perf_counter() - start
+    return result, usage
+
+
+def load_hook(spec):
+    """The function named by a 'package.module:function' string."""
+    module_name, _, function_name = spec.partition(':')
+    if not module_name or not function_name:
+        raise ValueError(f"Metrics hook '{spec}' is not of the form package.module:function")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def _rounded(value):
+    if isinstance(value, float):
+        return round(value, 3)
+    if isinstance(value, dict):
+        return {key: _rounded(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_rounded(item) for item in value]
+    return value
+
+
+class RunMetrics(object):
+    """
+    Performance report of one recipe run: time spent in each stage (staging,
+    download, process, upload, cleanup...), one record per job with its wall
+    time, CPU time, peak RSS and inputs, and a summary to size max_workers and
+    containers from.
+
+    Stage times are summed over the threads running them, so a stage can add
+    up to more than the wall time of the run. Thread-safe. Written as
+    run_metrics.json by report() and optionally pushed to a hook function.
+    """
+
+    def __init__(self, recipe, partition=None, parameters=None):
+        """
+        :param recipe: name of the recipe
+        :param partition: partition the recipe runs on
+        :param parameters: settings of the run worth keeping next to its metrics, e.g. max_workers
+        """
+        self.recipe = recipe
+        self.partition = partition
+        self.parameters = dict(parameters or {})
+        self.status = 'running'
+        self.started_at = time.time()
+        self.wall_seconds = None
+        self.stages = {}
+        self.jobs = []
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def add_time(self, stage, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            entry['count'] += 1
+            entry['seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds)
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        """Add the time spent in the block to `stage`, even when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def record_job(self, name, status, seconds, usage=None, **fields):
+        """
+        Record a finished job.
+
+        :param name: description of the job
+        :param status: 'succeeded' or 'failed'
+        :param seconds: wall time of the job
+        :param usage: optional CPU times and peak RSS, as returned by rusage_fields
+        :param fields: other fields of the record, e.g. input_bytes and sequences
+        """
+        record = {'job': name, 'status': status, 'start': max(0.0, self.elapsed() - seconds), 'seconds': seconds}
+        record.update(usage or {})
+        record.update(fields)
+        with self._lock:
+            self.jobs.append(record)
+
+    def summary(self):
+        with self._lock:
+            jobs = list(self.jobs)
+        seconds = sorted(job['seconds'] for job in jobs)
+        job_seconds = sum(seconds)
+        cpu_seconds = sum(job.get('user_cpu_seconds', 0) + job.get('system_cpu_seconds', 0) for job in jobs)
+        wall_seconds = self.wall_seconds if self.wall_seconds is not None else self.elapsed()
+        return {
+            'jobs': len(jobs),
+            'failed_jobs': sum(1 for job in jobs if job['status'] != 'succeeded'),
+            'job_seconds': job_seconds,
+            'job_cpu_seconds': cpu_seconds,
+            # 1.0 for a single-threaded job busy all the time, less when it waits on I/O
+            'cpu_per_job_second': cpu_seconds / job_seconds if job_seconds > 0 else None,
+            'max_job_rss_bytes': max((job['max_rss_bytes'] for job in jobs if 'max_rss_bytes' in job), default=None),
+            'p50_job_seconds': _percentile(seconds, 0.5),
+            'p95_job_seconds': _percentile(seconds, 0.95),
+            'max_job_seconds': seconds[-1] if seconds else None,
+            # Average number of jobs running at the same time over the run
+            'job_concurrency': job_seconds / wall_seconds if wall_seconds > 0 else None,
+        }
+
+    def to_dict(self):
+        with self._lock:
+            stages = {name: dict(entry) for name, entry in self.stages.items()}
+            jobs = list(self.jobs)
+        return _rounded({
+            'version': RUN_METRICS_VERSION,
+            'recipe': self.recipe,
+            'partition': self.partition,
+            'status': self.status,
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.started_at)),
+            'wall_seconds': self.wall_seconds if self.wall_seconds is not None else self.elapsed(),
+            'parameters': self.parameters,
+            'process': rusage_fields(resource.getrusage(resource.RUSAGE_SELF)),
+            'children': rusage_fields(resource.getrusage(resource.RUSAGE_CHILDREN)),
+            'stages': stages,
+            'summary': self.summary(),
+            'jobs': sorted(jobs, key=lambda job: job['start']),
+        })
+
+    def save(self, folder, path):
+        """Write the report as JSON to `path` in a Dataiku folder."""
+        folder.upload_data(path, json.dumps(self.to_dict(), sort_keys=True).encode('utf-8'))
+
+    def publish(self, folder, path, hook=None):
+        """Save the report and pass it to `hook`, a 'package.module:function' string. Failures are only logged."""
+        try:
+            self.save(folder, path)
+            logger.info(f"Wrote run metrics to {path}")
+        except Exception as e:
+            logger.warning(f"Failed to write run metrics to {path}: {e}")
+        if hook:
+            try:
+                load_hook(hook)(self.to_dict())
+                logger.info(f"Pushed run metrics to {hook}")
+            except Exception as e:
+                logger.warning(f"Failed to push run metrics to {hook}: {e}")
+
+    @contextlib.contextmanager
+    def report(self, folder, path, hook=None):
+        """Run the block as the whole run, then publish the report, whether the block succeeded or failed."""
+        try:
+            yield self
+            self.status = 'succeeded'
+        except BaseException:
+            self.status = 'failed'
+            raise
+        finally:
+            self.wall_seconds = self.elapsed()
+            self.publish(folder, path, hook)
@@ -0,0 +1,312 @@
+import json
+import logging
+import math
+import struct
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MOTIF_STORE_NAME = 'motifs.bin'
+STORE_MAGIC = b'MTFSTORE'
+STORE_VERSION = 1
+# Arrays of the store start on multiples of this, so memory maps are aligned
+STORE_ALIGNMENT = 64
+_STORE_PREAMBLE = struct.Struct('<8sII Q')
+_STORE_ARRAYS = ['probabilities', 'offsets', 'evalues', 'nsites', 'motif_samples', 'backgrounds']
+
+
+class Motif(object):
+    """A letter-probability matrix (width x alphabet size) with its MEME identifiers."""
+
+    def __init__(self, motif_id, alt_id, probabilities, nsites=None, evalue=None):
+        self.id = motif_id
+        self.alt_id = alt_id
+        self.probabilities = np.asarray(probabilities, dtype=np.float64)
+        self.nsites = nsites
+        self.evalue = evalue
+
+    @property
+    def width(self):
+        return self.probabilities.shape[0]
+
+
+class MotifSet(object):
+    """
+    Motifs of one or more MEME files held in contiguous arrays.
+
+    The matrices of all motifs are stacked in `probabilities` (one row per
+    motif position), motif i spanning rows offsets[i]:offsets[i + 1]. Each
+    motif belongs to a sample, and each sample has its own background.
+    """
+
+    def __init__(self, alphabet, probabilities, offsets, ids, alt_ids, evalues, nsites, motif_samples, samples,
+                 backgrounds):
+        self.alphabet = alphabet
+        self.probabilities = probabilities
+        self.offsets = offsets
+        self.ids = ids
+        self.alt_ids = alt_ids
+        self.evalues = evalues
+        self.nsites = nsites
+        self.motif_samples = motif_samples
+        self.samples = samples
+        self.backgrounds = backgrounds
+        self._index = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def widths(self):
+        return np.diff(self.offsets)
+
+    def matrix(self, index):
+        return self.probabilities[self.offsets[index]:self.offsets[index + 1]]
+
+    def sample(self, index):
+        return self.samples[self.motif_samples[index]]
+
+    def background(self, index):
+        return self.backgrounds[self.motif_samples[index]]
+
+    def motif(self, index):
+        nsites = float(self.nsites[index])
+        evalue = float(self.evalues[index])
+        return Motif(self.ids[index], self.alt_ids[index], self.matrix(index),
+                     None if math.isnan(nsites) else nsites, None if math.isnan(evalue) else evalue)
+
+    def find(self, motif_id, sample=''):
+        """Index of a motif by sample and motif ID, raises KeyError when absent."""
+        if self._index is None:
+            self._index = {(self.sample(index), motif_id): index for index, motif_id in enumerate(self.ids)}
+        return self._index[(sample, motif_id)]
+
+    def indices(self, sample):
+        """Indices of the motifs of a sample."""
+        return np.nonzero(self.motif_samples == self.samples.index(sample))[0]
+
+    @classmethod
+    def concatenate(cls, motif_sets):
+        """One MotifSet holding the motifs of several sets, which must share their alphabet."""
+        motif_sets = list(motif_sets)
+        if not motif_sets:
+            raise ValueError("No motif set to concatenate")
+        alphabet = motif_sets[0].alphabet
+        if any(motif_set.alphabet != alphabet for motif_set in motif_sets):
+            raise ValueError("Motif sets with different alphabets cannot be concatenated")
+        offsets = [np.zeros(1, dtype=np.int64)]
+        motif_samples = []
+        rows = 0
+        for motif_set in motif_sets:
+            offsets.append(np.asarray(motif_set.offsets[1:]) + rows)
+            rows += int(motif_set.offsets[-1])
+        sample_count = 0
+        for motif_set in motif_sets:
+            motif_samples.append(np.asarray(motif_set.motif_samples) + sample_count)
+            sample_count += len(motif_set.samples)
+        return cls(alphabet,
+                   np.concatenate([motif_set.probabilities for motif_set in motif_sets]).reshape(-1, len(alphabet)),
+                   np.concatenate(offsets),
+                   [motif_id for motif_set in motif_sets for motif_id in motif_set.ids],
+                   [alt_id for motif_set in motif_sets for alt_id in motif_set.alt_ids],
+                   np.concatenate([motif_set.evalues for motif_set in motif_sets]),
+                   np.concatenate([motif_set.nsites for motif_set in motif_sets]),
+                   np.concatenate(motif_samples).astype(np.int32),
+                   [sample for motif_set in motif_sets for sample in motif_set.samples],
+                   np.concatenate([motif_set.backgrounds for motif_set in motif_sets]).reshape(-1, len(alphabet)))
+
+    def save(self, stream):
+        """
+        Write the set as a binary store to a binary stream: a preamble, a JSON
+        header with the identifiers and the layout of the arrays, then the raw
+        arrays, each aligned so load() can memory-map them.
+        """
+        arrays = {
+            'probabilities': np.ascontiguousarray(self.probabilities, dtype='<f8'),
+            'offsets': np.ascontiguousarray(self.offsets, dtype='<i8'),
+            'evalues': np.ascontiguousarray(self.evalues, dtype='<f8'),
+            'nsites': np.ascontiguousarray(self.nsites, dtype='<f8'),
+            'motif_samples': np.ascontiguousarray(self.motif_samples, dtype='<i4'),
+            'backgrounds': np.ascontiguousarray(self.backgrounds, dtype='<f8'),
+        }
+        header = {'alphabet': self.alphabet, 'ids': list(self.ids), 'alt_ids': list(self.alt_ids),
+                  'samples': list(self.samples), 'arrays': {}}
+        # Array offsets depend on the header size, so lay the arrays out relative to the data start first
+        position = 0
+        for name in _STORE_ARRAYS:
+            position = _align(position)
+            header['arrays'][name] = {'dtype': arrays[name].dtype.str, 'shape': list(arrays[name].shape),
+                                      'offset': position}
+            position += arrays[name].nbytes
+        header_bytes = json.dumps(header, sort_keys=True).encode('utf-8')
+        data_start = _align(_STORE_PREAMBLE.size + len(header_bytes))
+        stream.write(_STORE_PREAMBLE.pack(STORE_MAGIC, STORE_VERSION, 0, len(header_bytes)))
+        stream.write(header_bytes)
+        written = _STORE_PREAMBLE.size + len(header_bytes)
+        for name in _STORE_ARRAYS:
+            start = data_start + header['arrays'][name]['offset']
+            stream.write(b'\0' * (start - written))
+            stream.write(arrays[name].tobytes())
+            written = start + arrays[name].nbytes
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Open a store written by save(), the arrays are memory-mapped read-only unless mmap is False."""
+        with open(path, 'rb') as f:
+            magic, version, _, header_size = _STORE_PREAMBLE.unpack(f.read(_STORE_PREAMBLE.size))
+            if magic != STORE_MAGIC:
+                raise ValueError(f"{path} is not a motif store")
+            if version != STORE_VERSION:
+                raise ValueError(f"Unsupported motif store version {version} in {path}")
+            header = json.loads(f.read(header_size).decode('utf-8'))
+            data_start = _align(_STORE_PREAMBLE.size + header_size)
+            arrays = {}
+            for name in _STORE_ARRAYS:
+                layout = header['arrays'][name]
+                dtype, shape = np.dtype(layout['dtype']), tuple(layout['shape'])
+                if mmap and int(np.prod(shape)) > 0:
+                    arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=data_start + layout['offset'],
+                                             shape=shape)
+                else:
+                    f.seek(data_start + layout['offset'])
+                    count = int(np.prod(shape))
+                    arrays[name] = np.frombuffer(f.read(count * dtype.itemsize), dtype=dtype).reshape(shape)
+        return cls(header['alphabet'], arrays['probabilities'], arrays['offsets'], header['ids'], header['alt_ids'],
+                   arrays['evalues'], arrays['nsites'], arrays['motif_samples'], header['samples'],
+                   arrays['backgrounds'])
+
+
+def _align(position):
+    return -(-position // STORE_ALIGNMENT) * STORE_ALIGNMENT
+
+
+def _symbol_order(symbol):
+    """Sort key of a core symbol: MEME orders letters, then digits, then any other symbol, each by code."""
+    if symbol.isalpha():
+        return 0, symbol
+    if symbol.isdigit():
+        return 1, symbol
+    return 2, symbol
+
+
+def _parse_alphabet_block(lines, index):
+    """
+    Core symbols of an `ALPHABET "name" ... END ALPHABET` block, in the order
+    MEME gives the matrix columns, and the index of the block's last line.
+    """
+    symbols = []
+    while index + 1 < len(lines):
+        index += 1
+        line = lines[index].strip()
+        if line.startswith('END ALPHABET'):
+            break
+        # Core symbols are declared alone or with their complement after '~', ambiguous ones with '='
+        if line and '=' not in line:
+            symbols.extend(side.split()[0] for side in line.split('~') if side.strip())
+    return ''.join(sorted(set(symbols), key=_symbol_order)), index
+
+
+def _matrix_attributes(line):
+    attributes = line.split(':', 1)[1].replace('= ', '=').split()
+    return dict(attribute.split('=', 1) for attribute in attributes if '=' in attribute)
+
+
+def parse_meme(text, sample=''):
+    """
+    Parse motifs in MEME text format (as written by MEME, STREME and DREME)
+    into a MotifSet whose motifs all belong to `sample`.
+    """
+    lines = text.splitlines()
+    alphabet = None
+    background = None
+    ids, alt_ids, evalues, nsites, matrices = [], [], [], [], []
+    motif_id, alt_id = None, ''
+    index = 0
+    while index < len(lines):
+        line = lines[index].strip()
+        if line.startswith('ALPHABET='):
+            alphabet = line.split('=', 1)[1].strip()
+        elif line.startswith('ALPHABET'):
+            alphabet, index = _parse_alphabet_block(lines, index)
+        elif line.startswith('Background letter frequencies'):
+            fields = []
+            while index + 1 < len(lines) and lines[index + 1].strip():
+                index += 1
+                fields.extend(lines[index].split())
+            background = dict(zip(fields[::2], (float(value) for value in fields[1::2])))
+        elif line.startswith('MOTIF'):
+            fields = line.split()
+            motif_id = fields[1]
+            alt_id = fields[2] if len(fields) > 2 else ''
+        elif line.startswith('letter-probability matrix'):
+            attributes = _matrix_attributes(line)
+            width = int(attributes['w'])
+            rows = []
+            while len(rows) < width:
+                index += 1
+                if lines[index].strip():
+                    rows.append(lines[index])
+            matrix = np.array(' '.join(rows).split(), dtype=np.float64).reshape(width, -1)
+            ids.append(motif_id)
+            alt_ids.append(alt_id)
+            nsites.append(float(attributes.get('nsites', 'nan')))
+            evalues.append(float(attributes.get('E', 'nan')))
+            matrices.append(matrix)
+        index += 1
+
+    if alphabet is None:
+        alphabet = 'ACGT'
+    size = len(alphabet)
+    if any(matrix.shape[1] != size for matrix in matrices):
+        raise ValueError(f"Motif matrices do not match the alphabet {alphabet}")
+    frequencies = np.full(size, 1.0 / size)
+    if background:
+        frequencies = np.array([background.get(letter, 0.0) for letter in alphabet])
+        frequencies /= frequencies.sum()
+    offsets = np.zeros(len(matrices) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([matrix.shape[0] for matrix in matrices])
+    probabilities = np.concatenate(matrices) if matrices else np.zeros((0, size))
+    return MotifSet(alphabet, probabilities, offsets, ids, alt_ids, np.array(evalues, dtype=np.float64),
+                    np.array(nsites, dtype=np.float64), np.zeros(len(ids), dtype=np.int32), [sample],
+                    frequencies.reshape(1, size))
+
+
+def read_meme(path, sample=''):
+    """Parse a MEME format motif file, see parse_meme()."""
+    with open(path) as f:
+        return parse_meme(f.read(), sample)
+
+
+def write_meme(motif_set, stream, indices=None, ids=None, background=None):
+    """
+    Write motifs of a MotifSet to a text stream in MEME format.
+
+    :param indices: indices of the motifs to write, all by default
+    :param ids: optional motif IDs to write instead of the original ones, which then become the alternate IDs
+    :param background: background frequencies of the file, the mean of the sample backgrounds by default
+    """
+    indices = range(len(motif_set)) if indices is None else indices
+    if background is None:
+        background = np.asarray(motif_set.backgrounds).mean(axis=0)
+    stream.write(f"MEME version 5\n\nALPHABET= {motif_set.alphabet}\n\n")
+    if motif_set.alphabet == 'ACGT':
+        stream.write("strands: + -\n\n")
+    stream.write("Background letter frequencies\n")
+    stream.write(' '.join(f"{letter} {frequency:.6f}" for letter, frequency in zip(motif_set.alphabet, background)))
+    stream.write("\n\n")
+    for position, index in enumerate(indices):
+        if ids is None:
+            stream.write(f"MOTIF {motif_set.ids[index]} {motif_set.alt_ids[index]}".rstrip() + "\n")
+        else:
+            stream.write(f"MOTIF {ids[position]} {motif_set.ids[index]}\n")
+        matrix = motif_set.matrix(index)
+        attributes = f"alength= {matrix.shape[1]} w= {matrix.shape[0]}"
+        if not math.isnan(motif_set.nsites[index]):
+            attributes += f" nsites= {motif_set.nsites[index]:g}"
+        if not math.isnan(motif_set.evalues[index]):
+            attributes += f" E= {motif_set.evalues[index]:.1e}"
+        stream.write(f"letter-probability matrix: {attributes}\n")
+        for row in matrix:
+            stream.write(' ' + ' '.join(f"{value:.6f}" for value in row) + '\n')
+        stream.write('\n')
@@ -0,0 +1,190 @@
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+from memetools.hits import DEFAULT_CHUNK_ROWS, iter_hit_chunks
+
+logger = logging.getLogger(__name__)
+
+OCCUPANCY_NAME = 'occupancy.npz'
+OCCUPANCY_VERSION = 1
+
+# Summary of the hits of one motif in one target, and its value in cells without hits
+FIELDS = ('count', 'best_score', 'min_pvalue')
+FIELD_DTYPES = {'count': np.int64, 'best_score': np.float64, 'min_pvalue': np.float64}
+FIELD_FILL = {'count': 0, 'best_score': np.nan, 'min_pvalue': np.nan}
+
+
+def summarize_fimo_tsv(tsv, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    Number of hits, best score and smallest p-value of every motif of a
+    fimo.tsv (a path or a binary stream), read in chunks. Returns a DataFrame
+    with motif_id, motif_alt_id and the FIELDS columns, one row per motif
+    having at least one hit.
+    """
+    parts = []
+    for chunk in iter_hit_chunks(tsv, chunk_rows):
+        chunk = chunk.assign(motif_alt_id=chunk['motif_alt_id'].fillna(''))
+        parts.append(chunk.groupby(['motif_id', 'motif_alt_id'], sort=False).agg(
+            count=('score', 'size'), best_score=('score', 'max'), min_pvalue=('p_value', 'min')))
+    if not parts:
+        return pd.DataFrame({'motif_id': [], 'motif_alt_id': [], 'count': np.zeros(0, dtype=np.int64),
+                             'best_score': np.zeros(0), 'min_pvalue': np.zeros(0)})
+    summary = pd.concat(parts)
+    if len(parts) > 1:
+        summary = summary.groupby(level=[0, 1], sort=False).agg(
+            {'count': 'sum', 'best_score': 'max', 'min_pvalue': 'min'})
+    return summary.reset_index()
+
+
+class OccupancyMatrix(object):
+    """
+    Sparse target x motif matrix of FIMO hit summaries: for every FASTA target
+    (row) and motif (column, a motif ID of a motif sample), the number of hits,
+    the best score and the smallest p-value.
+
+    Cells are stored in coordinate form. A pair (motif sample, target) is
+    recorded as a whole by update_pair, replacing the cells of a previous run
+    of the same pair, so the matrix of an incremental run is the previous
+    matrix with only the recomputed pairs updated. Pairs with no hit are
+    recorded too, so recorded pairs can be told apart from missing ones.
+    Persisted with save() as a compressed .npz file of plain arrays.
+    """
+
+    def __init__(self):
+        self.targets = []
+        self.samples = []
+        self.motif_samples = []
+        self.motif_ids = []
+        self.motif_alt_ids = []
+        self._target_index = {}
+        self._sample_index = {}
+        self._motif_index = {}
+        self._pairs = set()
+        self._cells = {'rows': np.zeros(0, dtype=np.int64), 'columns': np.zeros(0, dtype=np.int64)}
+        self._cells.update({field: np.zeros(0, dtype=FIELD_DTYPES[field]) for field in FIELDS})
+        self._updates = {}
+        self._lock = threading.Lock()
+
+    @property
+    def shape(self):
+        return len(self.targets), len(self.motif_ids)
+
+    def _index(self, index, labels, label):
+        if label not in index:
+            index[label] = len(labels)
+            labels.append(label)
+        return index[label]
+
+    def _column(self, sample_index, motif_id, motif_alt_id):
+        key = (sample_index, motif_id)
+        if key not in self._motif_index:
+            self._motif_index[key] = len(self.motif_ids)
+            self.motif_samples.append(sample_index)
+            self.motif_ids.append(motif_id)
+            self.motif_alt_ids.append(motif_alt_id)
+        return self._motif_index[key]
+
+    def has_pair(self, sample, target):
+        row, sample_index = self._target_index.get(target), self._sample_index.get(sample)
+        return (row, sample_index) in self._pairs
+
+    def update_pair(self, sample, target, summary):
+        """Record the hits of the motifs of `sample` in `target`, a DataFrame as returned by summarize_fimo_tsv."""
+        with self._lock:
+            row = self._index(self._target_index, self.targets, target)
+            sample_index = self._index(self._sample_index, self.samples, sample)
+            columns = [self._column(sample_index, motif_id, motif_alt_id)
+                       for motif_id, motif_alt_id in zip(summary['motif_id'], summary['motif_alt_id'])]
+            cells = {'columns': np.array(columns, dtype=np.int64)}
+            cells.update({field: summary[field].to_numpy(dtype=FIELD_DTYPES[field]) for field in FIELDS})
+            self._updates[(row, sample_index)] = cells
+            self._pairs.add((row, sample_index))
+
+    def add_fimo_tsv(self, tsv, sample, target, chunk_rows=DEFAULT_CHUNK_ROWS):
+        """Record the pair (sample, target) from its fimo.tsv, returns the number of motifs with hits."""
+        summary = summarize_fimo_tsv(tsv, chunk_rows)
+        self.update_pair(sample, target, summary)
+        return len(summary)
+
+    def _pair_keys(self, rows, sample_indexes):
+        return rows * max(1, len(self.samples)) + sample_indexes
+
+    def _merge(self):
+        """Fold the pairs updated since the last merge into the coordinate arrays."""
+        if not self._updates:
+            return
+        cells = self._cells
+        motif_samples = np.array(self.motif_samples, dtype=np.int64)
+        updated = np.array([self._pair_keys(row, sample_index) for row, sample_index in self._updates], dtype=np.int64)
+        keep = ~np.isin(self._pair_keys(cells['rows'], motif_samples[cells['columns']]), updated)
+        merged = {name: [values[keep]] for name, values in cells.items()}
+        for (row, _), update in self._updates.items():
+            merged['rows'].append(np.full(len(update['columns']), row, dtype=np.int64))
+            for name, values in update.items():
+                merged[name].append(values)
+        merged = {name: np.concatenate(parts) for name, parts in merged.items()}
+        order = np.lexsort((merged['columns'], merged['rows']))
+        self._cells = {name: values[order] for name, values in merged.items()}
+        self._updates = {}
+
+    def retain_pairs(self, pairs):
+        """Drop the recorded pairs that are not in `pairs`, (sample, target) tuples, e.g. of removed samples."""
+        with self._lock:
+            self._merge()
+            kept = {(self._target_index[target], self._sample_index[sample]) for sample, target in pairs
+                    if target in self._target_index and sample in self._sample_index}
+            dropped = self._pairs - kept
+            if not dropped:
+                return
+            cells = self._cells
+            motif_samples = np.array(self.motif_samples, dtype=np.int64)
+            dropped_keys = np.array([self._pair_keys(row, sample_index) for row, sample_index in dropped], dtype=np.int64)
+            keep = ~np.isin(self._pair_keys(cells['rows'], motif_samples[cells['columns']]), dropped_keys)
+            self._cells = {name: values[keep] for name, values in cells.items()}
+            self._pairs = kept
+            logger.info(f"Dropped {len(dropped)} pairs from the occupancy matrix")
+
+    def cells(self):
+        """The coordinate arrays: rows, columns and one array per field."""
+        with self._lock:
+            self._merge()
+            return dict(self._cells)
+
+    def to_dense(self, field='count'):
+        """Dense targets x motifs array of one field, FIELD_FILL where there is no hit."""
+        cells = self.cells()
+        dense = np.full(self.shape, FIELD_FILL[field], dtype=FIELD_DTYPES[field])
+        dense[cells['rows'], cells['columns']] = cells[field]
+        return dense
+
+    def save(self, stream):
+        cells = self.cells()
+        pairs = np.array(sorted(self._pairs), dtype=np.int64).reshape(-1, 2)
+        np.savez_compressed(
+            stream, version=np.array(OCCUPANCY_VERSION),
+            targets=np.array(self.targets, dtype=str), samples=np.array(self.samples, dtype=str),
+            motif_samples=np.array(self.motif_samples, dtype=np.int64),
+            motif_ids=np.array(self.motif_ids, dtype=str), motif_alt_ids=np.array(self.motif_alt_ids, dtype=str),
+            pairs=pairs, **cells)
+
+    @classmethod
+    def load(cls, source):
+        """Read a matrix written by save(), from a path or a seekable binary stream."""
+        matrix = cls()
+        with np.load(source, allow_pickle=False) as data:
+            if int(data['version']) != OCCUPANCY_VERSION:
+                raise ValueError(f"Unsupported occupancy matrix version {int(data['version'])}")
+            for target in data['targets'].tolist():
+                matrix._index(matrix._target_index, matrix.targets, target)
+            for sample in data['samples'].tolist():
+                matrix._index(matrix._sample_index, matrix.samples, sample)
+            for sample_index, motif_id, motif_alt_id in zip(data['motif_samples'].tolist(), data['motif_ids'].tolist(),
+                                                            data['motif_alt_ids'].tolist()):
+                matrix._column(sample_index, motif_id, motif_alt_id)
+            matrix._pairs = {(row, sample_index) for row, sample_index in data['pairs'].tolist()}
+            matrix._cells = {name: data[name].astype(dtype) for name, dtype in
+                             [('rows', np.int64), ('columns', np.int64)] + [(f, FIELD_DTYPES[f]) for f in FIELDS]}
+        return matrix
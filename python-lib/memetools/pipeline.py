@@ -0,0 +1,242 @@
+import contextlib
+import functools
+import logging
+import time
+import concurrent.futures
+from collections import deque
+
+from memetools.metrics import measure_call
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD = 'download'
+PROCESS = 'process'
+UPLOAD = 'upload'
+
+
+class PipelinedExecutor(object):
+    """
+    Runs jobs through download -> process -> upload stages without a barrier
+    between stages.
+
+    A job is handed to the process pool as soon as its download has finished,
+    and its result is uploaded as soon as it has been processed. At most
+    `max_in_flight` jobs are admitted at the same time, which caps the local
+    disk used by staged inputs and outputs that have not been uploaded yet.
+
+    Each stage receives the output of the previous one, the first stage
+    receives the job itself. `download` and `upload` run in threads; `process`
+    runs in a ProcessPoolExecutor so it, and its argument, must be picklable.
+
+    With a `cost` function, jobs are admitted by decreasing estimated work so
+    the longest ones do not end up in the tail, and a job only enters the
+    process stage once its estimated memory fits in `memory_budget` next to
+    the jobs already running (a job alone always runs).
+
+    With a `runner` (memetools.runner.CommandRunner), `process` only builds the
+    memetools.runner.Command of a job, run by the runner as an external
+    process without any Python worker process in between.
+
+    With `metrics` (memetools.metrics.RunMetrics), the time spent in each stage
+    is added to the download, process and upload stages of the report, and
+    every job going through the process stage gets a record with its CPU time
+    and peak RSS, plus the fields returned by `job_info`.
+    """
+
+    def __init__(self, process, download=None, upload=None, max_workers=1, transfer_workers=1, max_in_flight=None,
+                 bypass=None, cost=None, memory_budget=None, runner=None, metrics=None, job_info=None):
+        """
+        :param process: callable run in the process pool
+        :param download: optional callable staging the inputs of a job, run in a thread
+        :param upload: optional callable publishing the result of a job, run in a thread
+        :param max_workers: number of processes running the process stage
+        :param transfer_workers: number of threads for each of the download and upload stages
+        :param max_in_flight: maximum number of jobs admitted and not yet uploaded, defaults to 2 * max_workers
+        :param bypass: optional predicate on the download output, jobs for which it is true skip the process
+                       stage (e.g. results restored from a cache) and their download output is uploaded as is
+        :param cost: optional function of a job returning its memetools.scheduler.JobCost
+        :param memory_budget: total estimated memory in bytes of the jobs in the process stage, None for no limit
+        :param runner: optional CommandRunner running the commands built by `process`, instead of a process pool
+        :param metrics: optional RunMetrics receiving stage times and job records
+        :param job_info: optional function of the process stage input returning extra fields of its job record,
+                         e.g. input bytes and number of sequences
+        """
+        self.process = process
+        self.download = download
+        self.upload = upload
+        self.max_workers = max_workers
+        self.transfer_workers = transfer_workers
+        self.max_in_flight = max_in_flight or 2 * max_workers
+        self.bypass = bypass
+        self.cost = cost
+        self.memory_budget = memory_budget
+        self.runner = runner
+        self.metrics = metrics
+        self.job_info = job_info
+
+    def _timed(self, stage, func):
+        if self.metrics is None:
+            return func
+
+        def timed(value):
+            with self.metrics.timer(stage):
+                return func(value)
+        return timed
+
+    def _record_job(self, job, describe, started, future):
+        """Add the process stage of a job to the metrics, unless it was cancelled before it started."""
+        value, command, start = started
+        usage = None
+        if command is not None:
+            usage = command.usage
+        elif not future.cancelled() and future.exception() is None:
+            usage = future.result()[1]
+        if future.cancelled() and usage is None:
+            return
+        usage = dict(usage or {})
+        seconds = usage.pop('seconds', time.perf_counter() - start)
+        status = 'succeeded' if not future.cancelled() and future.exception() is None else 'failed'
+        fields = {}
+        if self.job_info is not None:
+            try:
+                fields = self.job_info(value)
+            except Exception as e:
+                logger.debug(f"No job information for {describe(job)}: {e}")
+        self.metrics.add_time(PROCESS, seconds)
+        self.metrics.record_job(describe(job), status, seconds, usage, **fields)
+
+    def run(self, jobs, describe=str):
+        """
+        Run all jobs and return the list of jobs that went through every stage.
+        On the first failure no new job is admitted, jobs that have not started
+        are cancelled and a RuntimeError is raised once running ones are done.
+        """
+        jobs = list(jobs)
+        costs = {}
+        if self.cost is not None:
+            costs = {id(job): self.cost(job) for job in jobs}
+            jobs.sort(key=lambda job: costs[id(job)].work, reverse=True)
+        waiting = deque(jobs)
+        pending = {}
+        completed = []
+        errors = []
+        # Jobs ready for the process stage, waiting for a worker or for memory
+        ready = []
+        running = {'jobs': 0, 'memory': 0}
+        # Process stage futures to (input, command, start time), for the metrics
+        started = {}
+        download = self._timed(DOWNLOAD, self.download)
+        upload = self._timed(UPLOAD, self.upload)
+
+        with contextlib.ExitStack() as stack:
+            download_pool = stack.enter_context(concurrent.futures.ThreadPoolExecutor(max_workers=self.transfer_workers))
+            upload_pool = stack.enter_context(concurrent.futures.ThreadPoolExecutor(max_workers=self.transfer_workers))
+            process_pool = None
+            if self.runner is None:
+                process_pool = stack.enter_context(concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers))
+
+            def submit_process(value):
+                start = time.perf_counter()
+                if self.runner is not None:
+                    command = self.process(value)
+                    future = self.runner.submit(command)
+                elif self.metrics is not None:
+                    command = None
+                    future = process_pool.submit(functools.partial(measure_call, self.process), value)
+                else:
+                    return process_pool.submit(self.process, value)
+                if self.metrics is not None:
+                    started[future] = (value, command, start)
+                return future
+
+            def memory_of(job):
+                return costs[id(job)].memory if id(job) in costs else 0
+
+            def submit(stage, job, value):
+                if stage == DOWNLOAD:
+                    future = download_pool.submit(download, value)
+                elif stage == PROCESS:
+                    ready.append((job, value))
+                    dispatch()
+                    return
+                else:
+                    future = upload_pool.submit(upload, value)
+                pending[future] = (stage, job)
+
+            def dispatch():
+                # Largest jobs first, as long as workers are free and their memory fits
+                ready.sort(key=lambda item: costs[id(item[0])].work if id(item[0]) in costs else 0, reverse=True)
+                index = 0
+                while index < len(ready) and running['jobs'] < self.max_workers:
+                    job, value = ready[index]
+                    memory = memory_of(job)
+                    if (self.memory_budget is not None and running['jobs']
+                            and running['memory'] + memory > self.memory_budget):
+                        index += 1
+                        continue
+                    del ready[index]
+                    running['jobs'] += 1
+                    running['memory'] += memory
+                    try:
+                        pending[submit_process(value)] = (PROCESS, job)
+                    except Exception as e:
+                        # Building the command failed, report it like a failed process stage
+                        future = concurrent.futures.Future()
+                        future.set_exception(e)
+                        pending[future] = (PROCESS, job)
+
+            def next_stage(stage, value):
+                if stage == DOWNLOAD and (self.bypass is None or not self.bypass(value)):
+                    return PROCESS
+                if stage in (DOWNLOAD, PROCESS) and self.upload is not None:
+                    return UPLOAD
+                return None
+
+            def admit():
+                while waiting and len(pending) + len(ready) < self.max_in_flight:
+                    job = waiting.popleft()
+                    logger.debug(f"Admitting job {describe(job)}")
+                    submit(DOWNLOAD if self.download is not None else PROCESS, job, job)
+
+            admit()
+            while pending or ready:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    stage, job = pending.pop(future)
+                    if stage == PROCESS:
+                        running['jobs'] -= 1
+                        running['memory'] -= memory_of(job)
+                    if future in started:
+                        self._record_job(job, describe, started.pop(future), future)
+                    if future.cancelled():
+                        continue
+                    try:
+                        value = future.result()
+                        if stage == PROCESS and self.runner is None and self.metrics is not None:
+                            value = value[0]
+                    except Exception as e:
+                        logger.error(f"Job {describe(job)} failed during {stage}: {e}")
+                        errors.append(f"{describe(job)} ({stage}): {e}")
+                        continue
+                    logger.debug(f"Job {describe(job)} finished {stage}")
+                    stage = next_stage(stage, value)
+                    if stage is None:
+                        completed.append(job)
+                    elif not errors:
+                        submit(stage, job, value)
+
+                if errors:
+                    # Fail fast: drop what has not started, let running work finish
+                    waiting.clear()
+                    del ready[:]
+                    for future in pending:
+                        future.cancel()
+                else:
+                    dispatch()
+                    admit()
+
+        if errors:
+            combined_message = "Pipeline failed with the following errors:\n" + "\n".join(errors)
+            raise RuntimeError(combined_message)
+        logger.info(f"Pipeline completed {len(completed)} jobs")
+        return completed
@@ -0,0 +1,233 @@
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+
+from memetools.metrics import rusage_fields
+
+logger = logging.getLogger(__name__)
+
+# Lines of stderr kept to report why a command failed
+TAIL_LINES = 20
+
+
+def _all_tasks(loop):
+    # asyncio.all_tasks only exists from Python 3.7, and Task.all_tasks also returns finished tasks
+    if hasattr(asyncio, 'all_tasks'):
+        return asyncio.all_tasks(loop)
+    return {task for task in asyncio.Task.all_tasks(loop) if not task.done()}
+
+
+def _current_task(loop):
+    if hasattr(asyncio, 'current_task'):
+        return asyncio.current_task(loop)
+    return asyncio.Task.current_task(loop)
+
+
+class CommandFailed(RuntimeError):
+    """An external command exited with a non-zero status or timed out."""
+
+
+class Command(object):
+    """
+    An external command to run: its arguments, a description for the logs, an
+    optional file receiving its stdout, and the value the runner returns once
+    it succeeded (typically the job it belongs to).
+
+    Once the command has exited, `usage` holds its wall time, CPU times and
+    peak RSS (see memetools.metrics.rusage_fields) whether it succeeded or not.
+    """
+
+    def __init__(self, args, description=None, stdout_path=None, timeout=None, result=None, cwd=None):
+        self.args = [str(arg) for arg in args]
+        self.description = description or self.args[0]
+        self.stdout_path = stdout_path
+        self.timeout = timeout
+        self.result = result
+        self.cwd = cwd
+        self.usage = None
+
+
+class CommandRunner(object):
+    """
+    Runs external commands concurrently from one process, on an asyncio event
+    loop living in a background thread.
+
+    Unlike a process pool calling subprocess.run, no Python worker is started
+    per job and outputs are not buffered: stderr and stdout are streamed to the
+    log line by line as the command writes them (or stdout to a file). Each
+    command gets a wall-clock timeout after which it is killed, and cancelling
+    the future returned by submit() kills the command.
+
+    Commands are reaped with os.wait4 from a thread instead of asyncio's child
+    watcher, which gives the resource usage of each command on its own, where
+    getrusage(RUSAGE_CHILDREN) would mix up commands running at the same time.
+    """
+
+    def __init__(self, max_concurrency=1, timeout=None, output_level=logging.INFO):
+        """
+        :param max_concurrency: number of commands running at the same time
+        :param timeout: default wall-clock timeout of a command in seconds, None for no timeout
+        :param output_level: log level of the streamed command output
+        """
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self.output_level = output_level
+        self.loop = None
+        self._thread = None
+        self._semaphore = None
+        self._waiters = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        # One thread per running command, blocked in os.wait4 until it exits
+        self._waiters = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                              thread_name_prefix='command-wait')
+        self._thread = threading.Thread(target=self._run_loop, name='command-runner', daemon=True)
+        self._thread.start()
+        self._semaphore = asyncio.run_coroutine_threadsafe(self._make_semaphore(), self.loop).result()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _make_semaphore(self):
+        return asyncio.Semaphore(self.max_concurrency)
+
+    async def _cancel_pending(self):
+        """Cancel the commands still pending or running and wait until they are killed and reaped."""
+        tasks = [task for task in _all_tasks(self.loop) if task is not _current_task(self.loop)]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self):
+        """Kill the commands still running, then stop the event loop and its threads."""
+        if self.loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._cancel_pending(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+        self.loop = None
+        self._waiters.shutdown()
+
+    def submit(self, command):
+        """Schedule a command, returns a concurrent.futures.Future of command.result."""
+        return asyncio.run_coroutine_threadsafe(self._run(command), self.loop)
+
+    def run_all(self, commands):
+        """
+        Run commands concurrently and return their results in order. On the
+        first failure the other commands are cancelled (running ones killed)
+        and CommandFailed is raised.
+        """
+        futures = [self.submit(command) for command in commands]
+        done, not_done = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_EXCEPTION)
+        failed = [future for future in done if not future.cancelled() and future.exception() is not None]
+        if failed:
+            for future in not_done:
+                future.cancel()
+            concurrent.futures.wait(not_done)
+            raise failed[0].exception()
+        return [future.result() for future in futures]
+
+    async def _stream(self, stream, description, tail=None, sink=None):
+        while True:
+            line = await stream.readline()
+            if not line:
+                break
+            if sink is not None:
+                sink.write(line)
+                continue
+            text = line.decode('utf-8', 'replace').rstrip()
+            if tail is not None:
+                tail.append(text)
+            logger.log(self.output_level, f"[{description}] {text}")
+
+    async def _run(self, command):
+        async with self._semaphore:
+            return await self._execute(command)
+
+    async def _pipe_reader(self, pipe):
+        reader = asyncio.StreamReader()
+        await self.loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+        return reader
+
+    async def _execute(self, command):
+        timeout = command.timeout if command.timeout is not None else self.timeout
+        sink = open(command.stdout_path, 'wb') if command.stdout_path else None
+        tail = collections.deque(maxlen=TAIL_LINES)
+        logger.debug(f"Starting {command.description}: {' '.join(command.args)}")
+        start = time.perf_counter()
+        try:
+            process = subprocess.Popen(command.args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=command.cwd)
+            exit_status = self.loop.run_in_executor(self._waiters, os.wait4, process.pid, 0)
+            readers = asyncio.gather(
+                self._stream(await self._pipe_reader(process.stdout), command.description, sink=sink),
+                self._stream(await self._pipe_reader(process.stderr), command.description, tail=tail))
+            try:
+                await asyncio.wait_for(asyncio.shield(readers), timeout)
+                returncode = self._reap(command, process, await exit_status, start)
+            except asyncio.TimeoutError:
+                self._kill(process, exit_status)
+                self._reap(command, process, await exit_status, start)
+                self._cancel(readers)
+                raise CommandFailed(f"{command.description} timed out after {timeout} s")
+            except asyncio.CancelledError:
+                self._kill(process, exit_status)
+                self._reap(command, process, await exit_status, start)
+                self._cancel(readers)
+                logger.info(f"Cancelled {command.description}")
+                raise
+        finally:
+            if sink is not None:
+                sink.close()
+        if returncode != 0:
+            details = '\n'.join(tail)
+            logger.error(f"{command.description} failed with exit status {returncode}")
+            raise CommandFailed(f"{command.description} failed with exit status {returncode}:\n{details}")
+        logger.debug(f"{command.description} succeeded")
+        return command.result
+
+    @staticmethod
+    def _reap(command, process, exit_status, start):
+        """Record the usage of an exited command from its os.wait4 result, returns its exit code."""
+        _, status, usage = exit_status
+        command.usage = rusage_fields(usage)
+        command.usage['seconds'] = time.perf_counter() - start
+        if os.WIFSIGNALED(status):
+            returncode = -os.WTERMSIG(status)
+        else:
+            returncode = os.WEXITSTATUS(status)
+        # Already reaped, keep Popen from waiting for it again
+        process.returncode = returncode
+        return returncode
+
+    @staticmethod
+    def _cancel(readers):
+        readers.cancel()
+        # Nobody awaits the readers anymore, retrieve their outcome so asyncio does not log it
+        readers.add_done_callback(lambda future: future.cancelled() or future.exception())
+
+    @staticmethod
+    def _kill(process, exit_status):
+        # Not process.kill(), which polls and could reap the process before os.wait4 does
+        if exit_status.done():
+            return
+        try:
+            os.kill(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
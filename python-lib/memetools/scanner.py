@@ -0,0 +1,245 @@
+import logging
+import math
+
+import numpy as np
+
+from memetools.fasta import FastaReader
+from memetools.motifs import MotifSet, read_meme
+
+logger = logging.getLogger(__name__)
+
+# Identifies the scanner in cache and manifest keys, bump it whenever results change
+SCANNER_VERSION = 'memetools-scanner 1'
+
+DNA_ALPHABET = 'ACGT'
+# Code of every byte that is not an unambiguous DNA letter, windows holding it are not scored
+INVALID_CODE = 4
+DEFAULT_THRESHOLD = 1e-4
+DEFAULT_PSEUDOCOUNT = 0.1
+DEFAULT_MAX_STORED_SCORES = 100000
+# FIMO's default number of sites for motifs that do not declare nsites
+DEFAULT_NSITES = 20
+# Log-odds scores are scaled to integers in [0, SCORE_RANGE] per column to get exact p-values
+SCORE_RANGE = 1000
+# Number of bases scored at once, sequences are concatenated up to this size
+CHUNK_BASES = 16 * 1024 * 1024
+
+FIMO_COLUMNS = ['motif_id', 'motif_alt_id', 'sequence_name', 'start', 'stop', 'strand', 'score', 'p-value',
+                'q-value', 'matched_sequence']
+
+_ENCODING = np.full(256, INVALID_CODE, dtype=np.uint8)
+for _code, _letter in enumerate(DNA_ALPHABET):
+    _ENCODING[ord(_letter)] = _code
+    _ENCODING[ord(_letter.lower())] = _code
+_COMPLEMENT = bytes.maketrans(b'ACGTacgt', b'TGCAtgca')
+
+
+def encode(sequence):
+    """uint8 codes of a DNA sequence (str or bytes): A, C, G, T -> 0..3, anything else -> INVALID_CODE."""
+    if isinstance(sequence, str):
+        sequence = sequence.encode('ascii', 'replace')
+    return _ENCODING[np.frombuffer(sequence, dtype=np.uint8)]
+
+
+def reverse_complement(sequence):
+    return sequence.translate(_COMPLEMENT)[::-1]
+
+
+class ScoredMotif(object):
+    """
+    Integer log-odds matrices of a motif, for both strands, with the exact
+    distribution of their scores under the background model.
+
+    As in FIMO, the pseudocount-adjusted log2-odds matrix is scaled to integers
+    so the score distribution of a random window is computed exactly by
+    convolving the columns, which gives the p-value of every reachable score.
+    """
+
+    def __init__(self, motif, background, pseudocount=DEFAULT_PSEUDOCOUNT, score_range=SCORE_RANGE):
+        self.motif = motif
+        nsites = motif.nsites or DEFAULT_NSITES
+        probabilities = (motif.probabilities * nsites + pseudocount * background) / (nsites + pseudocount)
+        log_odds = np.log2(probabilities / background)
+        self.offset = log_odds.min()
+        spread = log_odds.max() - self.offset
+        self.scale = math.floor(score_range / spread) if spread > 0 else 1
+        scaled = np.rint((log_odds - self.offset) * self.scale).astype(np.int32)
+        # Extra column for INVALID_CODE, windows holding it are masked out
+        self.forward = np.zeros((motif.width, 5), dtype=np.int32)
+        self.forward[:, :4] = scaled
+        self.reverse = np.zeros_like(self.forward)
+        self.reverse[:, :4] = scaled[::-1, ::-1]
+        self.pvalues = self._pvalues(scaled, background)
+
+    @staticmethod
+    def _pvalues(scaled, background):
+        """P(score >= s) for every integer score s of a random window."""
+        distribution = np.ones(1)
+        for column in scaled:
+            convolved = np.zeros(len(distribution) + column.max())
+            for letter, score in enumerate(column):
+                convolved[score:score + len(distribution)] += distribution * background[letter]
+            distribution = convolved
+        return np.minimum(np.cumsum(distribution[::-1])[::-1], 1.0)
+
+    def cutoff(self, threshold):
+        """Lowest integer score whose p-value is at most threshold."""
+        return int(np.searchsorted(-self.pvalues, -threshold, side='left'))
+
+    def raw_score(self, score):
+        """Log2-odds score of an integer score, as reported by FIMO."""
+        return score / self.scale + self.offset * self.motif.width
+
+
+def _window_scores(matrix, codes, count):
+    scores = np.zeros(count, dtype=np.int32)
+    for position, column in enumerate(matrix):
+        scores += column[codes[position:position + count]]
+    return scores
+
+
+def iter_sequence_chunks(fasta_path, chunk_bases=CHUNK_BASES):
+    """
+    Yield (names, starts, raw) batches of sequences joined by a newline, so a
+    separator between two sequences invalidates every window spanning both.
+    """
+    names, parts, starts = [], [], []
+    size = 0
+    with open(fasta_path, 'rb') as f:
+        for header, sequence in iter(FastaReader(f).read_record_bytes, None):
+            fields = header.split(None, 1)
+            names.append(fields[0].decode('utf-8') if fields else '')
+            starts.append(size)
+            parts.append(sequence)
+            size += len(sequence) + 1
+            if size >= chunk_bases:
+                yield names, np.array(starts), b'\n'.join(parts)
+                names, parts, starts = [], [], []
+                size = 0
+    if names:
+        yield names, np.array(starts), b'\n'.join(parts)
+
+
+class MotifScanner(object):
+    """
+    In-process replacement for `fimo --oc` on DNA motifs.
+
+    Sequences are encoded as uint8 codes and scored for every window and both
+    strands with vectorized NumPy operations, several sequences at a time.
+    Only zero-order backgrounds are supported: FIMO scores windows against a
+    higher-order Markov background given with --bfile, which this scanner
+    does not implement, so such a background is rejected. Hits are windows whose p-value is at most `threshold`; q-values use the
+    Benjamini-Hochberg procedure over all windows tested, and only the
+    `max_stored_scores` best hits are kept.
+    """
+
+    def __init__(self, motifs, threshold=DEFAULT_THRESHOLD, both_strands=True, pseudocount=DEFAULT_PSEUDOCOUNT,
+                 max_stored_scores=DEFAULT_MAX_STORED_SCORES, background=None):
+        """
+        :param motifs: a MotifSet, or the path of a MEME format motif file
+        :param background: letter frequencies, or the path of a zero-order background file, used instead of
+                           the backgrounds of the motif file (like fimo --bfile)
+        """
+        if not isinstance(motifs, MotifSet):
+            motifs = read_meme(motifs)
+        if motifs.alphabet != DNA_ALPHABET:
+            raise ValueError(f"The scanner only supports DNA motifs, got alphabet {motifs.alphabet}")
+        if isinstance(background, str):
+            from memetools.background import MarkovBackground
+            model = MarkovBackground.read(background)
+            if model.order > 0:
+                raise ValueError(f"The scanner only supports zero-order backgrounds, {background} has order "
+                                 f"{model.order}")
+            background = model.zero_order()
+        self.motifs = [ScoredMotif(motifs.motif(index), motifs.background(index) if background is None else background,
+                                   pseudocount)
+                       for index in range(len(motifs))]
+        self.threshold = threshold
+        self.both_strands = both_strands
+        self.max_stored_scores = max_stored_scores
+
+    def scan(self, fasta_path):
+        """Return (hits, tested): hits are (p-value, motif index, name, start, stop, strand, raw score, sequence)."""
+        hits = []
+        tested = 0
+        strands = [('+', 'forward'), ('-', 'reverse')] if self.both_strands else [('+', 'forward')]
+        for names, starts, raw in iter_sequence_chunks(fasta_path):
+            codes = encode(raw)
+            invalid = np.concatenate(([0], np.cumsum(codes == INVALID_CODE)))
+            for motif_index, motif in enumerate(self.motifs):
+                width = motif.motif.width
+                count = len(codes) - width + 1
+                if count <= 0:
+                    continue
+                valid = invalid[width:width + count] == invalid[:count]
+                tested += int(valid.sum()) * len(strands)
+                cutoff = motif.cutoff(self.threshold)
+                for strand, attribute in strands:
+                    scores = _window_scores(getattr(motif, attribute), codes, count)
+                    positions = np.nonzero(valid & (scores >= cutoff))[0]
+                    sequence_indices = np.searchsorted(starts, positions, side='right') - 1
+                    for position, sequence_index in zip(positions.tolist(), sequence_indices.tolist()):
+                        start = position - int(starts[sequence_index]) + 1
+                        matched = raw[position:position + width]
+                        if strand == '-':
+                            matched = reverse_complement(matched)
+                        score = int(scores[position])
+                        hits.append((float(motif.pvalues[score]), motif_index, names[sequence_index], start,
+                                     start + width - 1, strand, motif.raw_score(score), matched.decode('ascii')))
+            if len(hits) > 2 * self.max_stored_scores:
+                hits = self._prune(hits)
+        return self._prune(hits), tested
+
+    def _prune(self, hits):
+        if len(hits) <= self.max_stored_scores:
+            return hits
+        hits.sort(key=lambda hit: hit[0])
+        logger.warning(f"More than {self.max_stored_scores} hits, keeping the best ones")
+        return hits[:self.max_stored_scores]
+
+    def write_tsv(self, fasta_path, output_path):
+        """Scan fasta_path and write the hits to output_path in fimo.tsv format. Returns the number of hits."""
+        hits, tested = self.scan(fasta_path)
+        hits.sort(key=lambda hit: hit[0])
+        # Benjamini-Hochberg, made monotonic from the largest p-value down
+        qvalues = [0.0] * len(hits)
+        running = 1.0
+        for rank in range(len(hits), 0, -1):
+            running = min(running, hits[rank - 1][0] * tested / rank)
+            qvalues[rank - 1] = running
+        order = sorted(range(len(hits)), key=lambda index: (hits[index][1], hits[index][0]))
+        with open(output_path, 'w') as f:
+            f.write('\t'.join(FIMO_COLUMNS) + '\n')
+            for index in order:
+                pvalue, motif_index, name, start, stop, strand, score, matched = hits[index]
+                motif = self.motifs[motif_index].motif
+                f.write(f"{motif.id}\t{motif.alt_id}\t{name}\t{start}\t{stop}\t{strand}\t{score:.6g}\t"
+                        f"{pvalue:.3g}\t{qvalues[index]:.3g}\t{matched}\n")
+            f.write(f"\n# {SCANNER_VERSION}\n# thresh: {self.threshold} tested windows: {tested}\n")
+        return len(hits)
+
+
+def scanner_options(fimo_options):
+    """
+    MotifScanner keyword arguments from a FIMO options map. Returns (kwargs,
+    ignored option names), the scanner only implements the options below.
+    """
+    kwargs = {}
+    ignored = []
+    for key, value in (fimo_options or {}).items():
+        name = str(key).strip().lstrip('-')
+        value = str(value).strip()
+        if name == 'thresh':
+            kwargs['threshold'] = float(value)
+        elif name == 'norc':
+            kwargs['both_strands'] = value.lower() == 'false'
+        elif name == 'motif-pseudo':
+            kwargs['pseudocount'] = float(value)
+        elif name == 'max-stored-scores':
+            kwargs['max_stored_scores'] = int(value)
+        elif name == 'bfile':
+            if value != '--motif--':
+                kwargs['background'] = value
+        elif name not in ('text', 'verbosity') and value.lower() != 'false':
+            ignored.append(name)
+    return kwargs, ignored
@@ -0,0 +1,126 @@
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+# Share of the detected memory limit given to the jobs, the rest is left to the recipe and the OS
+MEMORY_BUDGET_FRACTION = 0.8
+COUNT_BUFFER_SIZE = 8 * 1024 * 1024
+# Bytes read at the start of a FASTA file to estimate its number of sequences
+ESTIMATE_SAMPLE_SIZE = 1024 * 1024
+
+# Rough cost models, in bytes of memory per byte of FASTA input. STREME keeps
+# every sequence and its shuffled controls in memory, FIMO streams sequences.
+BASE_MEMORY = 64 * 1024 * 1024
+STREME_MEMORY_PER_BYTE = 20
+FIMO_MEMORY_PER_BYTE = 1
+
+
+def _read_first_line(path):
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except (IOError, OSError):
+        return None
+
+
+def cpu_limit():
+    """Number of CPUs this process may use: the cgroup quota (v2 or v1) when set, else the CPUs it is bound to."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota, period = None, None
+    cpu_max = _read_first_line(os.path.join(CGROUP_ROOT, 'cpu.max'))
+    if cpu_max:
+        fields = cpu_max.split()
+        if fields[0] != 'max' and len(fields) > 1:
+            quota, period = int(fields[0]), int(fields[1])
+    else:
+        cfs_quota = _read_first_line(os.path.join(CGROUP_ROOT, 'cpu', 'cpu.cfs_quota_us'))
+        cfs_period = _read_first_line(os.path.join(CGROUP_ROOT, 'cpu', 'cpu.cfs_period_us'))
+        if cfs_quota and cfs_period and int(cfs_quota) > 0:
+            quota, period = int(cfs_quota), int(cfs_period)
+    if quota and period:
+        cpus = min(cpus, max(1, quota // period))
+    return cpus
+
+
+def memory_limit():
+    """Memory available to this process in bytes: the cgroup limit (v2 or v1) when set, else the physical memory."""
+    physical = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    for path in (os.path.join(CGROUP_ROOT, 'memory.max'),
+                 os.path.join(CGROUP_ROOT, 'memory', 'memory.limit_in_bytes')):
+        value = _read_first_line(path)
+        if value and value.isdigit():
+            # cgroup v1 reports a huge number when there is no limit
+            return min(int(value), physical)
+    return physical
+
+
+def default_workers(requested):
+    """The requested number of workers, or the CPU limit when it is 0 or less."""
+    return int(requested) if requested and int(requested) > 0 else cpu_limit()
+
+
+def default_memory_budget(requested_bytes):
+    """The requested memory budget, or a share of the memory limit when it is 0 or less."""
+    if requested_bytes and requested_bytes > 0:
+        return int(requested_bytes)
+    return int(memory_limit() * MEMORY_BUDGET_FRACTION)
+
+
+def count_sequences(path):
+    """Number of records of a FASTA file, counting '>' at line starts in large blocks."""
+    count = 0
+    previous = b'\n'
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(COUNT_BUFFER_SIZE), b''):
+            count += block.count(b'\n>') + (1 if previous == b'\n' and block.startswith(b'>') else 0)
+            previous = block[-1:]
+    return count
+
+
+def estimate_sequences(path, sample_size=ESTIMATE_SAMPLE_SIZE):
+    """
+    Number of records of a FASTA file, counted in its first sample_size bytes
+    and extrapolated to the file size, so scheduling does not read whole files.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        block = f.read(sample_size)
+    count = block.count(b'\n>') + (1 if block.startswith(b'>') else 0)
+    if size <= len(block):
+        return count
+    # Only the records complete in the block are extrapolated, the last one may be cut
+    end = block.rfind(b'\n>')
+    if end <= 0:
+        return max(count, 1)
+    return int(round((count - 1) * size / (end + 1)))
+
+
+class JobCost(object):
+    """Estimated relative run time (`work`) and peak memory in bytes of a job."""
+
+    def __init__(self, work, memory):
+        self.work = work
+        self.memory = memory
+
+    def __repr__(self):
+        return f"JobCost(work={self.work}, memory={self.memory / (1024 * 1024):.0f} MB)"
+
+
+def streme_cost(fasta_size, sequences=None):
+    """
+    STREME run time grows with the total sequence length, and a little more
+    with the number of sequences for the same length (per sequence shuffling
+    and scoring); its memory with the total length.
+    """
+    work = fasta_size + 64 * (sequences or 0)
+    return JobCost(work, BASE_MEMORY + STREME_MEMORY_PER_BYTE * fasta_size)
+
+
+def fimo_cost(fasta_size, motif_size):
+    """FIMO run time grows with the sequence length times the size of the motif file; its memory barely does."""
+    return JobCost(fasta_size * max(1, motif_size), BASE_MEMORY + FIMO_MEMORY_PER_BYTE * fasta_size)
@@ -0,0 +1,262 @@
+import logging
+import os
+import shutil
+import threading
+import time
+import concurrent.futures
+
+logger = logging.getLogger(__name__)
+
+# Copy buffer for managed folder streams, far above shutil's 64 KB default
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+DEFAULT_TRANSFER_WORKERS = 4
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_DELAY = 1.0
+
+
+def local_folder_path(folder):
+    """Return the local filesystem path of a managed folder, or None when it is not stored locally."""
+    try:
+        path = folder.get_path()
+    except Exception:
+        return None
+    return path if path and os.path.isdir(path) else None
+
+
+def link_file(source, destination, allow_symlink=True):
+    """
+    Make `destination` point to the content of `source` without copying it: a
+    hardlink when both are on the same filesystem, else a symlink if allowed,
+    else a plain copy. Returns the method used.
+    """
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+        return 'hardlink'
+    except OSError:
+        pass
+    if allow_symlink:
+        try:
+            os.symlink(os.path.abspath(source), destination)
+            return 'symlink'
+        except OSError:
+            pass
+    shutil.copyfile(source, destination)
+    return 'copy'
+
+
+class TransferStats(object):
+    """Aggregated counters of a FolderTransfer, safe to update from several threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.files = 0
+        self.bytes = 0
+        self.retries = 0
+        self.linked = 0
+        self.seconds = 0.0
+
+    def add(self, nbytes, seconds):
+        with self._lock:
+            self.files += 1
+            self.bytes += nbytes
+            self.seconds += seconds
+
+    def add_linked(self):
+        with self._lock:
+            self.files += 1
+            self.linked += 1
+
+    def add_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def rate(self, elapsed):
+        """Aggregate throughput in bytes/s over a wall-clock duration."""
+        return self.bytes / elapsed if elapsed > 0 else 0.0
+
+    def describe(self, elapsed):
+        return (f"{self.files} files, {self.bytes / (1024 * 1024):.1f} MB in {elapsed:.1f} s "
+                f"({self.rate(elapsed) / (1024 * 1024):.1f} MB/s, {self.linked} linked, {self.retries} retries)")
+
+
+class FolderTransfer(object):
+    """
+    Concurrent file transfers between a managed folder and the local disk.
+
+    Works with dataiku.Folder or any object exposing get_download_stream() and
+    upload_stream(), such as memetools.localfolder.LocalFolder. Each file is
+    retried with exponential backoff before the transfer is reported as failed.
+
+    When the folder is stored on the local filesystem, files are linked
+    instead of streamed: downloads become hardlinks (or symlinks across
+    filesystems) to the original files and uploads become hardlinks into the
+    folder, so no byte is read or written.
+
+    All batch transfers of an instance share one thread pool, so concurrent
+    callers (e.g. the upload threads of a PipelinedExecutor) never move more
+    than max_workers files at once. Call close() to stop its threads.
+    """
+
+    def __init__(self, folder, max_workers=DEFAULT_TRANSFER_WORKERS, retries=DEFAULT_RETRIES,
+                 retry_delay=DEFAULT_RETRY_DELAY, buffer_size=COPY_BUFFER_SIZE, link_local=True):
+        """
+        :param folder: the managed folder to transfer from/to
+        :param max_workers: number of files transferred concurrently
+        :param retries: number of additional attempts per file after a failure
+        :param retry_delay: delay before the first retry, doubled at each attempt
+        :param buffer_size: size of the copy buffer
+        :param link_local: link files instead of copying them when the folder is local
+        """
+        self.folder = folder
+        self.local_root = local_folder_path(folder) if link_local else None
+        self.max_workers = max(1, max_workers)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.buffer_size = buffer_size
+        self.downloaded = TransferStats()
+        self.uploaded = TransferStats()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._pool_thread = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Stop the threads of the shared pool, a later transfer starts a new one."""
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _pool_call(self, func, source, destination):
+        # Pool threads are marked by their tasks, ThreadPoolExecutor only takes an initializer from Python 3.7
+        self._pool_thread.active = True
+        return func(source, destination)
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers,
+                                                                       thread_name_prefix='memetools-transfer')
+            return self._executor
+
+    def _with_retry(self, action, description, stats):
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                nbytes = action()
+                stats.add(nbytes, time.perf_counter() - start)
+                return nbytes
+            except Exception as e:
+                if attempt >= self.retries:
+                    logger.error(f"Failed to {description} after {attempt + 1} attempts: {e}")
+                    raise IOError(f"Failed to {description}: {e}")
+                delay = self.retry_delay * (2 ** attempt)
+                logger.warning(f"Failed to {description} ({e}), retrying in {delay:.1f} s")
+                stats.add_retry()
+                attempt += 1
+                time.sleep(delay)
+
+    def local_path(self, remote_path):
+        """Path of a folder file on the local filesystem, None when the folder is not local."""
+        if self.local_root is None:
+            return None
+        return os.path.join(self.local_root, remote_path.lstrip('/'))
+
+    def download_file(self, remote_path, local_path):
+        """Download one file, returns the number of bytes written."""
+        if self.local_root is not None:
+            method = link_file(self.local_path(remote_path), local_path)
+            self.downloaded.add_linked()
+            logger.debug(f"Linked {remote_path} to {local_path} ({method})")
+            return 0
+
+        def action():
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            with self.folder.get_download_stream(remote_path) as f_remote, open(local_path, 'wb') as f_local:
+                shutil.copyfileobj(f_remote, f_local, self.buffer_size)
+                return f_local.tell()
+        nbytes = self._with_retry(action, f"download {remote_path}", self.downloaded)
+        logger.debug(f"Copied {remote_path} to {local_path}")
+        return nbytes
+
+    def upload_file(self, local_path, remote_path):
+        """Upload one file, returns the number of bytes read."""
+        if self.local_root is not None:
+            # No symlink here, the local file is usually removed right after
+            method = link_file(local_path, self.local_path(remote_path), allow_symlink=False)
+            self.uploaded.add_linked()
+            logger.debug(f"Linked {local_path} to {remote_path} ({method})")
+            return 0
+
+        def action():
+            with open(local_path, 'rb', buffering=self.buffer_size) as f_local:
+                self.folder.upload_stream(remote_path, f_local)
+            return os.path.getsize(local_path)
+        nbytes = self._with_retry(action, f"upload {local_path}", self.uploaded)
+        logger.debug(f"Uploaded {local_path} to {remote_path}")
+        return nbytes
+
+    def _run_all(self, func, pairs, verb, stats):
+        start = time.perf_counter()
+        bytes_before = stats.bytes
+        if len(pairs) <= 1 or getattr(self._pool_thread, 'active', False):
+            # A single file, or a call from a thread of the pool itself, which must not wait on the pool
+            for source, destination in pairs:
+                func(source, destination)
+        else:
+            futures = [self._get_executor().submit(self._pool_call, func, source, destination)
+                       for source, destination in pairs]
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                # Transfers already running finish before the failure is reported
+                concurrent.futures.wait(futures)
+                raise
+        elapsed = time.perf_counter() - start
+        nbytes = stats.bytes - bytes_before
+        logger.debug(f"{verb} {len(pairs)} files, {nbytes / (1024 * 1024):.1f} MB in {elapsed:.1f} s "
+                    f"({nbytes / elapsed / (1024 * 1024) if elapsed > 0 else 0.0:.1f} MB/s)")
+        return nbytes
+
+    def download_files(self, remote_paths, local_root):
+        """Download remote paths concurrently under local_root, keeping their relative layout."""
+        pairs = [(remote_path, os.path.join(local_root, remote_path.lstrip('/'))) for remote_path in remote_paths]
+        self._run_all(self.download_file, pairs, "Downloaded", self.downloaded)
+        return [local_path for _, local_path in pairs]
+
+    def download_partition(self, local_root, partition_id=None):
+        """Download every file of a partition (or of the whole folder) under local_root."""
+        return self.download_files(self.folder.list_paths_in_partition(partition_id), local_root)
+
+    def upload_files(self, pairs):
+        """Upload (local_path, remote_path) pairs concurrently."""
+        self._run_all(self.upload_file, list(pairs), "Uploaded", self.uploaded)
+
+    def upload_directory(self, local_dir, relative_to, exclude=None):
+        """
+        Upload every file under local_dir to the path it has relative to `relative_to`.
+        :param exclude: optional predicate on file names, matching files are skipped
+        :return: the list of uploaded local paths
+        """
+        pairs = []
+        for root, _, file_names in os.walk(local_dir):
+            for file_name in file_names:
+                if exclude is not None and exclude(file_name):
+                    continue
+                local_path = os.path.join(root, file_name)
+                remote_path = '/' + os.path.relpath(local_path, relative_to).replace(os.sep, '/')
+                pairs.append((local_path, remote_path))
+        self.upload_files(pairs)
+        return [local_path for local_path, _ in pairs]
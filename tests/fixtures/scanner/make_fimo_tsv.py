@@ -0,0 +1,120 @@
+"""
+Write fimo.tsv, the expected `fimo --text --thresh 1e-3 --bfile --motif-- streme.txt sequences.fasta`
+hits of the scanner fixture.
+
+Run it with a FIMO executable (FIMO_EXEC or fimo on the PATH) to record FIMO's own output. Without one,
+the hits are computed here independently of memetools.scanner: log2-odds with FIMO's 0.1 motif
+pseudocount, exact p-values from every word of the motif width (no score discretization), windows with
+letters other than ACGT skipped. The file records which of the two produced it.
+"""
+import bisect
+import functools
+import itertools
+import math
+import operator
+import os
+import shutil
+import subprocess
+import sys
+
+FIXTURES = os.path.dirname(os.path.abspath(__file__))
+MOTIFS = os.path.join(FIXTURES, 'streme.txt')
+SEQUENCES = os.path.join(FIXTURES, 'sequences.fasta')
+OUTPUT = os.path.join(FIXTURES, 'fimo.tsv')
+THRESHOLD = 1e-3
+PSEUDOCOUNT = 0.1
+ALPHABET = 'ACGT'
+COLUMNS = ['motif_id', 'motif_alt_id', 'sequence_name', 'start', 'stop', 'strand', 'score', 'p-value', 'q-value',
+           'matched_sequence']
+
+
+def read_motifs(path):
+    """Background and (id, alt_id, nsites, rows) of every motif of a MEME text file."""
+    with open(path) as f:
+        lines = [line.strip() for line in f]
+    background, motifs = None, []
+    for number, line in enumerate(lines):
+        if line.startswith('Background letter frequencies'):
+            fields = lines[number + 1].split()
+            background = [float(fields[fields.index(letter) + 1]) for letter in ALPHABET]
+        elif line.startswith('MOTIF'):
+            fields = line.split()
+            motifs.append([fields[1], fields[2] if len(fields) > 2 else '', None, []])
+        elif line.startswith('letter-probability matrix'):
+            fields = line.replace('= ', '=').split()
+            values = dict(field.split('=') for field in fields if '=' in field)
+            motifs[-1][2] = float(values.get('nsites', 20))
+            motifs[-1][3] = [[float(value) for value in row.split()]
+                             for row in lines[number + 1:number + 1 + int(values['w'])]]
+    return background, motifs
+
+
+def read_sequences(path):
+    sequences = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('>'):
+                sequences.append([line[1:].split()[0], ''])
+            elif line:
+                sequences[-1][1] += line
+    return sequences
+
+
+def reference_hits():
+    background, motifs = read_motifs(MOTIFS)
+    rows = []
+    for motif_id, alt_id, nsites, matrix in motifs:
+        log_odds = [[math.log2((p * nsites + PSEUDOCOUNT * b) / (nsites + PSEUDOCOUNT) / b)
+                     for p, b in zip(row, background)] for row in matrix]
+        width = len(log_odds)
+        # Every word of the motif width with its score and background probability
+        words = sorted(((sum(log_odds[i][letter] for i, letter in enumerate(word)),
+                         functools.reduce(operator.mul, (background[letter] for letter in word)))
+                        for word in itertools.product(range(4), repeat=width)), reverse=True)
+        negated = [-score for score, _ in words]
+        tails = list(itertools.accumulate(probability for _, probability in words))
+
+        def pvalue(score):
+            # Probability of the words scoring at least `score`, up to rounding errors
+            return tails[bisect.bisect_right(negated, -score + 1e-9) - 1]
+
+        for name, sequence in read_sequences(SEQUENCES):
+            for start in range(len(sequence) - width + 1):
+                window = sequence[start:start + width]
+                if any(letter not in ALPHABET for letter in window.upper()):
+                    continue
+                codes = [ALPHABET.index(letter) for letter in window.upper()]
+                for strand, word in (('+', codes), ('-', [3 - code for code in reversed(codes)])):
+                    score = sum(log_odds[i][letter] for i, letter in enumerate(word))
+                    p = pvalue(score)
+                    if p <= THRESHOLD:
+                        matched = window if strand == '+' else window[::-1].translate(str.maketrans('ACGTacgt',
+                                                                                                    'TGCAtgca'))
+                        rows.append((motif_id, alt_id, name, start + 1, start + width, strand, score, p, matched))
+    rows.sort(key=lambda row: (row[0], row[7]))
+    lines = ['\t'.join(COLUMNS)]
+    lines += [f"{m}\t{a}\t{n}\t{s}\t{e}\t{strand}\t{score:.6g}\t{p:.3g}\t\t{matched}"
+              for m, a, n, s, e, strand, score, p, matched in rows]
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    fimo = os.environ.get('FIMO_EXEC') or shutil.which('fimo')
+    if fimo:
+        version = subprocess.run([fimo, '--version'], capture_output=True, text=True, check=True).stdout.strip()
+        output = subprocess.run([fimo, '--text', '--thresh', str(THRESHOLD), '--bfile', '--motif--', MOTIFS,
+                                 SEQUENCES], capture_output=True, text=True, check=True).stdout
+        source = f"fimo {version}"
+    else:
+        output = reference_hits()
+        source = 'make_fimo_tsv.py reference computation (no fimo executable available)'
+    with open(OUTPUT, 'w') as f:
+        f.write(output)
+        f.write(f"# Expected hits of `fimo --text --thresh {THRESHOLD} --bfile --motif-- streme.txt sequences.fasta`\n")
+        f.write(f"# Generated by {source}, regenerate with tests/fixtures/scanner/make_fimo_tsv.py\n")
+    print(f"Wrote {OUTPUT} from {source}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import os
+
+from memetools.cache import ResultCache, cache_key
+from memetools.localfolder import LocalFolder
+
+
+def make_output(tmp_path, name, size=100):
+    output_dir = os.path.join(str(tmp_path), name)
+    os.makedirs(output_dir)
+    with open(os.path.join(output_dir, 'streme.txt'), 'wb') as f:
+        f.write(os.urandom(size))
+    with open(os.path.join(output_dir, '.memetools-done-x'), 'w') as f:
+        f.write('marker')
+    return output_dir
+
+
+def key(name):
+    return cache_key(name, {'nmotifs': 5}, 'streme 5.5.7')
+
+
+def test_cache_key_normalizes_options():
+    assert cache_key('d', {'--nmotifs': 5, 'dna': True, 'rna': 'false'}, 'v') == \
+        cache_key('d', {'dna': 'TRUE', 'nmotifs': ' 5'}, 'v')
+    assert cache_key('d', {'nmotifs': 5}, 'v') != cache_key('d', {'nmotifs': 5}, 'v2')
+
+
+def test_store_restore_round_trip(tmp_path):
+    folder = LocalFolder(os.path.join(str(tmp_path), 'cache'))
+    cache = ResultCache(folder)
+    output_dir = make_output(tmp_path, 'out')
+    cache.store(key('a'), output_dir, exclude=lambda name: name.startswith('.memetools-done-'),
+                description='P1:S000')
+    cache.save_index()
+
+    restored = os.path.join(str(tmp_path), 'restored')
+    reloaded = ResultCache(folder)
+    assert reloaded.index[key('a')]['description'] == 'P1:S000'
+    assert reloaded.restore(key('a'), restored)
+    assert os.listdir(restored) == ['streme.txt']
+    with open(os.path.join(output_dir, 'streme.txt'), 'rb') as f, \
+            open(os.path.join(restored, 'streme.txt'), 'rb') as g:
+        assert f.read() == g.read()
+    assert not reloaded.restore(key('b'), restored)
+    assert (reloaded.hits, reloaded.misses) == (1, 1)
+
+
+def test_eviction_keeps_max_size(tmp_path):
+    folder = LocalFolder(os.path.join(str(tmp_path), 'cache'))
+    cache = ResultCache(folder)
+    cache.store(key('a'), make_output(tmp_path, 'a', 5000))
+    cache.save_index()
+    entry_size = cache.size
+    cache = ResultCache(folder, max_size=2 * entry_size + entry_size // 2)
+    for name in 'bcd':
+        cache.store(key(name), make_output(tmp_path, name, 5000))
+    cache.save_index()
+
+    assert cache.size <= cache.max_size
+    assert set(cache.index) == {key('c'), key('d')}
+    assert not os.path.exists(folder._local(ResultCache._entry_path(key('a'))))
+    assert not os.path.exists(folder._local(ResultCache._entry_path(key('b'))))
+
+
+def test_concurrent_runs_keep_each_other_entries(tmp_path):
+    folder = LocalFolder(os.path.join(str(tmp_path), 'cache'))
+    first, second = ResultCache(folder), ResultCache(folder)
+    first.store(key('a'), make_output(tmp_path, 'a'), description='P1:S000')
+    second.store(key('b'), make_output(tmp_path, 'b'), description='P2:S000')
+    first.save_index()
+    second.save_index()
+
+    assert set(ResultCache(folder).index) == {key('a'), key('b')}
+    # An entry evicted by one run is not brought back by the other
+    first = ResultCache(folder)
+    third = ResultCache(folder)
+    first.max_size = first.index[key('b')]['size']
+    first.evict()
+    first.save_index()
+    third.save_index()
+    assert set(ResultCache(folder).index) == {key('b')}
+
+
+def test_save_index_adopts_orphan_entries(tmp_path):
+    folder = LocalFolder(os.path.join(str(tmp_path), 'cache'))
+    lost = ResultCache(folder)
+    lost.store(key('a'), make_output(tmp_path, 'a'))
+    # The index update of `lost` is never saved, its archive is still accounted for
+    cache = ResultCache(folder)
+    cache.store(key('b'), make_output(tmp_path, 'b'))
+    cache.save_index()
+
+    index = ResultCache(folder).index
+    assert set(index) == {key('a'), key('b')}
+    assert index[key('a')]['size'] == lost.index[key('a')]['size']
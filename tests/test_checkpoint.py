@@ -0,0 +1,48 @@
+import os
+
+from memetools.checkpoint import Checkpoints
+from memetools.localfolder import LocalFolder
+
+
+def write(folder, path, data=b'x'):
+    folder.upload_data(path, data)
+
+
+def test_remove_stale_results(tmp_path):
+    folder = LocalFolder(str(tmp_path))
+    for sample in ('S1', 'S2', 'S3'):
+        write(folder, f"/P1/{sample}/streme.txt")
+    Checkpoints(folder, 'P1').mark_done('/P1/S1', 'k1')
+    Checkpoints(folder, 'P1').mark_done('/P1/S1/nested', 'k2')
+    write(folder, '/P1/S1/nested/streme.txt')
+    write(folder, '/P1/motifs.bin')
+
+    checkpoints = Checkpoints(folder, 'P1')
+    removed = checkpoints.remove_stale(['/P1/S1', '/P1/S3'], '/P1')
+
+    assert sorted(removed) == ['/P1/S1/nested/.memetools-done-k2', '/P1/S1/nested/streme.txt', '/P1/S2/streme.txt']
+    assert folder.list_paths_in_partition('P1') == ['/P1/S1/.memetools-done-k1', '/P1/S1/streme.txt',
+                                                    '/P1/S3/streme.txt', '/P1/motifs.bin']
+    assert checkpoints.is_done('/P1/S1', 'k1')
+    assert not checkpoints.is_done('/P1/S1/nested', 'k2')
+
+
+def test_nothing_stale(tmp_path):
+    folder = LocalFolder(str(tmp_path))
+    write(folder, '/P1/S1/streme.txt')
+    assert Checkpoints(folder, 'P1').remove_stale(['/P1/S1'], '/P1') == []
+    assert os.path.exists(os.path.join(str(tmp_path), 'P1', 'S1', 'streme.txt'))
+
+
+def test_invalidate_removes_previous_results(tmp_path):
+    folder = LocalFolder(str(tmp_path))
+    for path in ('/P1/S1/streme.txt', '/P1/S1/streme.html', '/P1/S1/nested/streme.txt', '/P1/S2/streme.txt'):
+        write(folder, path)
+    Checkpoints(folder, 'P1').mark_done('/P1/S1', 'old')
+
+    checkpoints = Checkpoints(folder, 'P1')
+    checkpoints.remove_stale(['/P1/S1', '/P1/S1/nested', '/P1/S2'], '/P1')
+    checkpoints.invalidate('/P1/S1')
+
+    assert not checkpoints.is_done('/P1/S1', 'old')
+    assert folder.list_paths_in_partition('P1') == ['/P1/S1/nested/streme.txt', '/P1/S2/streme.txt']
@@ -0,0 +1,94 @@
+import io
+import os
+
+import pytest
+
+from memetools.background import MarkovBackground
+from memetools.cluster import HitExpander, cluster_motifs
+from memetools.motifs import MotifSet, parse_meme, read_meme, write_meme
+from memetools.scanner import MotifScanner
+
+from test_scanner import MOTIFS, SEQUENCES, read_tsv
+
+THRESHOLD = 3e-4
+# The core of the first fixture motif with mismatched flanks, a hit of the member but not of its representative
+WEAK_FLANKS = '>weak\nAAAAACGACGTCGAAAAAAAAAAAAAAAAAAAAAAACCCCCCAGACGTCTTTTT\n'
+
+
+def sequences(tmp_path):
+    path = os.path.join(str(tmp_path), 'sequences.fasta')
+    if not os.path.exists(path):
+        with open(SEQUENCES) as source, open(path, 'w') as f:
+            f.write(source.read() + WEAK_FLANKS)
+    return path
+
+
+def member_text():
+    """A second sample whose single motif is the six core columns of the first fixture motif."""
+    motifs = read_meme(MOTIFS)
+    stream = io.StringIO()
+    write_meme(motifs, stream, [0])
+    lines = stream.getvalue().splitlines()
+    start = lines.index(next(line for line in lines if line.startswith('letter-probability')))
+    rows = lines[start + 1:start + 9]
+    lines[start] = lines[start].replace('w= 8', 'w= 6')
+    lines[start - 1] = 'MOTIF 1-GACGTC STREME-1'
+    return '\n'.join(lines[:start + 1] + rows[1:7]) + '\n'
+
+
+def expand(tmp_path, slack=10):
+    motif_set = MotifSet.concatenate([read_meme(MOTIFS, 'a'), parse_meme(member_text(), 'b')])
+    clusters = cluster_motifs(motif_set, 0.95)
+    assert list(clusters.representatives) == [0, 1]
+    assert clusters.representative[2] == 0
+    representatives = os.path.join(str(tmp_path), 'representatives.txt')
+    with open(representatives, 'w') as f:
+        write_meme(motif_set, f, clusters.representatives, ids=[str(index) for index in clusters.representatives])
+    expander = HitExpander(motif_set, clusters, THRESHOLD, slack=slack)
+    scan_tsv = os.path.join(str(tmp_path), 'scan.tsv')
+    MotifScanner(representatives, threshold=expander.scan_threshold).write_tsv(sequences(tmp_path), scan_tsv)
+    outputs = {'a': os.path.join(str(tmp_path), 'a'), 'b': os.path.join(str(tmp_path), 'b')}
+    expander.expand(scan_tsv, outputs)
+    return {sample: read_tsv(os.path.join(output_dir, 'fimo.tsv')) for sample, output_dir in outputs.items()}
+
+
+def direct_scan(tmp_path, text, sample):
+    path = os.path.join(str(tmp_path), f"{sample}.txt")
+    with open(path, 'w') as f:
+        f.write(text)
+    tsv = os.path.join(str(tmp_path), f"{sample}.tsv")
+    MotifScanner(path, threshold=THRESHOLD).write_tsv(sequences(tmp_path), tsv)
+    return read_tsv(tsv)
+
+
+def test_expanded_hits_match_direct_scans(tmp_path):
+    expanded = expand(tmp_path)
+    with open(MOTIFS) as f:
+        expected = {'a': direct_scan(tmp_path, f.read(), 'a'), 'b': direct_scan(tmp_path, member_text(), 'b')}
+    for sample in ('a', 'b'):
+        assert set(expanded[sample]) == set(expected[sample])
+        for key, (score, pvalue, matched) in expected[sample].items():
+            assert expanded[sample][key][0] == pytest.approx(score, abs=1e-3)
+            assert expanded[sample][key][1] == pytest.approx(pvalue, rel=1e-2)
+            assert expanded[sample][key][2] == matched
+
+
+def test_representative_hits_are_filtered_at_the_threshold(tmp_path):
+    expanded = expand(tmp_path)
+    assert expanded['a']
+    assert all(pvalue <= THRESHOLD for _, pvalue, _ in expanded['a'].values())
+
+
+def test_member_hits_missed_without_slack(tmp_path):
+    assert not any(key[1] == 'weak' for key in expand(tmp_path, slack=1)['b'])
+    assert any(key[1] == 'weak' for key in expand(tmp_path)['b'])
+
+
+def test_higher_order_backgrounds_are_rejected(tmp_path):
+    path = os.path.join(str(tmp_path), 'order1.bg')
+    with open(path, 'w') as f:
+        MarkovBackground.from_fasta([SEQUENCES], order=1).write(f)
+    motif_set = read_meme(MOTIFS)
+    expander = HitExpander(motif_set, cluster_motifs(motif_set), THRESHOLD)
+    with pytest.raises(ValueError):
+        expander._rescore(0, 'TGACGTCA', path)
@@ -0,0 +1,83 @@
+import gzip
+import io
+import os
+import struct
+
+import pytest
+
+from memetools.compression import (BGZF, BGZF_EOF, GZIP, NONE, ZSTD, CompressedWriter, compressed_reader,
+                                   decompress_file, open_compressed)
+
+DATA = b''.join(b'>seq%d\n' % index + b'ACGTTGCA' * (index % 50 + 1) + b'\n' for index in range(5000))
+
+
+class TrickleStream(object):
+    """Non-seekable stream returning at most a few bytes per read, like a network stream."""
+
+    def __init__(self, data, step=3):
+        self._stream = io.BytesIO(data)
+        self._step = step
+
+    def read(self, size=-1):
+        return self._stream.read(self._step if size < 0 else min(size, self._step))
+
+
+def compress(data, compression):
+    stream = io.BytesIO()
+    with CompressedWriter(stream, compression) as writer:
+        # Writes of odd sizes, spanning BGZF blocks
+        for start in range(0, len(data), 10007):
+            writer.write(data[start:start + 10007])
+    return stream.getvalue()
+
+
+def bgzf_blocks(data):
+    """Uncompressed size of every block of a BGZF file, checking the BSIZE field of each one."""
+    sizes = []
+    offset = 0
+    while offset < len(data):
+        assert data[offset:offset + 4] == b'\x1f\x8b\x08\x04'
+        xlen, = struct.unpack_from('<H', data, offset + 10)
+        assert data[offset + 12:offset + 16] == b'BC\x02\x00'
+        bsize, = struct.unpack_from('<H', data, offset + 16)
+        end = offset + bsize + 1
+        sizes.append(struct.unpack_from('<I', data, end - 4)[0])
+        assert xlen == 6 and bsize < 65536
+        offset = end
+    assert offset == len(data)
+    return sizes
+
+
+@pytest.mark.parametrize('compression', [NONE, GZIP, BGZF, ZSTD])
+def test_round_trip_through_non_seekable_streams(compression):
+    if compression == ZSTD:
+        pytest.importorskip('zstandard')
+    compressed = compress(DATA, compression)
+    with compressed_reader(TrickleStream(compressed)) as reader:
+        assert reader.read() == DATA
+
+
+def test_bgzf_blocks():
+    compressed = compress(DATA, BGZF)
+    assert compressed.endswith(BGZF_EOF)
+    sizes = bgzf_blocks(compressed)
+    assert sizes[-1] == 0 and all(size <= 0xff00 for size in sizes)
+    assert sum(sizes) == len(DATA)
+    assert gzip.decompress(compressed) == DATA
+
+
+@pytest.mark.parametrize('compression', [GZIP, BGZF])
+def test_appended_files_read_as_one(tmp_path, compression):
+    path = os.path.join(str(tmp_path), 'sample.fasta.gz')
+    for mode, part in (('wb', DATA[:1000]), ('ab', DATA[1000:])):
+        with open_compressed(path, mode, compression=compression) as writer:
+            writer.write(part)
+    with open_compressed(path) as reader:
+        assert reader.read() == DATA
+    destination = os.path.join(str(tmp_path), 'plain', 'sample.fasta')
+    assert decompress_file(path, destination) == len(DATA)
+
+
+def test_uncompressed_and_short_input():
+    assert compressed_reader(io.BytesIO(b'>a')).read() == b'>a'
+    assert compressed_reader(io.BytesIO(b'')).read() == b''
@@ -0,0 +1,50 @@
+import os
+
+from memetools.dedup import collapse_fasta, read_sequence_map
+
+FASTA = ('>s1 first\nACGT\nACGT\n'
+         '>s2\nacgtacgt\n'
+         '>s3\nGGGG\n'
+         '>s4 wrapped differently\nACGTAC\nGT\n'
+         '>s5\nTTTT\n'
+         '>s6\nGGGG')
+
+
+def write_fasta(tmp_path, text=FASTA):
+    path = os.path.join(str(tmp_path), 'input.fasta')
+    with open(path, 'w') as f:
+        f.write(text)
+    return path
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def test_duplicates_are_collapsed_into_their_first_occurrence(tmp_path):
+    source = write_fasta(tmp_path)
+    destination = os.path.join(str(tmp_path), 'out', 'collapsed.fasta')
+    map_path = os.path.join(str(tmp_path), 'out', 'sequence_map.tsv')
+    stats = collapse_fasta(source, destination, map_path=map_path, chunk_size=5)
+
+    assert read(destination) == '>s1 first\nACGTACGT\n>s3\nGGGG\n>s5\nTTTT\n'
+    assert (stats.records, stats.unique, stats.kept) == (6, 3, 3)
+    assert (stats.residues, stats.unique_residues, stats.kept_residues) == (36, 16, 16)
+    assert read_sequence_map(map_path) == {'s1': ['s1', 's2', 's4'], 's3': ['s3', 's6'], 's5': ['s5']}
+
+
+def test_subsampling_is_deterministic(tmp_path):
+    text = ''.join(f">s{i}\n{'ACGT'[i % 4] * (i + 1)}\n>d{i}\n{'ACGT'[i % 4] * (i + 1)}\n" for i in range(20))
+    source = write_fasta(tmp_path, text)
+    outputs = []
+    for name, seed in (('a', 1), ('b', 1), ('c', 2)):
+        destination = os.path.join(str(tmp_path), f"{name}.fasta")
+        map_path = os.path.join(str(tmp_path), f"{name}.tsv")
+        stats = collapse_fasta(source, destination, map_path=map_path, max_sequences=5, seed=seed)
+        assert (stats.unique, stats.kept) == (20, 5)
+        outputs.append(read(destination))
+        # Sequences left out by subsampling are still mapped
+        assert sum(len(members) for members in read_sequence_map(map_path).values()) == 40
+    assert outputs[0] == outputs[1] != outputs[2]
+    assert outputs[0].count('>s') == 5 and '>d' not in outputs[0]
@@ -0,0 +1,72 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from memetools.demux import UNASSIGNED_SAMPLE, SampleDemultiplexer
+
+
+class Streams(object):
+    """open_stream factory keeping the content of every sample in memory."""
+
+    def __init__(self):
+        self.content = {}
+        self.opened = []
+
+    def __call__(self, sample_id, append):
+        self.opened.append((sample_id, append))
+        assert append == (sample_id in self.content)
+        stream = Stream(self.content, sample_id)
+        self.content.setdefault(sample_id, b'')
+        return stream
+
+
+class Stream(io.BytesIO):
+    def __init__(self, content, sample_id):
+        super().__init__()
+        self.target = (content, sample_id)
+
+    def close(self):
+        content, sample_id = self.target
+        content[sample_id] += self.getvalue()
+        super().close()
+
+
+def test_lru_eviction_and_append_on_reopen():
+    streams = Streams()
+    with SampleDemultiplexer(streams, max_open_files=2) as demultiplexer:
+        demultiplexer.write_records([('A', 'a1', 'AC'), ('B', 'b1', 'GT')])
+        # Writing C evicts A, the least recently used, then writing A again evicts B
+        demultiplexer.write_records([('B', 'b2', 'TT'), ('C', 'c1', 'CC')])
+        demultiplexer.write_records([('A', 'a2', 'GG')])
+        assert demultiplexer.evictions == 2
+        assert demultiplexer.samples == ['A', 'B', 'C']
+
+    assert streams.opened == [('A', False), ('B', False), ('C', False), ('A', True)]
+    assert streams.content == {'A': b'>a1\nAC\n>a2\nGG\n', 'B': b'>b1\nGT\n>b2\nTT\n', 'C': b'>c1\nCC\n'}
+    assert [demultiplexer.records_written(sample) for sample in 'ABC'] == [2, 2, 1]
+
+
+def test_batches_larger_than_the_pool():
+    streams = Streams()
+    records = [(f"S{i % 5}", f"r{i}", 'ACGT') for i in range(20)]
+    with SampleDemultiplexer(streams, max_open_files=2, max_workers=3) as demultiplexer:
+        demultiplexer.write_records(records[:10])
+        demultiplexer.write_records(records[10:])
+
+    for i in range(5):
+        expected = b''.join(f">r{j}\nACGT\n".encode() for j in range(i, 20, 5))
+        assert streams.content[f"S{i}"] == expected
+
+
+def test_dataframe_rows_without_sample_id():
+    streams = Streams()
+    df = pd.DataFrame({'sample_id': ['A', None, 'B', np.nan, 'A'],
+                       'id': ['r1', 'r2', 'r3', 'r4', 'r5'],
+                       'sequence': ['AA', 'CC', 'GG', 'TT', 'AC']})
+    with SampleDemultiplexer(streams) as demultiplexer:
+        demultiplexer.write_dataframe(df, 'sample_id', 'id', 'sequence')
+        assert demultiplexer.unassigned == 2
+
+    assert streams.content == {'A': b'>r1\nAA\n>r5\nAC\n', UNASSIGNED_SAMPLE: b'>r2\nCC\n>r4\nTT\n',
+                               'B': b'>r3\nGG\n'}
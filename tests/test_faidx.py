@@ -0,0 +1,70 @@
+import io
+import os
+
+import pytest
+
+from memetools.faidx import FaiEntry, FastaIndex, IndexedFasta, build_fai, write_fai
+from memetools.fasta import FastaWriter
+
+# Expected .fai entries of FASTA, offsets counted as samtools faidx does (CRLF lines, no final newline)
+FASTA = b'>one\nATGC\nATGC\nAT\n>two desc\nGGGG\n>empty\n>crlf\r\nACG\r\nTA\r\n>one\nCCCC\n>last\nTTTTT'
+FAI = [FaiEntry('one', 10, 5, 4, 5), FaiEntry('two', 4, 28, 4, 5), FaiEntry('empty', 0, 40, 0, 0),
+       FaiEntry('crlf', 5, 47, 3, 5), FaiEntry('last', 5, 72, 5, 6)]
+
+
+def write_fasta(tmp_path, data=FASTA):
+    path = os.path.join(str(tmp_path), 'sample.fasta')
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def test_index_matches_samtools(tmp_path):
+    index = build_fai(write_fasta(tmp_path))
+    assert list(index) == FAI
+    # Like samtools, only the first record of a name is indexed
+    assert index.duplicates == 1
+
+
+def test_index_round_trip(tmp_path):
+    path = write_fasta(tmp_path)
+    write_fai(path)
+    with open(path + '.fai') as f:
+        assert f.read().splitlines()[0] == 'one\t10\t5\t4\t5'
+    assert list(FastaIndex.load(path + '.fai')) == FAI
+
+
+def test_lines_of_different_lengths_are_rejected(tmp_path):
+    with pytest.raises(ValueError, match='different lengths'):
+        build_fai(write_fasta(tmp_path, b'>a\nACG\nACGT\n'))
+    with pytest.raises(ValueError, match='different lengths'):
+        build_fai(write_fasta(tmp_path, b'>a\nACGT\n\nACGT\n'))
+
+
+def test_fetch_and_regions(tmp_path):
+    with IndexedFasta(write_fasta(tmp_path)) as fasta:
+        assert fasta.names == ['one', 'two', 'empty', 'crlf', 'last']
+        assert fasta.fetch('one') == 'ATGCATGCAT'
+        assert fasta.fetch('one', 3, 9) == 'CATGCA'
+        assert fasta.fetch('crlf') == 'ACGTA'
+        assert fasta.fetch('empty') == ''
+        assert fasta.fetch('last', 2) == 'TTT'
+        # samtools regions are 1-based and inclusive, out of range bounds are clipped
+        assert fasta.region('one:4-6') == 'CAT'
+        assert fasta.region('one:9') == 'AT'
+        assert fasta.region('two:3-100') == 'GG'
+        assert fasta.region('one:1,000-2,000') == ''
+        assert fasta.region('two') == 'GGGG'
+
+
+def test_writer_index_matches_built_index(tmp_path):
+    records = [('r1 comment', 'ACGT' * 10), ('r2', 'AC'), ('r3', ''), ('r4', 'G' * 16)]
+    stream = io.BytesIO()
+    index = FastaIndex()
+    writer = FastaWriter(stream, line_width=8, index=index)
+    writer.write_records(records)
+    writer.close()
+    path = write_fasta(tmp_path, stream.getvalue())
+    assert list(index) == list(build_fai(path))
+    with IndexedFasta(path, index=index) as fasta:
+        assert [fasta.fetch(name) for name in fasta.names] == [sequence for _, sequence in records]
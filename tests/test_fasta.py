@@ -0,0 +1,74 @@
+import io
+
+import pytest
+
+from memetools.fasta import FastaReader, FastaWriter
+
+FASTA = (b'; comment line before the first record\n'
+         b'>seq1 first record\nACGT\nAC\n'
+         b'>seq2\n\n'
+         b'>seq3 a > inside the header\nGG>TT\r\nCC \n'
+         b'>seq4\nTTTT')
+RECORDS = [('seq1', 'first record', 'ACGTAC'), ('seq2', '', ''), ('seq3', 'a > inside the header', 'GG>TTCC'),
+           ('seq4', '', 'TTTT')]
+
+
+@pytest.mark.parametrize('chunk_size', list(range(1, len(FASTA) + 2)))
+def test_records_do_not_depend_on_chunk_boundaries(chunk_size):
+    assert list(FastaReader(io.BytesIO(FASTA), chunk_size=chunk_size)) == RECORDS
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 1024])
+def test_last_record_is_kept(chunk_size):
+    # The last record has no trailing newline, or ends exactly at a chunk boundary
+    for data in (b'>a\nAC\n>b\nGT', b'>a\nAC\n>b\nGT\n', b'>a\nAC\n>b\n', b'>b'):
+        records = list(FastaReader(io.BytesIO(data), chunk_size=chunk_size))
+        assert records[-1][0] == 'b'
+    assert list(FastaReader(io.BytesIO(b'>a\nAC\n>b\nGT'), chunk_size=chunk_size)) == [('a', '', 'AC'),
+                                                                                      ('b', '', 'GT')]
+
+
+def test_empty_and_headerless_input():
+    assert list(FastaReader(io.BytesIO(b''))) == []
+    assert list(FastaReader(io.BytesIO(b'ACGT\nACGT\n'), chunk_size=3)) == []
+
+
+def test_text_stream_and_raw_records():
+    reader = FastaReader(io.StringIO(FASTA.decode('utf-8')), chunk_size=5)
+    assert reader.read_record_bytes() == (bytearray(b'seq1 first record'), bytearray(b'ACGTAC'))
+    assert [record[0] for record in reader] == ['seq2', 'seq3', 'seq4']
+    assert reader.read_record() is None
+    assert reader.bytes_read == len(FASTA)
+
+
+def test_writer_wraps_lines():
+    stream = io.BytesIO()
+    writer = FastaWriter(stream, line_width=4)
+    writer.write_record('a', 'ACGTACGTAC', comment='first')
+    writer.write_records([('b', 'ACGT'), ('c', ''), ('d', 'ACGTA', 'last')])
+    writer.close()
+    assert stream.getvalue() == b'>a first\nACGT\nACGT\nAC\n>b\nACGT\n>c\n\n>d last\nACGT\nA\n'
+    assert writer.records_written == 4
+    assert writer.bytes_written == len(stream.getvalue())
+
+
+def test_writer_round_trip_and_missing_values():
+    stream = io.StringIO()
+    records = [(f"s{i}", 'ACGT' * i) for i in range(50)]
+    with FastaWriter(stream, line_width=7, buffer_size=16) as writer:
+        writer.write_columns([record[0] for record in records], [record[1] for record in records])
+        writer.write_columns([1, None], [float('nan'), 'GG'], comments=[None, 'x'])
+    text = stream.getvalue()
+    assert text.endswith('>1\n\n> x\nGG\n')
+    parsed = list(FastaReader(io.StringIO(text)))
+    assert parsed[:50] == [(name, '', sequence) for name, sequence in records]
+    assert all(len(line) <= 7 for line in text.splitlines() if not line.startswith('>'))
+
+
+def test_writer_buffers_until_full():
+    stream = io.BytesIO()
+    writer = FastaWriter(stream, buffer_size=20)
+    writer.write_record('a', 'ACGT')
+    assert stream.getvalue() == b''
+    writer.write_record('b', 'ACGTACGTACGT')
+    assert stream.getvalue() == b'>a\nACGT\n>b\nACGTACGTACGT\n'
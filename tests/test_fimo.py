@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+from memetools import fimo
+from memetools.fasta import FastaReader
+from memetools.fimo import (FIMO_TSV_NAME, MANIFEST_NAME, PairManifest, build_pairs, gather_pair_inputs,
+                            path_fingerprint, split_fimo_tsv, write_tagged_fasta)
+from memetools.localfolder import LocalFolder
+
+
+def test_pairs_skip_directories_without_motifs():
+    subfolders = gather_pair_inputs(['/P1/S1/S1.fasta', '/P1/S1/streme.txt', '/P1/S2/S2.fa.gz',
+                                     '/P1/S3/streme.txt', '/P1/S3/S3.fasta', '/P1/S4/streme.txt'])
+    assert subfolders == {'/P1/S1': ('/P1/S1/streme.txt', '/P1/S1/S1.fasta'), '/P1/S2': (None, '/P1/S2/S2.fa.gz'),
+                          '/P1/S3': ('/P1/S3/streme.txt', '/P1/S3/S3.fasta')}
+    assert sorted(build_pairs(subfolders)) == [
+        ('/P1/S1/streme.txt', '/P1/S2/S2.fa.gz', '/P1/S1/S2'), ('/P1/S1/streme.txt', '/P1/S3/S3.fasta', '/P1/S1/S3'),
+        ('/P1/S3/streme.txt', '/P1/S1/S1.fasta', '/P1/S3/S1'), ('/P1/S3/streme.txt', '/P1/S2/S2.fa.gz', '/P1/S3/S2')]
+
+
+def test_manifest_round_trip(tmp_path):
+    folder = LocalFolder(str(tmp_path))
+    path = f"/P1/{MANIFEST_NAME}"
+    manifest = PairManifest(folder, path)
+    assert manifest.pairs == {}
+    manifest.mark_done('/P1/S1/S2', 'k1')
+    manifest.remember_digest('/P1/S2/S2.fasta', [10, 1000], 'd2')
+    manifest.remember_digest('/P1/S3/S3.fasta', None, 'd3')
+    manifest.save()
+
+    reloaded = PairManifest(folder, path)
+    assert reloaded.is_current('/P1/S1/S2', 'k1')
+    assert not reloaded.is_current('/P1/S1/S2', 'k2')
+    assert not reloaded.is_current('/P1/S1/S3', 'k1')
+    assert reloaded.known_digest('/P1/S2/S2.fasta', [10, 1000]) == 'd2'
+    # A changed file, or one without a fingerprint, has to be hashed again
+    assert reloaded.known_digest('/P1/S2/S2.fasta', [10, 2000]) is None
+    assert reloaded.known_digest('/P1/S3/S3.fasta', None) is None
+
+
+def test_manifest_checkpoint_interval(tmp_path):
+    folder = LocalFolder(str(tmp_path))
+    manifest = PairManifest(folder, '/manifest.json')
+    manifest.mark_done('/S1/S2', 'k')
+    manifest.checkpoint(interval=3600)
+    assert not os.path.exists(os.path.join(str(tmp_path), 'manifest.json'))
+    manifest.checkpoint(interval=0)
+    assert PairManifest(folder, '/manifest.json').pairs == {'/S1/S2': 'k'}
+
+
+def test_path_fingerprint(tmp_path):
+    folder = LocalFolder(str(tmp_path))
+    folder.upload_data('/a.fasta', b'>a\nAC\n')
+    size, last_modified = path_fingerprint(folder, '/a.fasta')
+    assert size == 6 and last_modified > 0
+    assert path_fingerprint(folder, '/missing.fasta') is None
+
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def test_tagged_fasta_keeps_sequence_ids(tmp_path):
+    first, second, tagged = (os.path.join(str(tmp_path), name) for name in ('a.fasta', 'b.fasta', 'all.fasta'))
+    write(first, '>s1 comment\nACGT\n>s2\nGG\n')
+    write(second, '>s1\nTT\n')
+    assert write_tagged_fasta([first, second], tagged) == ['0', '1']
+    with open(tagged, 'rb') as f:
+        assert list(FastaReader(f)) == [('0|s1', 'comment', 'ACGT'), ('0|s2', '', 'GG'), ('1|s1', '', 'TT')]
+
+
+COMMENTS = '\n# FIMO (Find Individual Motif Occurrences): Version 5.5.7\n# The format of this file is described at ...\n'
+HEADER = 'motif_id\tmotif_alt_id\tsequence_name\tstart\tstop\tstrand\tscore\tp-value\tq-value\tmatched_sequence\n'
+
+
+@pytest.mark.parametrize('buffer_size', [1, fimo.SPLIT_BUFFER_SIZE])
+def test_split_fimo_tsv(tmp_path, monkeypatch, buffer_size):
+    monkeypatch.setattr(fimo, 'SPLIT_BUFFER_SIZE', buffer_size)
+    tsv_path = os.path.join(str(tmp_path), 'batch.tsv')
+    write(tsv_path, HEADER +
+          'M1\tS-1\t0|s1\t3\t10\t+\t12.5\t1e-05\t\tACGTACGT\n'
+          'M1\tS-1\t1|s1|x\t5\t12\t-\t11\t2e-05\t\tTTTTACGT\n'
+          'M1\tS-1\t0|s2\t1\t8\t+\t10\t3e-05\t\tACGTACGA\n'
+          'M1\tS-1\t2|s9\t1\t8\t+\t10\t3e-05\t\tACGTACGA\n' + COMMENTS)
+    outputs = {tag: os.path.join(str(tmp_path), 'out', tag) for tag in ('0', '1', '3')}
+    assert split_fimo_tsv(tsv_path, outputs) == {'0': 2, '1': 1, '3': 0}
+    assert read(os.path.join(outputs['0'], FIMO_TSV_NAME)) == (
+        HEADER + 'M1\tS-1\ts1\t3\t10\t+\t12.5\t1e-05\t\tACGTACGT\n'
+        'M1\tS-1\ts2\t1\t8\t+\t10\t3e-05\t\tACGTACGA\n' + COMMENTS)
+    # Only the tag is removed, IDs holding the separator are kept whole
+    assert read(os.path.join(outputs['1'], FIMO_TSV_NAME)) == (
+        HEADER + 'M1\tS-1\ts1|x\t5\t12\t-\t11\t2e-05\t\tTTTTACGT\n' + COMMENTS)
+    assert read(os.path.join(outputs['3'], FIMO_TSV_NAME)) == HEADER + COMMENTS
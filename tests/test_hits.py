@@ -0,0 +1,75 @@
+import io
+import math
+import os
+
+import pandas as pd
+
+from memetools.hits import HIT_SCHEMA, HitsWriter, iter_hit_chunks
+
+FIMO_TSV = ('motif_id\tmotif_alt_id\tsequence_name\tstart\tstop\tstrand\tscore\tp-value\tq-value\tmatched_sequence\n'
+            'M1\tS-1\tseq1\t3\t10\t+\t12.5\t1e-06\t0.001\tACGTACGT\n'
+            'M1\tS-1\tseq#2\t5\t12\t-\t11\t2e-05\t0.2\tTTTTACGT\n'
+            'M2\tS-2\tseq3\t1\t8\t+\t10\t3e-04\t\tACGTACGA\n'
+            'M2\tS-2\tseq4\t7\t14\t+\t9.5\t5e-04\t0.3\tACGTACGC\n'
+            '\n'
+            '# FIMO (Find Individual Motif Occurrences): Version 5.5.7\n'
+            '# The format of this file is described at https://meme-suite.org/meme/doc/fimo-output-format.html.\n')
+
+
+class MemoryDataset(object):
+    """Stand-in for dataiku.Dataset keeping the written DataFrames."""
+
+    name = 'hits'
+
+    def __init__(self):
+        self.schema = None
+        self.frames = []
+        self.closed = False
+
+    def write_schema(self, schema):
+        self.schema = schema
+
+    def get_writer(self):
+        return self
+
+    def write_dataframe(self, df):
+        self.frames.append(df.copy())
+
+    def close(self):
+        self.closed = True
+
+    def dataframe(self):
+        return pd.concat(self.frames, ignore_index=True)
+
+
+def tsv_stream():
+    return io.BytesIO(FIMO_TSV.encode('utf-8'))
+
+
+def test_chunks_are_typed_and_skip_comments():
+    chunks = list(iter_hit_chunks(tsv_stream(), chunk_rows=3))
+    hits = pd.concat(chunks, ignore_index=True)
+    assert list(hits['sequence_name']) == ['seq1', 'seq#2', 'seq3', 'seq4']
+    assert hits['start'].dtype == 'int64' and hits['p_value'].dtype == 'float64'
+    assert math.isnan(hits['q_value'][2])
+    assert all(len(chunk) <= 3 for chunk in chunks)
+
+
+def test_filters_keep_hits_without_qvalue():
+    hits = pd.concat(iter_hit_chunks(tsv_stream(), max_pvalue=4e-4, max_qvalue=0.1), ignore_index=True)
+    assert list(hits['sequence_name']) == ['seq1', 'seq3']
+
+
+def test_writer_adds_pair_columns(tmp_path):
+    dataset = MemoryDataset()
+    with HitsWriter(dataset, max_pvalue=1e-4, chunk_rows=1) as writer:
+        assert writer.write_tsv(tsv_stream(), 'S1', 'S2') == 2
+        path = os.path.join(str(tmp_path), 'fimo.tsv')
+        with open(path, 'w') as f:
+            f.write(FIMO_TSV)
+        assert writer.write_tsv(path, 'S1', 'S3') == 2
+    assert dataset.closed and writer.rows == 4
+    hits = dataset.dataframe()
+    assert list(hits.columns) == [column['name'] for column in dataset.schema] == [column['name'] for column in HIT_SCHEMA]
+    assert list(zip(hits['sample'], hits['target'], hits['sequence_name'])) == [
+        ('S1', 'S2', 'seq1'), ('S1', 'S2', 'seq#2'), ('S1', 'S3', 'seq1'), ('S1', 'S3', 'seq#2')]
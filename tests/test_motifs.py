@@ -0,0 +1,74 @@
+import io
+
+import numpy as np
+import pytest
+
+from memetools.motifs import MotifSet, parse_meme, write_meme
+
+DNA_LIKE = """MEME version 5.5.7
+
+ALPHABET "DNA" DNA-LIKE
+A "Adenine" CC0000 ~ T "Thymine" 008000
+C "Cytosine" 0000CC ~ G "Guanine" FFB300
+N "Any base" = ACGT
+X = ACGT
+. = ACGT
+V "Not T" = ACG
+H "Not G" = ACT
+D "Not C" = AGT
+B "Not A" = CGT
+M "Amino" = AC
+R "Purine" = AG
+W "Weak" = AT
+S "Strong" = CG
+Y "Pyrimidine" = CT
+K "Keto" = GT
+U = T
+END ALPHABET
+
+strands: + -
+
+Background letter frequencies
+A 0.3 C 0.2 G 0.2 T 0.3
+
+MOTIF 1-ACGT STREME-1
+letter-probability matrix: alength= 4 w= 2 nsites= 12 E= 2.0e-003
+ 0.700000 0.100000 0.100000 0.100000
+ 0.100000 0.100000 0.100000 0.700000
+
+"""
+
+
+def test_alphabet_block_with_complements():
+    motifs = parse_meme(DNA_LIKE, 'sample')
+    assert motifs.alphabet == 'ACGT'
+    np.testing.assert_allclose(motifs.backgrounds[0], [0.3, 0.2, 0.2, 0.3])
+    assert motifs.matrix(0)[0, 0] == pytest.approx(0.7)
+
+
+def test_alphabet_block_symbol_order():
+    text = DNA_LIKE.replace('A "Adenine" CC0000 ~ T "Thymine" 008000\nC "Cytosine" 0000CC ~ G "Guanine" FFB300',
+                            'T ~ A\nG "Guanine" ~ C "Cytosine"')
+    assert parse_meme(text).alphabet == 'ACGT'
+
+
+def test_alphabet_block_without_complements():
+    text = 'MEME version 5\n\nALPHABET "Custom"\nB "Bee"\n2\nA\nZ = AB\nEND ALPHABET\n\n' \
+           'MOTIF 1\nletter-probability matrix: alength= 3 w= 1\n 0.5 0.25 0.25\n'
+    assert parse_meme(text).alphabet == 'AB2'
+
+
+def test_write_and_parse_round_trip():
+    motifs = parse_meme(DNA_LIKE, 'sample')
+    stream = io.StringIO()
+    write_meme(motifs, stream)
+    parsed = parse_meme(stream.getvalue(), 'sample')
+    assert parsed.ids == motifs.ids
+    np.testing.assert_allclose(parsed.probabilities, motifs.probabilities)
+
+
+def test_concatenate_rejects_mixed_alphabets():
+    text = DNA_LIKE.replace('ALPHABET "DNA" DNA-LIKE', 'ALPHABET "RNA" RNA-LIKE').replace('~ T "Thymine"', '~ U "Uracil"') \
+        .replace('U = T', 'T = U')
+    with pytest.raises(ValueError):
+        MotifSet.concatenate([parse_meme(DNA_LIKE), parse_meme(text)])
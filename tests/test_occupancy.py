@@ -0,0 +1,58 @@
+import io
+
+import numpy as np
+
+from memetools.occupancy import OccupancyMatrix, summarize_fimo_tsv
+
+HEADER = 'motif_id\tmotif_alt_id\tsequence_name\tstart\tstop\tstrand\tscore\tp-value\tq-value\tmatched_sequence\n'
+
+
+def fimo_tsv(*hits):
+    """A fimo.tsv stream from (motif_id, score, p-value) hits."""
+    lines = [f"{motif_id}\tSTREME-{motif_id}\tseq{index}\t1\t8\t+\t{score}\t{pvalue}\t\tACGTACGT\n"
+             for index, (motif_id, score, pvalue) in enumerate(hits)]
+    return io.BytesIO((HEADER + ''.join(lines) + '\n# FIMO\n').encode('utf-8'))
+
+
+def test_summary_merges_chunks():
+    summary = summarize_fimo_tsv(fimo_tsv(('M1', 10, 1e-5), ('M2', 8, 1e-4), ('M1', 12, 1e-6), ('M1', 9, 2e-5)),
+                                 chunk_rows=1)
+    assert summary.to_dict('list') == {'motif_id': ['M1', 'M2'], 'motif_alt_id': ['STREME-M1', 'STREME-M2'],
+                                       'count': [3, 1], 'best_score': [12.0, 8.0], 'min_pvalue': [1e-6, 1e-4]}
+    assert summarize_fimo_tsv(fimo_tsv()).empty
+
+
+def test_pairs_replace_their_cells():
+    matrix = OccupancyMatrix()
+    matrix.add_fimo_tsv(fimo_tsv(('M1', 10, 1e-5), ('M2', 8, 1e-4)), 'S1', 'T2')
+    matrix.add_fimo_tsv(fimo_tsv(('M1', 11, 1e-5)), 'S2', 'T1')
+    matrix.add_fimo_tsv(fimo_tsv(('M1', 9, 1e-5)), 'S1', 'T3')
+    assert matrix.cells()['rows'].tolist() == [0, 0, 1, 2]
+    # A recomputed pair replaces all of its cells, other pairs are left as they were
+    matrix.add_fimo_tsv(fimo_tsv(('M2', 7, 1e-4), ('M2', 6, 2e-4)), 'S1', 'T2')
+    matrix.add_fimo_tsv(fimo_tsv(), 'S1', 'T3')
+
+    assert matrix.targets == ['T2', 'T1', 'T3']
+    assert list(zip(matrix.motif_samples, matrix.motif_ids)) == [(0, 'M1'), (0, 'M2'), (1, 'M1')]
+    np.testing.assert_array_equal(matrix.to_dense(), [[0, 2, 0], [0, 0, 1], [0, 0, 0]])
+    np.testing.assert_array_equal(matrix.to_dense('best_score'),
+                                  [[np.nan, 7, np.nan], [np.nan, np.nan, 11], [np.nan, np.nan, np.nan]])
+    assert matrix.has_pair('S1', 'T3') and not matrix.has_pair('S2', 'T2')
+
+
+def test_save_load_and_retain_pairs():
+    matrix = OccupancyMatrix()
+    matrix.add_fimo_tsv(fimo_tsv(('M1', 10, 1e-5)), 'S1', 'T2')
+    matrix.add_fimo_tsv(fimo_tsv(('M1', 11, 1e-6)), 'S2', 'T1')
+    stream = io.BytesIO()
+    matrix.save(stream)
+    stream.seek(0)
+
+    loaded = OccupancyMatrix.load(stream)
+    assert loaded.shape == matrix.shape
+    np.testing.assert_array_equal(loaded.to_dense('min_pvalue'), matrix.to_dense('min_pvalue'))
+    # An incremental run updates the loaded matrix, then drops the pairs of removed samples
+    loaded.add_fimo_tsv(fimo_tsv(('M1', 12, 1e-7), ('M1', 9, 1e-5)), 'S1', 'T2')
+    loaded.retain_pairs([('S1', 'T2')])
+    np.testing.assert_array_equal(loaded.to_dense(), [[2, 0], [0, 0]])
+    assert not loaded.has_pair('S2', 'T1')
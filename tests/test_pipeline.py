@@ -0,0 +1,86 @@
+import concurrent.futures
+import threading
+import time
+
+import pytest
+
+from memetools.pipeline import PipelinedExecutor
+from memetools.scheduler import JobCost
+
+
+def square(value):
+    return value * value
+
+
+class ThreadRunner(object):
+    """Stand-in for CommandRunner running callables in threads, recording how many jobs run at once."""
+
+    def __init__(self, max_concurrency):
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency)
+        self.lock = threading.Lock()
+        self.running = set()
+        self.snapshots = []
+
+    def submit(self, command):
+        return self.pool.submit(self._run, command)
+
+    def _run(self, command):
+        name, func = command
+        with self.lock:
+            self.running.add(name)
+            self.snapshots.append(frozenset(self.running))
+        try:
+            time.sleep(0.05)
+            return func()
+        finally:
+            with self.lock:
+                self.running.discard(name)
+
+
+def test_every_stage_runs_in_order():
+    uploaded = []
+    executor = PipelinedExecutor(square, download=lambda job: job + 1, upload=uploaded.append, max_workers=2,
+                                 transfer_workers=2)
+    assert sorted(executor.run(range(6))) == list(range(6))
+    assert sorted(uploaded) == [(job + 1) ** 2 for job in range(6)]
+
+
+def test_bypass_skips_the_process_stage():
+    uploaded = []
+    executor = PipelinedExecutor(square, download=lambda job: -job, upload=uploaded.append,
+                                 bypass=lambda value: value < -2)
+    executor.run(range(5))
+    assert sorted(uploaded) == [-4, -3, 0, 1, 4]
+
+
+def test_failure_stops_admitting_jobs():
+    processed, uploaded = [], []
+
+    def process(job):
+        def run():
+            processed.append(job)
+            if job == 1:
+                raise ValueError('boom')
+            return job
+        return job, run
+
+    runner = ThreadRunner(1)
+    executor = PipelinedExecutor(process, upload=uploaded.append, max_in_flight=1, runner=runner)
+    with pytest.raises(RuntimeError, match=r'1 \(process\): boom'):
+        executor.run(range(10), describe=str)
+    assert processed == [0, 1]
+    assert uploaded == [0]
+
+
+def test_memory_budget_limits_concurrent_jobs():
+    memory = {'a': 6, 'b': 5, 'c': 4, 'd': 3, 'e': 2, 'huge': 20}
+    runner = ThreadRunner(4)
+    executor = PipelinedExecutor(lambda job: (job, lambda: job), max_workers=4, runner=runner,
+                                 cost=lambda job: JobCost(memory[job], memory[job]), memory_budget=10)
+    assert sorted(executor.run(memory)) == sorted(memory)
+    for snapshot in runner.snapshots:
+        # A job over the budget runs alone
+        assert sum(memory[job] for job in snapshot) <= 10 or len(snapshot) == 1
+    assert max(len(snapshot) for snapshot in runner.snapshots) > 1
+    # Jobs are started by decreasing work
+    assert runner.snapshots[0] == {'huge'}
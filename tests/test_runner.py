@@ -0,0 +1,62 @@
+import logging
+import os
+import sys
+import time
+
+import pytest
+
+from memetools.runner import Command, CommandFailed, CommandRunner
+
+
+def python_command(code, **kwargs):
+    return Command([sys.executable, '-c', code], **kwargs)
+
+
+def test_results_and_stdout_file(tmp_path):
+    stdout_path = os.path.join(str(tmp_path), 'out.txt')
+    with CommandRunner(2) as runner:
+        results = runner.run_all([python_command("print('hello')", stdout_path=stdout_path, result='a'),
+                                  python_command("pass", result='b')])
+    assert results == ['a', 'b']
+    with open(stdout_path) as f:
+        assert f.read() == 'hello\n'
+
+
+def test_failure_reports_stderr_tail():
+    with CommandRunner() as runner:
+        with pytest.raises(CommandFailed, match='boom'):
+            runner.run_all([python_command("import sys; sys.stderr.write('boom\\n'); sys.exit(3)")])
+
+
+def test_timeout_kills_the_command():
+    start = time.perf_counter()
+    with CommandRunner(timeout=0.5) as runner:
+        with pytest.raises(CommandFailed, match='timed out'):
+            runner.run_all([Command(['sleep', '20'])])
+    assert time.perf_counter() - start < 10
+
+
+def test_close_kills_cancelled_and_running_commands(tmp_path):
+    pid_path = os.path.join(str(tmp_path), 'pids')
+    code = f"import os, time; open({pid_path!r} + str(os.getpid()), 'w').close(); time.sleep(20)"
+    runner = CommandRunner(2)
+    runner.start()
+    cancelled = runner.submit(python_command(code))
+    running = runner.submit(python_command(code))
+    while len([name for name in os.listdir(str(tmp_path)) if name.startswith('pids')]) < 2:
+        time.sleep(0.05)
+    cancelled.cancel()
+    start = time.perf_counter()
+    runner.close()
+    assert time.perf_counter() - start < 10
+    assert running.cancelled()
+    for name in os.listdir(str(tmp_path)):
+        with pytest.raises(ProcessLookupError):
+            os.kill(int(name[len('pids'):]), 0)
+
+
+def test_output_is_logged_at_info(caplog):
+    with caplog.at_level(logging.INFO, logger='memetools.runner'):
+        with CommandRunner() as runner:
+            runner.run_all([python_command("import sys; sys.stderr.write('progress 50%\\n')", description='job')])
+    assert '[job] progress 50%' in caplog.text
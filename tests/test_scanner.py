@@ -0,0 +1,142 @@
+import csv
+import itertools
+import os
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+from memetools.background import MarkovBackground
+from memetools.motifs import read_meme
+from memetools.scanner import MotifScanner, ScoredMotif, encode
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'scanner')
+MOTIFS = os.path.join(FIXTURES, 'streme.txt')
+SEQUENCES = os.path.join(FIXTURES, 'sequences.fasta')
+# Expected `fimo --text` hits, see make_fimo_tsv.py for how they were produced
+FIMO_TSV = os.path.join(FIXTURES, 'fimo.tsv')
+THRESHOLD = 1e-3
+
+
+def read_tsv(path):
+    """Hits of a fimo.tsv file by (motif_id, sequence_name, start, stop, strand), comments and q-values left out."""
+    with open(path) as f:
+        rows = [row for row in csv.DictReader((line for line in f if line.strip() and not line.startswith('#')),
+                                              delimiter='\t')]
+    return {(row['motif_id'], row['sequence_name'], int(row['start']), int(row['stop']), row['strand']):
+            (float(row['score']), float(row['p-value']), row['matched_sequence'].upper()) for row in rows}
+
+
+def read_sequences(path):
+    sequences = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('>'):
+                name = line[1:].split()[0]
+                sequences[name] = ''
+            else:
+                sequences[name] += line
+    return sequences
+
+
+def scan(tmp_path, **kwargs):
+    output = os.path.join(str(tmp_path), 'fimo.tsv')
+    MotifScanner(MOTIFS, threshold=THRESHOLD, **kwargs).write_tsv(SEQUENCES, output)
+    return read_tsv(output)
+
+
+def test_pvalues_match_enumeration():
+    motifs = read_meme(MOTIFS)
+    index = motifs.find('2-CCAATSR')
+    background = motifs.background(index)
+    scored = ScoredMotif(motifs.motif(index), background)
+    counts = {}
+    for word in itertools.product(range(4), repeat=scored.motif.width):
+        score = int(scored.forward[np.arange(len(word)), word].sum())
+        probability = float(np.prod(background[list(word)]))
+        counts[score] = counts.get(score, 0.0) + probability
+    for score in counts:
+        expected = sum(probability for other, probability in counts.items() if other >= score)
+        assert scored.pvalues[score] == pytest.approx(expected, rel=1e-9)
+
+
+def test_hits_match_window_by_window_scoring(tmp_path):
+    motifs = read_meme(MOTIFS)
+    expected = {}
+    for index in range(len(motifs)):
+        scored = ScoredMotif(motifs.motif(index), motifs.background(index))
+        width = scored.motif.width
+        for name, sequence in read_sequences(SEQUENCES).items():
+            codes = encode(sequence)
+            for position in range(len(sequence) - width + 1):
+                window = codes[position:position + width]
+                if (window == 4).any():
+                    continue
+                for strand, matrix in (('+', scored.forward), ('-', scored.reverse)):
+                    score = int(matrix[np.arange(width), window].sum())
+                    if scored.pvalues[score] <= THRESHOLD:
+                        expected[(scored.motif.id, name, position + 1, position + width, strand)] = scored.pvalues[score]
+    hits = scan(tmp_path)
+    assert set(hits) == set(expected)
+    for key, pvalue in expected.items():
+        assert hits[key][1] == pytest.approx(pvalue, rel=1e-2)
+
+
+def test_windows_with_ambiguous_letters_are_skipped(tmp_path):
+    sequence = read_sequences(SEQUENCES)['seq4']
+    for (_, name, start, stop, _), _ in scan(tmp_path).items():
+        if name == 'seq4':
+            assert 'N' not in sequence[start - 1:stop]
+
+
+def test_single_strand(tmp_path):
+    assert {key[4] for key in scan(tmp_path, both_strands=False)} == {'+'}
+
+
+def test_higher_order_background_is_rejected(tmp_path):
+    path = os.path.join(str(tmp_path), 'order1.bg')
+    with open(path, 'w') as f:
+        MarkovBackground.from_fasta([SEQUENCES], order=1).write(f)
+    with pytest.raises(ValueError):
+        MotifScanner(MOTIFS, background=path)
+
+
+def test_zero_order_background_file(tmp_path):
+    path = os.path.join(str(tmp_path), 'order0.bg')
+    with open(path, 'w') as f:
+        MarkovBackground.from_fasta([SEQUENCES], order=0).write(f)
+    scanner = MotifScanner(MOTIFS, background=path)
+    motifs = read_meme(MOTIFS)
+    expected = ScoredMotif(motifs.motif(0), MarkovBackground.read(path).zero_order())
+    np.testing.assert_allclose(scanner.motifs[0].pvalues, expected.pvalues)
+
+
+def assert_hits_match(hits, expected):
+    assert set(hits) == set(expected)
+    for key, (score, pvalue, matched) in expected.items():
+        assert hits[key][0] == pytest.approx(score, abs=0.01)
+        assert hits[key][1] == pytest.approx(pvalue, rel=0.01)
+        assert hits[key][2] == matched
+
+
+def test_hits_match_expected_fimo_output(tmp_path):
+    assert_hits_match(scan(tmp_path), read_tsv(FIMO_TSV))
+
+
+def fimo_executable():
+    return os.environ.get('FIMO_EXEC') or shutil.which('fimo')
+
+
+@pytest.mark.skipif(not fimo_executable(), reason="fimo executable not found, set FIMO_EXEC or put it on the PATH")
+def test_hits_match_fimo(tmp_path):
+    result = subprocess.run([fimo_executable(), '--text', '--thresh', str(THRESHOLD), '--bfile', '--motif--',
+                             MOTIFS, SEQUENCES], capture_output=True, text=True, check=True)
+    fimo_tsv = os.path.join(str(tmp_path), 'fimo_reference.tsv')
+    with open(fimo_tsv, 'w') as f:
+        f.write(result.stdout)
+    expected = read_tsv(fimo_tsv)
+    assert_hits_match(scan(tmp_path), expected)
+    # A failure here means fimo.tsv is out of date, regenerate it with make_fimo_tsv.py
+    assert_hits_match(read_tsv(FIMO_TSV), expected)
@@ -0,0 +1,22 @@
+import os
+
+from memetools.scheduler import count_sequences, estimate_sequences
+
+
+def write_fasta(path, records, length):
+    with open(path, 'w') as f:
+        for index in range(records):
+            f.write(f">seq{index}\n{'ACGT' * (length // 4)}\n")
+
+
+def test_estimate_is_exact_for_small_files(tmp_path):
+    path = os.path.join(str(tmp_path), 'small.fasta')
+    write_fasta(path, 10, 100)
+    assert estimate_sequences(path) == count_sequences(path) == 10
+
+
+def test_estimate_extrapolates_from_the_first_block(tmp_path):
+    path = os.path.join(str(tmp_path), 'large.fasta')
+    write_fasta(path, 2000, 200)
+    estimate = estimate_sequences(path, sample_size=4096)
+    assert abs(estimate - count_sequences(path)) <= 20
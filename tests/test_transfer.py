@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+
+import pytest
+
+from memetools.localfolder import LocalFolder
+from memetools.transfer import FolderTransfer
+
+
+class FlakyFolder(LocalFolder):
+    """LocalFolder whose uploads fail a number of times per path, and which records concurrent uploads."""
+
+    def __init__(self, root, failures=None, delay=0.0):
+        super(FlakyFolder, self).__init__(root)
+        self.failures = dict(failures or {})
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def upload_stream(self, path, f):
+        with self.lock:
+            if self.failures.get(path, 0) > 0:
+                self.failures[path] -= 1
+                raise IOError(f"upload of {path} failed")
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            super(FlakyFolder, self).upload_stream(path, f)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def local_files(tmp_path, count, size=1000):
+    directory = os.path.join(str(tmp_path), 'local')
+    os.makedirs(directory)
+    for index in range(count):
+        with open(os.path.join(directory, f"file_{index}.txt"), 'wb') as f:
+            f.write(b'x' * size)
+    return directory
+
+
+def test_upload_directory_stats(tmp_path):
+    directory = local_files(tmp_path, 5)
+    folder = FlakyFolder(os.path.join(str(tmp_path), 'folder'))
+    with FolderTransfer(folder, max_workers=3, link_local=False) as transfer:
+        transfer.upload_directory(directory, str(tmp_path))
+    assert folder.list_paths_in_partition() == [f"/local/file_{index}.txt" for index in range(5)]
+    assert (transfer.uploaded.files, transfer.uploaded.bytes, transfer.uploaded.retries) == (5, 5000, 0)
+
+
+def test_failed_uploads_are_retried(tmp_path):
+    directory = local_files(tmp_path, 3)
+    folder = FlakyFolder(os.path.join(str(tmp_path), 'folder'), failures={'/local/file_1.txt': 2})
+    with FolderTransfer(folder, max_workers=2, retry_delay=0, link_local=False) as transfer:
+        transfer.upload_directory(directory, str(tmp_path))
+    assert len(folder.list_paths_in_partition()) == 3
+    assert (transfer.uploaded.files, transfer.uploaded.retries) == (3, 2)
+
+
+def test_partial_failure(tmp_path):
+    directory = local_files(tmp_path, 4)
+    folder = FlakyFolder(os.path.join(str(tmp_path), 'folder'), failures={'/local/file_2.txt': 10})
+    with FolderTransfer(folder, max_workers=2, retries=1, retry_delay=0, link_local=False) as transfer:
+        with pytest.raises(IOError):
+            transfer.upload_directory(directory, str(tmp_path))
+    assert '/local/file_2.txt' not in folder.list_paths_in_partition()
+    assert transfer.uploaded.retries == 1
+
+
+def test_download_files(tmp_path):
+    folder = LocalFolder(os.path.join(str(tmp_path), 'folder'))
+    for index in range(4):
+        folder.upload_data(f"/P1/S{index}/S{index}.fasta", b'>a\nACGT\n')
+    local_root = os.path.join(str(tmp_path), 'local')
+    with FolderTransfer(folder, max_workers=2, link_local=False) as transfer:
+        paths = transfer.download_partition(local_root, 'P1')
+    assert sorted(paths) == [os.path.join(local_root, 'P1', f"S{index}", f"S{index}.fasta") for index in range(4)]
+    assert (transfer.downloaded.files, transfer.downloaded.bytes, transfer.downloaded.linked) == (4, 32, 0)
+
+
+def test_local_folder_files_are_linked(tmp_path):
+    folder = LocalFolder(os.path.join(str(tmp_path), 'folder'))
+    folder.upload_data('/P1/a.fasta', b'>a\nACGT\n')
+    with FolderTransfer(folder) as transfer:
+        transfer.download_files(['/P1/a.fasta'], os.path.join(str(tmp_path), 'local'))
+    assert (transfer.downloaded.linked, transfer.downloaded.bytes) == (1, 0)
+
+
+def test_concurrent_callers_share_the_pool(tmp_path):
+    directory = local_files(tmp_path, 12)
+    folder = FlakyFolder(os.path.join(str(tmp_path), 'folder'), delay=0.02)
+    names = sorted(os.listdir(directory))
+    with FolderTransfer(folder, max_workers=3, link_local=False) as transfer:
+        # Like the upload threads of a pipeline, each uploading the results of one job
+        callers = [threading.Thread(target=transfer.upload_files,
+                                    args=([(os.path.join(directory, name), f"/{caller}/{name}") for name in names],))
+                   for caller in range(4)]
+        for caller in callers:
+            caller.start()
+        for caller in callers:
+            caller.join()
+    assert len(folder.list_paths_in_partition()) == 48
+    assert folder.max_active <= 3
+
+
+def test_nested_calls_from_pool_threads_run_inline(tmp_path):
+    directory = local_files(tmp_path, 4)
+    folder = LocalFolder(os.path.join(str(tmp_path), 'folder'))
+    transfer = FolderTransfer(folder, max_workers=1, link_local=False)
+
+    def upload_twice(local_path, remote_path):
+        # Would wait forever on the single pool thread if it were submitted to the pool
+        transfer.upload_files([(local_path, remote_path), (local_path, remote_path + '.copy')])
+
+    with transfer:
+        transfer._run_all(upload_twice, [(os.path.join(directory, name), f"/{name}")
+                                         for name in sorted(os.listdir(directory))], "Uploaded", transfer.uploaded)
+    assert len(folder.list_paths_in_partition()) == 8